@@ -23,6 +23,8 @@ from TwoTensorModelVizLib.PolyDataLib import *
 from TwoTensorModelVizLib.LineRenderLib import *
 from TwoTensorModelVizLib.TensorRenderLib import *
 from TwoTensorModelVizLib.TubeRenderLib import *
+from TwoTensorModelVizLib.SceneLib import *
+from TwoTensorModelVizLib.PickLib import *
 
 from vtkSlicerPyOpenGLActorPython import *  
 
@@ -37,6 +39,8 @@ params['cylinderStacks']=1
 params['cylinderSlices']=10
 params['tubeSlices']=10
 
+sceneCache=SceneCache() # GPU copy of the scene drawn by DrawScene
+
 def InitGL():
     pass
     
@@ -44,60 +48,9 @@ def DrawScene(inpd,params):
     
     InitGL()
     
-    lineNum=int(params['lineNum'])
-    lineSpace=int(params['lineSpace'])
-    glyphSpace=int(params['glyphSpace'])
-    glyphScale=int(params['glyphScale'])
-    tubeScale=int(params['tubeScale'])
-    
-    tubeColorFlag=params['tubeColorFlag']
-    tubeSizeFlag=params['tubeSizeFlag']
-        
-    onlyOneLine=params['onlyOneLine']
-    showLines=params['showLines']
-    showTensor1=params['showTensor1']
-    showTensor2=params['showTensor2']
-    showTubes=params['showTubes']
+    # the scene is only rebuilt when inpd or the parameters change
+    sceneCache.Render(inpd,params)
     
-    if onlyOneLine:
-        
-        if showLines:
-            RenderLineWithSegmentOrientation(inpd,lineNum)
-            
-        if showTensor1:
-            RenderTensorWithCustomColors(inpd,lineNum, params,'tensor1',0)
-            
-        if showTensor2:
-            RenderTensorWithCustomColors(inpd,lineNum, params,'tensor2',1)
-            
-        if showTubes:
-            if tubeColorFlag==0:
-                RenderTubeWithFixedColor(inpd,lineNum,params)
-            elif tubeColorFlag==1:
-                RenderTubeWithOrientation(inpd,lineNum,params)
-            elif tubeColorFlag==2:
-                RenderTubeWithCustomColors(inpd,lineNum,params)
-                
-    else: # multiple lines
-        
-        for lidx in range(1,inpd.GetNumberOfLines()+1,lineSpace):
-            if showLines:
-                RenderLineWithSegmentOrientation(inpd,lidx)
-                
-            if showTensor1:
-                RenderTensorWithCustomColors(inpd,lidx, params,'tensor1',0)
-                
-            if showTensor2:
-                RenderTensorWithCustomColors(inpd,lidx, params,'tensor2',1)
-                
-            if showTubes:
-                if tubeColorFlag==0:
-                    RenderTubeWithFixedColor(inpd,lidx,params)
-                elif tubeColorFlag==1:
-                    RenderTubeWithOrientation(inpd,lidx,params)
-                elif tubeColorFlag==2:
-                    RenderTubeWithCustomColors(inpd,lidx,params)
-                    
     return
 #==============================================================================
 # TwoTensorModelViz 
@@ -189,6 +142,20 @@ class TwoTensorModelVizWidget:
     modelFormLayout.addRow("Glyph Scale:", self.sliderGlyphScale)
     self.sliderGlyphScale.connect('valueChanged(double)', \
          self.onGlyphScaleChanged)
+    
+    # ============Simplify Tolerance scroller=================
+    self.sliderDecimate = ctk.ctkSliderWidget()
+    self.sliderDecimate.decimals = 2
+    self.sliderDecimate.singleStep = 0.05
+    self.sliderDecimate.minimum=0
+    self.sliderDecimate.maximum=2
+    self.sliderDecimate.value=0
+    self.sliderDecimate.suffix=" mm"
+    self.sliderDecimate.toolTip="Lines and tubes drop the points within this distance of the simplified fiber; glyphs keep all points."
+    self.sliderDecimate.enabled = False
+    modelFormLayout.addRow("Simplify Tolerance:", self.sliderDecimate)
+    self.sliderDecimate.connect('valueChanged(double)', \
+         self.onDecimateChanged)
 
     modelGridLayout=qt.QGridLayout()
     modelFormLayout.addRow("View Items:",modelGridLayout)
@@ -261,6 +228,48 @@ class TwoTensorModelVizWidget:
     self.checkboxOnlyOneLine.checked=False
     self.checkboxOnlyOneLine.enabled=False
     filterFormLayout.addWidget(self.checkboxOnlyOneLine)
+    
+    # ============Region of interest selector===================
+    self.roiSelector = slicer.qMRMLNodeComboBox()
+    self.roiSelector.nodeTypes = ( ("vtkMRMLAnnotationROINode"), "" )
+    self.roiSelector.selectNodeUponCreation = True
+    self.roiSelector.addEnabled = True
+    self.roiSelector.removeEnabled = False
+    self.roiSelector.noneEnabled = True
+    self.roiSelector.showHidden = False
+    self.roiSelector.showChildNodeTypes = False
+    self.roiSelector.setMRMLScene( slicer.mrmlScene )
+    self.roiSelector.setToolTip( "Pick a region the shown fibers pass through." )
+    self.roiSelector.enabled = False
+    filterFormLayout.addRow("Region of Interest:", self.roiSelector)
+    self.roiSelector.connect('currentNodeChanged(vtkMRMLNode*)', \
+         self.onROISelect)
+    self.roiNode=None
+    self.roiObserver=None
+    
+    # ============Region of interest shape===================
+    self.roiShapeComboBox=qt.QComboBox()
+    self.roiShapeComboBox.addItems(["None","Sphere","Box", \
+         "Slab L-R","Slab P-A","Slab I-S"])
+    self.roiShapeComboBox.toolTip="Only fibers with a point in this shape of the region are shown."
+    self.roiShapeComboBox.enabled = False
+    filterFormLayout.addRow("Region Shape:", self.roiShapeComboBox)
+    self.roiShapeComboBox.connect('currentIndexChanged(int)', \
+         self.onROIShapeChanged)
+    
+    # ============Check Box for picking fibers==============
+    self.checkboxPick=qt.QCheckBox("Pick fibers under the mouse")
+    self.checkboxPick.toolTip="When checked, the fiber under the mouse in the 3D view becomes the specific fiber."
+    self.checkboxPick.checked=False
+    self.checkboxPick.enabled=False
+    filterFormLayout.addWidget(self.checkboxPick)
+    self.checkboxPick.connect('toggled(bool)', \
+         self.onPickToggled)
+    self.pickInteractor=None
+    self.pickObserver=None
+    
+    self.labelPick=qt.QLabel("")
+    filterFormLayout.addRow("Picked:", self.labelPick)
    
 # 
 # Cylinder Color Mapping Area
@@ -491,6 +500,7 @@ class TwoTensorModelVizWidget:
     self.modelSelector.enabled=enabled
     self.sliderGlyphSpace.enabled = enabled
     self.sliderGlyphScale.enabled = enabled
+    self.sliderDecimate.enabled = enabled
     self.sliderTubeScale.enabled = enabled
     self.checkboxLines.enabled=enabled
     self.checkboxTensor1.enabled=enabled
@@ -499,6 +509,9 @@ class TwoTensorModelVizWidget:
     self.checkboxOnlyOneLine.enabled=enabled
     self.sliderLineNum.enabled=enabled
     self.sliderLineSpace.enabled=enabled
+    self.roiSelector.enabled=enabled
+    self.roiShapeComboBox.enabled=enabled
+    self.checkboxPick.enabled=enabled
     
     self.applyButton.enabled = enabled
     self.clearButton.enabled = enabled
@@ -555,20 +568,84 @@ class TwoTensorModelVizWidget:
     self.bodRadioA1.checked=True    
     self.bodSliderA.value=255
     
+  # a displayed scene follows the sliders while they are dragged
   def onGlyphSpaceChanged(self,value):
     self.logic.glyphSpace=value;
+    self.logic.update()
     
   def onGlyphScaleChanged(self,value):
     self.logic.glyphScale=value;
+    self.logic.update()
+
+  def onDecimateChanged(self,value):
+    self.logic.decimateTolerance=value
+    self.logic.update()
 
   def onTubeScaleChanged(self,value):
     self.logic.tubeScale=value;
+    self.logic.update()
 
   def onLineNumChanged(self,value):
     self.logic.lineNum=value
+    self.logic.update()
 
   def onLineSpaceChanged(self,value):
     self.logic.lineSpace=value
+    self.logic.update()
+
+  # the shown fibers follow the region while it is dragged
+  def onROISelect(self,node):
+    if self.roiNode and self.roiObserver:
+        self.roiNode.RemoveObserver(self.roiObserver)
+    self.roiNode=node
+    self.roiObserver=None
+    if node:
+        self.roiObserver=node.AddObserver(vtk.vtkCommand.ModifiedEvent, \
+            self.onROIModified)
+    self.onROIModified()
+
+  def onROIModified(self,caller=None,event=None):
+    self.logic.SetROI(self.roiNode)
+    self.logic.update()
+
+  def onROIShapeChanged(self,index):
+    self.logic.roiType=['','sphere','box','slab','slab','slab'][index]
+    self.logic.roiSlabAxis=max(index-3,0)
+    self.logic.SetROI(self.roiNode)
+    self.logic.update()
+
+  # hovering a shown fiber makes it the specific fiber
+  def onPickToggled(self,checked):
+    if self.pickInteractor and self.pickObserver:
+        self.pickInteractor.RemoveObserver(self.pickObserver)
+    self.pickInteractor=None
+    self.pickObserver=None
+    self.labelPick.text=""
+    if checked:
+        self.pickInteractor=slicer.app.layoutManager().threeDWidget(0). \
+            threeDView().interactor()
+        self.pickObserver=self.pickInteractor.AddObserver( \
+            vtk.vtkCommand.MouseMoveEvent,self.onPickMouseMove)
+
+  def onPickMouseMove(self,caller,event):
+    x,y=caller.GetEventPosition()
+    pick=self.logic.Pick(x,y)
+    if pick is None:
+        return
+    text="fiber %d, point %d"%(pick.lineNum,pick.pointId)
+    if pick.glyphPointId is not None:
+        text+=", glyph %d"%pick.glyphPointId
+        for name,tensor in [('T1',pick.tensor1),('T2',pick.tensor2)]:
+            if tensor is not None:
+                text+="\n%s: %s"%(name,' '.join('%.3g'%v for v in tensor.flat))
+    self.labelPick.text=text
+    # with all fibers shown lineNum draws nothing, so the slider follows
+    # the fiber without an update that would render the scene again
+    if not self.logic.onlyOneLine and self.sliderLineNum.value!=pick.lineNum:
+        self.sliderLineNum.blockSignals(True)
+        self.sliderLineNum.value=pick.lineNum
+        self.sliderLineNum.blockSignals(False)
+        self.logic.lineNum=pick.lineNum
 
   def onLineColorRChanged(sel,value):
     pass
@@ -664,8 +741,15 @@ class TwoTensorModelVizLogic:
     self.glyphSpace=20
     self.glyphScale=2000
     self.tubeScale=5
+    self.decimateTolerance=0.0
     self.lineNum=1
     self.lineSpace=10
+    
+    # region of interest, see SelectROILineNums
+    self.roiType=''
+    self.roiCenter=(0.0,0.0,0.0)
+    self.roiRadius=(0.0,0.0,0.0)
+    self.roiSlabAxis=0
     self.showLines=True
     self.showTensor1=True
     self.showTensor2=True
@@ -700,11 +784,22 @@ class TwoTensorModelVizLogic:
     
     self.tubeColorFlag=0
     self.tubeSizeFlag=0
+    
+    self.displayedModel=None
+    
+    # renders the view while the scene is built in the background
+    self.buildTimer=qt.QTimer()
+    self.buildTimer.setInterval(50)
+    self.buildTimer.connect('timeout()',self.onBuildTimer)
   
   def apply(self):
     if not (self.inputFiberModel):
        return False
 
+    # the scene of the same model only updates the changed parts
+    if self.update():
+        return True
+
     if self.sactorCreated:
         self.clear()
         self.sactorCreated=False
@@ -713,27 +808,60 @@ class TwoTensorModelVizLogic:
     
     return True
 
+  def update(self):
+    if not (self.sactorCreated and self.displayedModel is self.inputFiberModel):
+       return False
+    
+    global inpd
+    inpd=self.inputFiberModel.GetPolyData()
+    self.SetParams()
+    self.renWin.Render()
+    self.WatchBuild()
+    return True
+
+  def WatchBuild(self):
+    if sceneCache.IsBuilding():
+       self.buildTimer.start()
+
+  def onBuildTimer(self):
+    if self.sactorCreated:
+       self.renWin.Render()
+    if not (self.sactorCreated and sceneCache.IsBuilding()):
+       self.buildTimer.stop()
+
+  def SetROI(self,roiNode):
+    # no region shows fibers everywhere
+    if not roiNode:
+       self.roiCenter=(0.0,0.0,0.0)
+       self.roiRadius=(1e30,1e30,1e30)
+       return
+    center=[0.0,0.0,0.0]
+    radius=[0.0,0.0,0.0]
+    roiNode.GetXYZ(center)
+    roiNode.GetRadiusXYZ(radius)
+    self.roiCenter=tuple(center)
+    self.roiRadius=tuple(radius)
+
+  def Pick(self,x,y):
+    # the fiber or glyph under the display position x,y of the 3D view,
+    # as drawn
+    if not (self.sactorCreated and self.displayedModel is self.inputFiberModel):
+       return None
+    origin,direction=GetPickRay(self.ren,x,y)
+    return GetFiberPicker(inpd,params).Pick(origin,direction, \
+       GetGlyphPicker(inpd,params))
+
   def clear(self):
+    sceneCache.Invalidate()
     if self.sactorCreated:  
        self.ren.RemoveActor(self.sactor)
        self.renWin.Render()
        del self.sactor
        self.sactorCreated=False
 
-  def Display(self):
-    global inpd
+  def SetParams(self):
     global params
-   
-    # Hide the original display object
-    dispModel=self.inputFiberModel.GetDisplayNode()    
-    dispModel.SetVisibility(False)
     
-    #=================================================
-    # Get the polydata
-    inpd=self.inputFiberModel.GetPolyData()
-    
-    #=================================================
-    # Set parameters for the rendering
     params['lineSpace']=self.lineSpace
     params['glyphSpace']=self.glyphSpace
     params['glyphScale']=self.glyphScale
@@ -743,9 +871,14 @@ class TwoTensorModelVizLogic:
     params['tubeMappedToName']=self.tubeMappedToName
     params['tubeColorFlag']=self.tubeColorFlag
     params['tubeSizeFlag']=self.tubeSizeFlag
+    params['decimateTolerance']=self.decimateTolerance
     
     params['lineNum']=self.lineNum
     params['onlyOneLine']=self.onlyOneLine
+    params['roiType']=self.roiType
+    params['roiCenter']=self.roiCenter
+    params['roiRadius']=self.roiRadius
+    params['roiSlabAxis']=self.roiSlabAxis
     params['showLines']=self.showLines
     params['showTensor1']=self.showTensor1
     params['showTensor2']=self.showTensor2
@@ -765,6 +898,23 @@ class TwoTensorModelVizLogic:
     params['bodGName']=self.bodGName
     params['bodBName']=self.bodBName
     params['bodAName']=self.bodAName
+
+  def Display(self):
+    global inpd
+    global params
+   
+    # Hide the original display object
+    dispModel=self.inputFiberModel.GetDisplayNode()    
+    dispModel.SetVisibility(False)
+    
+    #=================================================
+    # Get the polydata
+    inpd=self.inputFiberModel.GetPolyData()
+    self.displayedModel=self.inputFiberModel
+    
+    #=================================================
+    # Set parameters for the rendering
+    self.SetParams()
     
     #=================================================
     # Get the rendering objects from Slicer
@@ -785,4 +935,5 @@ class TwoTensorModelVizLogic:
     self.sactorCreated=True
    
     self.renWin.Render()
+    self.WatchBuild()
     
\ No newline at end of file
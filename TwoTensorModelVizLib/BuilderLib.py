@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It builds scene geometry in the background while the scene is drawn.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import threading
+import Queue
+
+#==============================================================================
+# SplitJobs(items,size)
+#    Split the list items into consecutive chunks of at most size items.
+#==============================================================================
+def SplitJobs(items,size):
+    items=list(items)
+    size=max(int(size),1)
+    return [items[i:i+size] for i in range(0,len(items),size)]
+
+#==============================================================================
+# ThreadBuilder()
+#    Run build(job) for a list of jobs on one worker thread. The results
+#    are collected in job order by the thread that draws, with GetResults.
+#    Start and Cancel drop the jobs of a previous build: its worker stops
+#    after the job it is running and its results are never returned.
+#==============================================================================
+def _RunJobs(build,jobs,cancelEvent,results):
+    for job in jobs:
+        if cancelEvent.is_set():
+            return
+        try:
+            result=build(job)
+        except Exception, e:
+            print 'Background build failed:',e
+            cancelEvent.set()
+            return
+        if cancelEvent.is_set():
+            return
+        results.put(result)
+
+class ThreadBuilder:
+    def __init__(self):
+        self.thread=None
+        self.cancelEvent=None
+        self.results=Queue.Queue()
+
+    def Start(self,build,jobs):
+        self.Cancel()
+        self.cancelEvent=threading.Event()
+        self.results=Queue.Queue()
+        self.thread=threading.Thread(target=_RunJobs, \
+            args=(build,jobs,self.cancelEvent,self.results))
+        self.thread.daemon=True
+        self.thread.start()
+
+    def Cancel(self):
+        if self.cancelEvent is not None:
+            self.cancelEvent.set()
+        self.cancelEvent=None
+        self.thread=None
+        self.results=Queue.Queue()
+
+    def IsRunning(self):
+        return (self.thread is not None and self.thread.is_alive()) or \
+            not self.results.empty()
+
+    def GetResults(self):
+        results=[]
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except Queue.Empty:
+                return results
@@ -0,0 +1,231 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It opens a fiber bundle file and loads its arrays only when they are used.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+import vtk
+from vtk.util import numpy_support
+
+from PolyDataLib import *
+from PolyDataFileLib import *
+from PolyDataFileLib import _ReadWithVTK
+from TensorLib import _TestDataFile
+
+DEFAULT_MEMORY_BUDGET=1<<30
+
+#==============================================================================
+# BundleArray
+#    Descriptor of a point array of a BundleView: its name, shape and
+#    attribute are known when the bundle is opened, the values are read
+#    from the file by GetValues and may be evicted again by the bundle.
+#==============================================================================
+class BundleArray:
+    def __init__(self,bundle,name,source,shape,attribute=None):
+        self.bundle=bundle
+        self.name=name
+        self.source=source
+        self.shape=shape
+        self.attribute=attribute
+        self.values=None
+
+    def GetNumberOfComponents(self):
+        return self.shape[1]
+
+    def GetNumberOfTuples(self):
+        return self.shape[0]
+
+    def IsLoaded(self):
+        return self.values is not None
+
+    def GetValues(self):
+        # native byte order, contiguous, (tuples,components)
+        return self.bundle._Load(self)
+
+    def Evict(self):
+        self.bundle._Evict(self)
+
+#==============================================================================
+# BundleView(filename,memoryBudget=DEFAULT_MEMORY_BUDGET)
+#    A .vtk or .vtp fiber bundle whose point arrays are BundleArray
+#    descriptors. Only the header of the file is read when it is opened;
+#    the lines and points are read once when first used, each array when
+#    its values are first asked for. Loaded arrays are kept in least
+#    recently used order, and the oldest are evicted as soon as they take
+#    more than memoryBudget bytes together, the array just loaded excepted.
+#==============================================================================
+class BundleView:
+    def __init__(self,filename,memoryBudget=DEFAULT_MEMORY_BUDGET):
+        self.filename=filename
+        self.memoryBudget=memoryBudget
+        self.file=ReadPolyDataFile(filename)
+        self.fiberIndex=None
+        self.loaded=OrderedDict()
+        self.arrays=OrderedDict()
+        arrays=self.file.pointArrays
+        for name in self.file.pointArrayNames:
+            # the loader or view, without running it
+            source=dict.__getitem__(arrays,name)
+            self.arrays[name]=BundleArray(self,name,source,arrays.shapes[name], \
+                self.file.pointAttributes.get(name))
+
+    def GetArrayNames(self,numComponents=None):
+        return [name for name,array in self.arrays.items() \
+            if numComponents is None or array.GetNumberOfComponents()==numComponents]
+
+    def GetArray(self,name):
+        # same lookup as ArrayRegistry: case insensitive, first one wins
+        for key,array in self.arrays.items():
+            if key.upper()==name.upper():
+                return array
+        return None
+
+    def GetValues(self,name):
+        array=self.GetArray(name)
+        return None if array is None else array.GetValues()
+
+    def GetFiberIndex(self):
+        if self.fiberIndex is None:
+            fiberIndex=self.file.GetFiberIndex()
+            fiberIndex.points=_NativeArray(fiberIndex.points)
+            self.fiberIndex=fiberIndex
+        return self.fiberIndex
+
+    def GetMemoryUsage(self):
+        return sum(self.loaded.values())
+
+    def SetMemoryBudget(self,memoryBudget):
+        self.memoryBudget=memoryBudget
+        self._Shrink(None)
+
+    def _Load(self,array):
+        if array.values is None:
+            source=array.source
+            if isinstance(source,Loader):
+                source=source()
+            array.values=_NativeArray(source).reshape(array.shape)
+            self.loaded[array.name]=array.values.nbytes
+            self._Shrink(array)
+        else:
+            # most recently used
+            self.loaded[array.name]=self.loaded.pop(array.name)
+        return array.values
+
+    def _Evict(self,array):
+        array.values=None
+        self.loaded.pop(array.name,None)
+
+    def _Shrink(self,keep):
+        for name in list(self.loaded.keys()):
+            if self.GetMemoryUsage()<=self.memoryBudget:
+                break
+            if keep is None or name!=keep.name:
+                self._Evict(self.arrays[name])
+
+    def ToPolyData(self,names):
+        # a vtkPolyData with the lines and the point arrays names only,
+        # sharing their memory with this view
+        fiberIndex=self.GetFiberIndex()
+        inpd=vtk.vtkPolyData()
+        points=vtk.vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(fiberIndex.points,deep=0))
+        inpd.SetPoints(points)
+        counts=np.diff(fiberIndex.offsets)
+        legacy=np.empty(counts.shape[0]+fiberIndex.pointIds.shape[0],dtype=np.int64)
+        heads=fiberIndex.offsets[:-1]+np.arange(counts.shape[0])
+        keep=np.ones(legacy.shape[0],dtype=bool)
+        keep[heads]=False
+        legacy[heads]=counts
+        legacy[keep]=fiberIndex.pointIds
+        lines=vtk.vtkCellArray()
+        lines.SetCells(counts.shape[0],numpy_support.numpy_to_vtkIdTypeArray( \
+            legacy.astype(numpy_support.ID_TYPE_CODE),deep=1))
+        inpd.SetLines(lines)
+
+        data=inpd.GetPointData()
+        for name in names:
+            array=self.GetArray(name)
+            if array is None:
+                continue
+            vtkArray=numpy_support.numpy_to_vtk(array.GetValues(),deep=0)
+            vtkArray.SetName(array.name)
+            if array.attribute=='TENSORS':
+                data.SetTensors(vtkArray)
+            else:
+                data.AddArray(vtkArray)
+        return inpd
+
+def _NativeArray(values):
+    return np.ascontiguousarray(values,dtype=values.dtype.newbyteorder('='))
+
+#==============================================================================
+# For Test
+#==============================================================================
+def _WriteZLibPolyData(inpd,filename):
+    writer=vtk.vtkXMLPolyDataWriter()
+    writer.SetInputData(inpd)
+    writer.SetFileName(filename)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.Write()
+
+#==============================================================================
+# BundleViewTest(filename=None)
+#    Open the bundle as .vtk and as compressed .vtp: only the arrays asked
+#    for are loaded, they equal what VTK reads, and a budget of one tensor
+#    array keeps only the last one used.
+#==============================================================================
+def BundleViewTest(filename=None):
+    if filename is None:
+        filename=_TestDataFile()
+    inpd=_ReadWithVTK(filename)
+    folder=tempfile.mkdtemp()
+    passed=True
+    try:
+        vtpFile=os.path.join(folder,'bundle.vtp')
+        _WriteZLibPolyData(inpd,vtpFile)
+        for bundleFile in [filename,vtpFile]:
+            bundle=BundleView(bundleFile)
+            print os.path.basename(bundleFile),'scalars:',bundle.GetArrayNames(1)
+            same=not any(bundle.GetArray(name).IsLoaded() \
+                for name in bundle.GetArrayNames())
+            fa=bundle.GetValues('fa1')
+            same=same and bundle.loaded.keys()==['FA1'] and np.array_equal(fa, \
+                numpy_support.vtk_to_numpy(inpd.GetPointData().GetArray('FA1')). \
+                reshape(fa.shape))
+            print 'one scalar loaded:','yes' if same else 'NO'
+
+            tensorBytes=bundle.GetValues('tensor1').nbytes
+            bundle.SetMemoryBudget(tensorBytes)
+            tensor2=bundle.GetValues('tensor2')
+            evicted=bundle.loaded.keys()==['tensor2'] and \
+                not bundle.GetArray('tensor1').IsLoaded() and \
+                bundle.GetMemoryUsage()<=tensorBytes
+            evicted=evicted and np.array_equal(tensor2, \
+                numpy_support.vtk_to_numpy(inpd.GetPointData().GetArray('tensor2')))
+            print 'least recently used evicted:','yes' if evicted else 'NO'
+
+            view=bundle.ToPolyData(['tensor1','FA1'])
+            same=same and view.GetPointData().GetNumberOfArrays()==2 and \
+                np.array_equal(BuildFiberIndex(view).pointIds, \
+                    BuildFiberIndex(inpd).pointIds)
+            passed=passed and same and evicted
+    finally:
+        shutil.rmtree(folder)
+    return passed
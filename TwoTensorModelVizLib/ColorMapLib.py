@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It maps point arrays to uint8 RGBA colors with lookup tables.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import time
+
+import numpy as np
+
+from PolyDataLib import *
+from PolyDataLib import _GetCachedObject
+from TensorLib import _TestDataFile
+
+#==============================================================================
+# GetColorTable(size=256,complement=False)
+#    uint8 levels of a linear map with size entries: entry i is the level
+#    floor(255*i/(size-1)), the complementary table is the same reversed.
+#    With 256 entries entry i is level i, so a lookup gives exactly the
+#    truncated 255*(value-min)/(max-min).
+#==============================================================================
+_colorTables={}
+
+def GetColorTable(size=256,complement=False):
+    key=(size,complement)
+    if key not in _colorTables:
+        table=(np.arange(size,dtype=np.int64)*255//(size-1)).astype(np.uint8)
+        if complement:
+            table=table[::-1].copy()
+        _colorTables[key]=table
+    return _colorTables[key]
+
+#==============================================================================
+# MapToIndex(values,vmin,vmax,size=256)
+#    values: numpy array, [vmin,vmax] the range mapped onto a table of size
+#    entries. Return the table position of each value, uint8 or uint16;
+#    values out of the range (and NaN) are clamped, and min==max maps
+#    everything to the first entry instead of dividing by zero.
+#==============================================================================
+def MapToIndex(values,vmin,vmax,size=256):
+    last=size-1
+    span=vmax-vmin
+    if span==0:
+        span=1.0
+    t=values-vmin
+    t*=last
+    t/=span
+    np.fmax(t,0,out=t)
+    np.fmin(t,last,out=t)
+    return t.astype(np.uint8 if size<=256 else np.uint16)
+
+def MapToLevels(values,vmin,vmax,table):
+    return np.take(table,MapToIndex(values,vmin,vmax,table.shape[0]))
+
+#==============================================================================
+# GetColorIndex(inpd,name,size=256)
+#    MapToIndex of the whole point array name over its range, computed once
+#    and kept until the array is modified; colors of any points and tables
+#    are then two lookups, without arithmetic.
+#==============================================================================
+_colorIndexCache={}
+
+def _BuildColorIndex(inpd,name,size):
+    registry=GetArrayRegistry(inpd)
+    vmin,vmax=GetMinMaxInArray(registry.GetPointArray(name))
+    return MapToIndex(registry.GetPointValues(name),vmin,vmax,size)
+
+def GetColorIndex(inpd,name,size=256):
+    array=GetPointArrayByName(inpd,name)
+    key=(array.GetAddressAsString('vtkDataArray'),size)
+    return _GetCachedObject(_colorIndexCache,key,array.GetMTime(), \
+        _BuildColorIndex,inpd,name,size,maxEntries=32)
+
+#==============================================================================
+# CalBodyColors(inpd,params,pids,mode=0,lutSize=256)
+#    (M,4) uint8 colors of the points pids from the bod?Flag, bod?Value and
+#    bod?Name params of the channels R,G,B,A: a fixed channel is bod?Value,
+#    a mapped one (flag 1) is bod?Name looked up in a table of lutSize
+#    entries over the range of that array (see GetColorIndex). mode 1 takes
+#    the complementary rgb colors, from complemented tables.
+#==============================================================================
+def CalBodyColors(inpd,params,pids,mode=0,lutSize=256):
+    rgba=np.empty((pids.shape[0],4),dtype=np.uint8)
+    for k,c in enumerate('RGBA'):
+        complement=mode==1 and k<3
+        if params['bod'+c+'Flag']==0:
+            level=int(min(max(params['bod'+c+'Value'],0),255))
+            rgba[:,k]=255-level if complement else level
+        else:
+            index=GetColorIndex(inpd,params['bod'+c+'Name'],lutSize)
+            rgba[:,k]=np.take(GetColorTable(lutSize,complement),index[pids])
+    return rgba
+
+#==============================================================================
+# For Test
+#==============================================================================
+def _FloatBodyColors(inpd,params,pids,mode=0):
+    # the mapping CalBodyColors replaces
+    rgbaBody=np.empty((pids.shape[0],4))
+    for k,c in enumerate('RGBA'):
+        if params['bod'+c+'Flag']==0:
+            rgbaBody[:,k]=params['bod'+c+'Value']
+        else:
+            array=GetPointArrayByName(inpd,params['bod'+c+'Name'])
+            vmin,vmax=GetMinMaxInArray(array)
+            values=GetArrayRegistry(inpd).GetPointValues(params['bod'+c+'Name'])
+            span=vmax-vmin
+            if span==0:
+                span=1.0
+            rgbaBody[:,k]=255*(values[pids]-vmin)/span
+    if mode==1:
+        rgbaBody[:,:3]=255-rgbaBody[:,:3]
+    return np.clip(rgbaBody,0,255).astype(np.uint8)
+
+def _BodyParams(names):
+    params={}
+    for c,name in zip('RGBA',names):
+        params['bod'+c+'Flag']=0 if name is None else 1
+        params['bod'+c+'Value']=200
+        params['bod'+c+'Name']=name
+    return params
+
+#==============================================================================
+# ColorMapTest(filename=None)
+#    The 256 entry tables must give the float mapping exactly, the 4096
+#    entry and complementary ones within one level; a constant array maps
+#    to level 0.
+#==============================================================================
+def ColorMapTest(filename=None):
+    if filename is None:
+        filename=_TestDataFile()
+    inpd=LoadPolyData(filename)
+    pids=np.arange(inpd.GetNumberOfPoints())
+    params=_BodyParams(['FA1','FA2','FreeWater',None])
+
+    expected=_FloatBodyColors(inpd,params,pids)
+    passed=np.array_equal(CalBodyColors(inpd,params,pids),expected)
+    print '256 entries:','identical' if passed else 'DIFFERENT'
+    for lutSize,mode in [(4096,0),(256,1),(4096,1)]:
+        diff=np.abs(CalBodyColors(inpd,params,pids,mode,lutSize).astype(int)- \
+            _FloatBodyColors(inpd,params,pids,mode)).max()
+        print '%d entries, mode %d: max difference %d'%(lutSize,mode,diff)
+        passed=passed and diff<=1
+
+    constant=np.full(10,0.5,dtype=np.float32)
+    levels=MapToLevels(constant,0.5,0.5,GetColorTable())
+    same=np.array_equal(levels,np.zeros(10,dtype=np.uint8))
+    print 'constant array:','clamped' if same else 'NOT CLAMPED'
+    return passed and same
+
+#==============================================================================
+# ColorMapBenchmark(filename=None,repeat=20)
+#    Time the float mapping against the table lookups for the points of
+#    the test data taken repeat times over.
+#==============================================================================
+def ColorMapBenchmark(filename=None,repeat=20):
+    if filename is None:
+        filename=_TestDataFile()
+    inpd=LoadPolyData(filename)
+    pids=np.tile(np.arange(inpd.GetNumberOfPoints()),repeat)
+    params=_BodyParams(['FA1','FA2','FreeWater',None])
+    print 'points:',pids.shape[0]
+    for label,function in [ \
+        ('float',lambda: _FloatBodyColors(inpd,params,pids)), \
+        ('256 entries',lambda: CalBodyColors(inpd,params,pids)), \
+        ('4096 entries',lambda: CalBodyColors(inpd,params,pids,0,4096))]:
+        best=None
+        for i in range(3):
+            t=time.time()
+            function()
+            t=time.time()-t
+            best=t if best is None else min(best,t)
+        print '%s: %.4f s'%(label,best)
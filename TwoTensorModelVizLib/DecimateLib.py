@@ -0,0 +1,195 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It simplifies the fibers to fewer points for the lines and tubes.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import time
+
+import numpy as np
+
+from PolyDataLib import *
+from PolyDataLib import _GetCachedObject,_FiberIndexKey
+from TensorLib import _TestDataFile
+from SpatialIndexLib import ConcatRanges
+
+def _SegmentDistances(p,a,b):
+    # distances of the points p to the segments a-b, row by row
+    ab=b-a
+    ap=p-a
+    c=np.square(ab).sum(axis=1)
+    c[c==0]=1.0
+    s=np.clip((ap*ab).sum(axis=1)/c,0,1)
+    return np.sqrt(np.square(ap-s[:,np.newaxis]*ab).sum(axis=1))
+
+#==============================================================================
+# DecimateLines(positions,counts,tolerance)
+#    Douglas-Peucker simplification of lines stored one after another,
+#    counts points each: a boolean mask of the points kept, such that every
+#    point dropped is within tolerance of the segment between the kept
+#    points around it. The ends of the lines are always kept.
+#    All spans of all lines are split together, so numpy works across
+#    lines and the Python loop only runs over the depth of the splits.
+#==============================================================================
+def DecimateLines(positions,counts,tolerance):
+    counts=np.asarray(counts,dtype=np.int64)
+    ends=np.cumsum(counts)
+    starts=ends-counts
+    keep=np.zeros(int(ends[-1]) if ends.shape[0]>0 else 0,dtype=bool)
+    used=counts>0
+    keep[starts[used]]=True
+    keep[ends[used]-1]=True
+
+    lower=starts[counts>2]
+    upper=ends[counts>2]-1
+    while lower.shape[0]>0:
+        sizes=upper-lower-1
+        inner=ConcatRanges(lower+1,upper)
+        span=np.repeat(np.arange(lower.shape[0]),sizes)
+        distances=_SegmentDistances(positions[inner], \
+            positions[lower[span]],positions[upper[span]])
+
+        # the first point of each span farthest from its segment
+        firsts=np.cumsum(sizes)-sizes
+        farthest=np.maximum.reduceat(distances,firsts)
+        candidates=np.where(distances==farthest[span],np.arange(inner.shape[0]), \
+            inner.shape[0])
+        split=inner[np.minimum.reduceat(candidates,firsts)]
+
+        far=farthest>tolerance
+        split=split[far]
+        keep[split]=True
+        lower=np.concatenate([lower[far],split])
+        upper=np.concatenate([split,upper[far]])
+        wide=upper-lower>1
+        lower=lower[wide]
+        upper=upper[wide]
+    return keep
+
+#==============================================================================
+# BuildDecimatedFiberIndex(fiberIndex,tolerance)
+#    FiberIndex of the points of fiberIndex that DecimateLines keeps, with
+#    the same lines and points.
+#==============================================================================
+def BuildDecimatedFiberIndex(fiberIndex,tolerance):
+    counts=np.diff(fiberIndex.offsets)
+    positions=fiberIndex.points[fiberIndex.pointIds].astype(np.float64)
+    keep=DecimateLines(positions,counts,tolerance)
+    lines=np.repeat(np.arange(counts.shape[0]),counts)
+    offsets=np.zeros(fiberIndex.offsets.shape[0],dtype=fiberIndex.offsets.dtype)
+    offsets[1:]=np.cumsum(np.bincount(lines[keep],minlength=counts.shape[0]))
+    return FiberIndex(offsets,fiberIndex.pointIds[keep],fiberIndex.points)
+
+#==============================================================================
+# GetDecimatedFiberIndex(inpd,tolerance)
+#    The FiberIndex of inpd simplified within tolerance (mm), built once
+#    for each tolerance and kept until the lines or points change; a
+#    tolerance of 0 is the FiberIndex itself.
+# GetRenderFiberIndex(inpd,params)
+#    The same for the decimateTolerance param, for the lines and tubes.
+#    Glyphs are still placed on the points of GetFiberIndex.
+#==============================================================================
+_decimatedIndexCache={}
+
+def GetDecimatedFiberIndex(inpd,tolerance):
+    tolerance=float(tolerance)
+    if tolerance<=0:
+        return GetFiberIndex(inpd)
+    key,mtime=_FiberIndexKey(inpd)
+    return _GetCachedObject(_decimatedIndexCache,(key,tolerance),mtime, \
+        _BuildDecimatedFiberIndex,inpd,tolerance,maxEntries=4)
+
+def _BuildDecimatedFiberIndex(inpd,tolerance):
+    return BuildDecimatedFiberIndex(GetFiberIndex(inpd),tolerance)
+
+def GetRenderFiberIndex(inpd,params):
+    return GetDecimatedFiberIndex(inpd,params.get('decimateTolerance',0))
+
+#==============================================================================
+# For Test
+#==============================================================================
+def _DecimateLine(positions,tolerance):
+    # the recursive Douglas-Peucker of one line
+    keep=np.zeros(positions.shape[0],dtype=bool)
+    if positions.shape[0]==0:
+        return keep
+    keep[0]=keep[-1]=True
+    spans=[(0,positions.shape[0]-1)]
+    while spans:
+        lower,upper=spans.pop()
+        if upper-lower<2:
+            continue
+        inner=np.arange(lower+1,upper)
+        distances=_SegmentDistances(positions[inner], \
+            positions[[lower]*inner.shape[0]],positions[[upper]*inner.shape[0]])
+        k=int(np.argmax(distances))
+        if distances[k]>tolerance:
+            keep[inner[k]]=True
+            spans+=[(lower,inner[k]),(inner[k],upper)]
+    return keep
+
+def _MaxDeviation(positions,counts,keep):
+    # largest distance of a dropped point to its simplified segment
+    rows=np.arange(keep.shape[0])
+    kept=rows[keep]
+    dropped=rows[~keep]
+    if dropped.shape[0]==0:
+        return 0.0
+    after=np.searchsorted(kept,dropped)
+    return _SegmentDistances(positions[dropped],positions[kept[after-1]], \
+        positions[kept[after]]).max()
+
+#==============================================================================
+# DecimateTest(filename=None,tolerances=[0.1,0.25,0.5,1.0])
+#    The vectorized simplification must keep the points the recursive one
+#    keeps on every line, drop no point farther than the tolerance and keep
+#    the ends; print the reduction of the vertices of the test data.
+#==============================================================================
+def DecimateTest(filename=None,tolerances=[0.1,0.25,0.5,1.0]):
+    if filename is None:
+        filename=_TestDataFile()
+    inpd=LoadPolyData(filename)
+    fiberIndex=GetFiberIndex(inpd)
+    counts=np.diff(fiberIndex.offsets)
+    positions=fiberIndex.points[fiberIndex.pointIds].astype(np.float64)
+    passed=True
+    for tolerance in tolerances:
+        keep=DecimateLines(positions,counts,tolerance)
+        expected=np.concatenate([_DecimateLine(positions[start:end],tolerance) \
+            for start,end in zip(fiberIndex.offsets[:-1],fiberIndex.offsets[1:])])
+        same=np.array_equal(keep,expected) and \
+            _MaxDeviation(positions,counts,keep)<=tolerance
+        decimated=GetDecimatedFiberIndex(inpd,tolerance)
+        for lineNum in [1,decimated.GetNumberOfLines()]:
+            ids=fiberIndex.GetLinePointIds(lineNum)
+            simplified=decimated.GetLinePointIds(lineNum)
+            same=same and simplified[0]==ids[0] and simplified[-1]==ids[-1]
+        same=same and GetDecimatedFiberIndex(inpd,tolerance) is decimated
+        print 'tolerance %.2f: %d of %d points, %.1fx,'%(tolerance, \
+            keep.sum(),keep.shape[0],keep.shape[0]/float(keep.sum())), \
+            'identical' if same else 'DIFFERENT'
+        passed=passed and same
+    return passed
+
+#==============================================================================
+# DecimateBenchmark(numLines=20000,numPoints=100,tolerance=0.5)
+#    Time the simplification of random walk lines.
+#==============================================================================
+def DecimateBenchmark(numLines=20000,numPoints=100,tolerance=0.5):
+    rng=np.random.RandomState(0)
+    steps=rng.randn(numLines,numPoints,3)*0.1+[0.5,0,0]
+    positions=np.cumsum(steps,axis=1).reshape(-1,3)
+    counts=np.full(numLines,numPoints,dtype=np.int64)
+    t=time.time()
+    keep=DecimateLines(positions,counts,tolerance)
+    print 'points: %d, kept: %d (%.1fx), %.3f s'%(keep.shape[0],keep.sum(), \
+        keep.shape[0]/float(keep.sum()),time.time()-t)
@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It manages OpenGL vertex buffers and shader programs.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import ctypes
+
+from OpenGL.GL import *
+
+import numpy as np
+
+#==============================================================================
+# VertexBuffer(target=GL_ARRAY_BUFFER)
+#    A buffer object holding one numpy array. Upload reuses the buffer and
+#    only reallocates it when the data grow.
+#==============================================================================
+class VertexBuffer:
+    def __init__(self,target=GL_ARRAY_BUFFER):
+        self.target=target
+        self.buffer=None
+        self.capacity=0
+        self.nbytes=0
+
+    def Upload(self,data,usage=GL_STATIC_DRAW):
+        data=np.ascontiguousarray(data)
+        if self.buffer is None:
+            self.buffer=glGenBuffers(1)
+        glBindBuffer(self.target,self.buffer)
+        if data.nbytes>self.capacity or usage==GL_STATIC_DRAW:
+            glBufferData(self.target,data.nbytes,data,usage)
+            self.capacity=data.nbytes
+        elif data.nbytes>0:
+            glBufferSubData(self.target,0,data.nbytes,data)
+        self.nbytes=data.nbytes
+        glBindBuffer(self.target,0)
+
+    def UploadRange(self,offset,data):
+        data=np.ascontiguousarray(data)
+        glBindBuffer(self.target,self.buffer)
+        glBufferSubData(self.target,offset,data.nbytes,data)
+        glBindBuffer(self.target,0)
+
+    def Bind(self):
+        glBindBuffer(self.target,self.buffer)
+
+    def Unbind(self):
+        glBindBuffer(self.target,0)
+
+    def Release(self):
+        if self.buffer is not None:
+            glDeleteBuffers(1,[self.buffer])
+        self.buffer=None
+        self.capacity=0
+        self.nbytes=0
+
+#==============================================================================
+# SetVertexAttrib(loc,size,glType,stride,offset,normalized=False,divisor=0)
+#    Point the generic attribute loc at the bound buffer and enable it.
+#    divisor 1 makes it a per-instance attribute.
+#==============================================================================
+def SetVertexAttrib(loc,size,glType,stride,offset,normalized=False,divisor=0):
+    glEnableVertexAttribArray(loc)
+    glVertexAttribPointer(loc,size,glType,normalized,stride, \
+        ctypes.c_void_p(offset))
+    if bool(glVertexAttribDivisor):
+        glVertexAttribDivisor(loc,divisor)
+
+#==============================================================================
+# DisableVertexAttribs(locs)
+#==============================================================================
+def DisableVertexAttribs(locs):
+    for loc in locs:
+        if bool(glVertexAttribDivisor):
+            glVertexAttribDivisor(loc,0)
+        glDisableVertexAttribArray(loc)
+
+#==============================================================================
+# CreateProgram(vertexSource,fragmentSource,attribs)
+#    attribs: dict of attribute name -> location, bound before linking
+#    Return the program, or 0 when shaders are not available or fail.
+#==============================================================================
+def CreateProgram(vertexSource,fragmentSource,attribs):
+    if not (bool(glCreateShader) and bool(glCreateProgram)):
+        return 0
+    try:
+        program=glCreateProgram()
+        shaders=[]
+        for shaderType,source in [(GL_VERTEX_SHADER,vertexSource), \
+                                  (GL_FRAGMENT_SHADER,fragmentSource)]:
+            shader=glCreateShader(shaderType)
+            glShaderSource(shader,source)
+            glCompileShader(shader)
+            if not glGetShaderiv(shader,GL_COMPILE_STATUS):
+                print 'Shader compile error:',glGetShaderInfoLog(shader)
+                glDeleteShader(shader)
+                glDeleteProgram(program)
+                return 0
+            glAttachShader(program,shader)
+            shaders.append(shader)
+        for name,loc in attribs.items():
+            glBindAttribLocation(program,loc,name)
+        glLinkProgram(program)
+        for shader in shaders:
+            glDeleteShader(shader)
+        if not glGetProgramiv(program,GL_LINK_STATUS):
+            print 'Shader link error:',glGetProgramInfoLog(program)
+            glDeleteProgram(program)
+            return 0
+        return program
+    except Exception, e:
+        print 'Shader program not available:',e
+        return 0
+
+#==============================================================================
+# InstancingSupported()
+#    True if the current context can draw instanced geometry
+#==============================================================================
+def InstancingSupported():
+    return bool(glDrawArraysInstanced) and bool(glVertexAttribDivisor)
+
+#==============================================================================
+# VertexBuffersSupported()
+#    True if the current context has buffer objects
+#==============================================================================
+def VertexBuffersSupported():
+    return bool(glGenBuffers) and bool(glBufferData)
@@ -17,38 +17,156 @@ from OpenGL.GL import *
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
 
+import ctypes
+
 import numpy as np
 
 from PolyDataLib import *
+from GLBufferLib import *
+from DecimateLib import GetDecimatedFiberIndex
 
 #==============================================================================
-# RenderLineWithSegmentOrientation(inpd,lineNum)
+# RenderLineWithSegmentOrientation(inpd,lineNum,tolerance=0)
 #==============================================================================
-def RenderLineWithSegmentOrientation(inpd,lineNum):
-    
-    pidList=GetLinePointList(inpd,lineNum)
-    
-    if pidList.GetNumberOfIds() < 2:
+def RenderLineWithSegmentOrientation(inpd,lineNum,tolerance=0):
+    RenderLinesWithSegmentOrientation(inpd,[lineNum],tolerance)
+    return
+
+#==============================================================================
+# RenderLinesWithSegmentOrientation(inpd,lineNums,tolerance=0)
+#    Draw all lines in lineNums, each segment colored by its orientation,
+#    from one vertex buffer with one draw call. A tolerance (mm) draws the
+#    lines simplified within it (see GetDecimatedFiberIndex).
+#==============================================================================
+def RenderLinesWithSegmentOrientation(inpd,lineNums,tolerance=0):
+    fiberIndex=GetDecimatedFiberIndex(inpd,tolerance)
+    rows,counts=fiberIndex.GetLineRows(lineNums)
+    if not (counts>1).any():
         return
+    positions=fiberIndex.points[fiberIndex.pointIds[rows]]
+    colors=CalSegmentColors(positions,counts)
     
-    glDisable(GL_LIGHTING) 
-    
-    point0=GetPointPos(inpd,pidList.GetId(0))
+    if VertexBuffersSupported():
+        global _lineStream
+        if _lineStream is None:
+            _lineStream=LineStrips()
+        _lineStream.SetLines(positions,colors,counts,GL_STREAM_DRAW)
+        _lineStream.Draw()
+    else:
+        DrawLineStrips(positions,colors,counts)
+    return
+
+#==============================================================================
+# GetSegmentEndIndex(counts)
+#    For lines stored one after another with counts points each, the index
+#    of the end point of the segment that colors each point: the point
+#    itself, or the second point for the first point of a line.
+#==============================================================================
+def GetSegmentEndIndex(counts):
+    counts=np.asarray(counts,dtype=np.int64)
+    index=np.arange(int(counts.sum()))
+    firsts=(np.cumsum(counts)-counts)[counts>1]
+    index[firsts]+=1
+    return index
+
+#==============================================================================
+# CalSegmentColors(positions,counts)
+#    Orientation colors |normalize(p1-p0)| of the segments of lines stored
+#    one after another, as (M,4) uint8: row i holds the color of the
+#    segment ending at point i (see GetSegmentEndIndex).
+#==============================================================================
+def CalSegmentColors(positions,counts):
+    ends=GetSegmentEndIndex(counts)
+    colors=np.zeros((ends.shape[0],4),dtype=np.uint8)
+    colors[:,3]=255
+    if ends.shape[0]<2:
+        return colors
+    diff=positions[ends]-positions[np.maximum(ends-1,0)]
+    norm=np.sqrt((diff*diff).sum(axis=1))
+    norm[norm==0]=1.0
+    colors[:,:3]=(np.fabs(diff/norm[:,np.newaxis])*255).astype(np.uint8)
+    return colors
+
+def _GetStrips(counts):
+    # first vertex and number of vertices of the lines with a segment
+    counts=np.asarray(counts,dtype=np.int32)
+    firsts=(np.cumsum(counts)-counts).astype(np.int32)
+    drawn=counts>1
+    return np.ascontiguousarray(firsts[drawn]),np.ascontiguousarray(counts[drawn])
+
+#==============================================================================
+# DrawLineStrips(positions,colors,counts)
+#    Draw lines stored one after another from client side arrays. With
+#    flat shading each segment takes the color of its end point, as
+#    CalSegmentColors computes them.
+#==============================================================================
+def DrawLineStrips(positions,colors,counts):
+    glDisable(GL_LIGHTING)
+    glShadeModel(GL_FLAT)
     
-    for i in range(1,pidList.GetNumberOfIds()):
-        point1 = GetPointPos(inpd,pidList.GetId(i))
-        color=np.array(point1)-np.array(point0)
-        norm=np.linalg.norm(color)
-        color=np.fabs(color/norm)
-        glColor3f(color[0],color[1],color[2])
-        glBegin(GL_LINES)
-        glVertex3f(point0[0],point0[1],point0[2])
-        glVertex3f(point1[0],point1[1],point1[2])
-        glEnd()    
-        point0=point1
-            
-    glEnable(GL_LIGHTING) 
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_COLOR_ARRAY)
+    glVertexPointer(3,GL_FLOAT,0,np.ascontiguousarray(positions,dtype=np.float32))
+    glColorPointer(4,GL_UNSIGNED_BYTE,0,colors)
+    firsts,counts=_GetStrips(counts)
+    if counts.shape[0]>0:
+        glMultiDrawArrays(GL_LINE_STRIP,firsts,counts,counts.shape[0])
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
     
+    glShadeModel(GL_SMOOTH)
+    glEnable(GL_LIGHTING)
     return
 
+#==============================================================================
+# LineStrips()
+#    Vertex buffer of a set of lines: interleaved float32 positions and
+#    uint8 segment colors, drawn with one glMultiDrawArrays call.
+#==============================================================================
+_LINE_VERTEX=np.dtype([('position',np.float32,3),('color',np.uint8,4)])
+
+class LineStrips:
+    def __init__(self):
+        self.buffer=VertexBuffer()
+        self.firsts=None
+        self.counts=None
+    
+    def SetLines(self,positions,colors,counts,usage=GL_STATIC_DRAW):
+        vertices=np.empty(positions.shape[0],dtype=_LINE_VERTEX)
+        vertices['position']=positions
+        vertices['color']=colors
+        self.buffer.Upload(vertices.view(np.uint8),usage)
+        self.firsts,self.counts=_GetStrips(counts)
+    
+    def SetRanges(self,firsts,counts):
+        # draw only these lines of the buffer
+        counts=np.asarray(counts,dtype=np.int32)
+        drawn=counts>1
+        self.firsts=np.ascontiguousarray(np.asarray(firsts,dtype=np.int32)[drawn])
+        self.counts=np.ascontiguousarray(counts[drawn])
+    
+    def Draw(self):
+        if self.counts is None or self.counts.shape[0]==0:
+            return
+        glDisable(GL_LIGHTING)
+        glShadeModel(GL_FLAT)
+        
+        self.buffer.Bind()
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3,GL_FLOAT,_LINE_VERTEX.itemsize,ctypes.c_void_p(0))
+        glColorPointer(4,GL_UNSIGNED_BYTE,_LINE_VERTEX.itemsize,ctypes.c_void_p(12))
+        glMultiDrawArrays(GL_LINE_STRIP,self.firsts,self.counts,self.counts.shape[0])
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        self.buffer.Unbind()
+        
+        glShadeModel(GL_SMOOTH)
+        glEnable(GL_LIGHTING)
+    
+    def Release(self):
+        self.buffer.Release()
+        self.firsts=None
+        self.counts=None
 
+_lineStream=None
@@ -0,0 +1,348 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It builds tube meshes and glyph matrices with a pool of processes that
+write into shared memory.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+from PolyDataLib import *
+from TensorLib import *
+from TensorLib import _SyntheticTensors
+from TensorRenderLib import BuildGlyphMatrices
+from TubeRenderLib import *
+
+#==============================================================================
+# SharedArray(shape,dtype)
+#    A numpy array in a file mapped by the processes of a pool, in /dev/shm
+#    where there is one. Return (shared,array): shared names the file and
+#    is handed to the pool, see GetSharedArray; ReleaseSharedArray removes
+#    the file once no array maps it.
+#==============================================================================
+_SHARED_FOLDER='/dev/shm' if os.path.isdir('/dev/shm') else None
+
+def SharedArray(shape,dtype):
+    handle,filename=tempfile.mkstemp(prefix='TwoTensorModelViz.',dir=_SHARED_FOLDER)
+    os.close(handle)
+    shared=(filename,np.dtype(dtype).str,tuple(shape))
+    return shared,GetSharedArray(shared,'w+')
+
+def GetSharedArray(shared,mode='r+'):
+    # a file cannot be mapped empty
+    filename,dtype,shape=shared
+    count=int(np.prod(shape))
+    return np.memmap(filename,dtype=np.dtype(dtype),mode=mode, \
+        shape=(max(count,1),))[:count].reshape(shape)
+
+def ReleaseSharedArray(shared):
+    os.remove(shared[0])
+
+def _SharedCopy(data):
+    shared,view=SharedArray(data.shape,data.dtype)
+    view[:]=data
+    return shared
+
+#==============================================================================
+# SplitShards(counts,numShards)
+#    Split lines with counts points into at most numShards consecutive
+#    ranges [start,end) of lines with about the same number of points.
+#==============================================================================
+def SplitShards(counts,numShards):
+    counts=np.asarray(counts,dtype=np.int64)
+    cum=np.cumsum(counts)
+    total=int(cum[-1]) if cum.shape[0]>0 else 0
+    if total==0:
+        return [(0,counts.shape[0])] if counts.shape[0]>0 else []
+    targets=total*np.arange(1,numShards)/float(numShards)
+    bounds=np.searchsorted(cum,targets,side='left')+1
+    bounds=np.unique(np.concatenate([[0],bounds,[counts.shape[0]]]))
+    return [(int(bounds[i]),int(bounds[i+1])) for i in range(bounds.shape[0]-1)]
+
+#==============================================================================
+# Tasks
+# A task builds one shard from the arrays (name -> numpy array) it is
+# given and writes its results into them in place. In a pool the arrays
+# are shared files, each task maps them itself; in one process they are
+# the arrays of the build, so concurrent builds never share anything.
+#==============================================================================
+def _TubeShard(arrays,shard):
+    lineStart,lineEnd,slices=shard
+    offsets=arrays['offsets']
+    start,end=int(offsets[lineStart]),int(offsets[lineEnd])
+    positions=arrays['positions'][start:end]
+
+    # frames of these lines, as GetFiberFrames gives them
+    localOffsets=offsets[lineStart:lineEnd+1]-start
+    frames=BuildFiberFrames(FiberIndex(localOffsets,np.arange(end-start), \
+        positions))
+    vertices,normals=BuildTubeRings(positions,frames.normals, \
+        frames.binormals,arrays['radii'][start:end],slices)
+    # two rings per point
+    arrays['vertices'][2*start*slices:2*end*slices]=vertices
+    arrays['normals'][2*start*slices:2*end*slices]=normals
+    if 'colors' in arrays:
+        arrays['vertexColors'][2*start*slices:2*end*slices]= \
+            GetTubeVertexColors(arrays['colors'][start:end], \
+                GetTubeRingColorIndex(np.diff(localOffsets)),slices)
+
+def _GlyphShard(arrays,shard):
+    start,end,scale=shard
+    eigens=CompactTensors(arrays['tensors'][start:end]).CalEigens()
+    arrays['mats'][start:end]=BuildGlyphMatrices(arrays['positions'][start:end], \
+        eigens.eigVecs,eigens.eigVals,scale)
+
+def _RunSharedShard(job):
+    task,shared,shard=job
+    task(dict((name,GetSharedArray(handle)) for name,handle in shared.items()),shard)
+
+#==============================================================================
+# ParallelBuildSupported()
+#    Whether worker processes can be started here. On Linux they are forked.
+#    On Windows a process runs sys.executable and imports __main__ again,
+#    which inside Slicer is the Slicer application rather than a Python
+#    interpreter; on Mac forking a process with Qt threads is unsafe. There,
+#    and after a pool failed to start once, builds stay in one process.
+#==============================================================================
+_poolFailed=[False]
+
+def ParallelBuildSupported():
+    if _poolFailed[0]:
+        return False
+    if sys.platform.startswith('linux'):
+        return True
+    if sys.platform=='win32':
+        return os.path.basename(sys.executable).lower().startswith('python')
+    return False
+
+#==============================================================================
+# GetParallelBuilder()
+#    The ParallelBuilder of the scene over all cores with its pool started,
+#    or None on one core or when worker processes cannot be used (see
+#    ParallelBuildSupported). Call it from the main thread, so the pool is
+#    never forked from a worker thread.
+# CloseParallelBuilder()
+#    Stop the pool of the scene builder when the scene is released.
+#==============================================================================
+_parallelBuilder=[]
+
+def GetParallelBuilder():
+    if multiprocessing.cpu_count()<2 or not ParallelBuildSupported():
+        return None
+    if not _parallelBuilder:
+        _parallelBuilder.append(ParallelBuilder())
+    builder=_parallelBuilder[0]
+    return builder if builder.Start() is not None else None
+
+def CloseParallelBuilder():
+    while _parallelBuilder:
+        _parallelBuilder.pop().Close()
+
+#==============================================================================
+# ParallelBuilder(processes=None)
+#    Build tube meshes and glyph matrices over the cores of the machine.
+#    Lines are split into shards of about the same number of points (see
+#    SplitShards), each shard is built by a process from the inputs in
+#    shared memory and written into shared output arrays at offsets known
+#    in advance, so nothing is sent back. Every output element is computed
+#    from its own inputs only, so the result does not depend on the number
+#    of processes and equals that of BuildTubeMesh and BuildGlyphMatrices.
+#    processes: number of processes, all cores by default; 1 builds in the
+#    calling process. shardsPerProcess shards per process balance the load.
+#    The pool is started by Start or the first build and reused by every
+#    build until Close; builds after Close run in the calling process.
+#==============================================================================
+class ParallelBuilder:
+    def __init__(self,processes=None,shardsPerProcess=4):
+        if processes is None:
+            processes=multiprocessing.cpu_count()
+        self.processes=max(int(processes),1)
+        self.shardsPerProcess=shardsPerProcess
+        self.pool=None
+
+    def Start(self):
+        if self.pool is None and self.processes>1 and ParallelBuildSupported():
+            try:
+                self.pool=multiprocessing.Pool(self.processes)
+            except Exception, e:
+                print 'Worker processes failed to start, building in one process:',e
+                _poolFailed[0]=True
+        return self.pool
+
+    def Close(self):
+        pool=self.pool
+        self.pool=None
+        self.processes=1
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _Run(self,task,shards,inputs,outputs):
+        # inputs: name -> array, outputs: name -> (shape,dtype); return the
+        # arrays of the outputs
+        pool=self.Start()
+        if pool is None:
+            arrays=dict(inputs)
+            for name,(shape,dtype) in outputs.items():
+                arrays[name]=np.empty(shape,dtype=dtype)
+            for shard in shards:
+                task(arrays,shard)
+            return dict((name,arrays[name]) for name in outputs)
+
+        shared={}
+        arrays={}
+        try:
+            for name,data in inputs.items():
+                shared[name]=_SharedCopy(np.asarray(data))
+            for name,(shape,dtype) in outputs.items():
+                shared[name],arrays[name]=SharedArray(shape,dtype)
+            pool.map(_RunSharedShard,[(task,shared,shard) for shard in shards], \
+                chunksize=1)
+            return dict((name,np.array(array)) for name,array in arrays.items())
+        finally:
+            # unmap before the files are removed
+            arrays.clear()
+            for handle in shared.values():
+                ReleaseSharedArray(handle)
+
+    def BuildTubeMesh(self,positions,radii,counts,slices,colors=None):
+        # positions, radii, colors: of the points of lines stored one after
+        # another, counts: number of points of each line
+        counts=np.asarray(counts,dtype=np.int64)
+        num=int(counts.sum())
+        offsets=np.zeros(counts.shape[0]+1,dtype=np.int64)
+        offsets[1:]=np.cumsum(counts)
+        inputs={'offsets':offsets,'positions':positions,'radii':radii}
+        outputs={'vertices':((2*num*slices,3),np.float32), \
+                 'normals':((2*num*slices,3),np.float32)}
+        if colors is not None:
+            inputs['colors']=colors
+            outputs['vertexColors']=((2*num*slices,4),np.uint8)
+
+        shards=[(start,end,slices) for start,end in \
+            SplitShards(counts,self.processes*self.shardsPerProcess)]
+        arrays=self._Run(_TubeShard,shards,inputs,outputs)
+        return TubeMesh(arrays['vertices'],arrays['normals'], \
+            BuildTubeIndices(counts,slices),slices,arrays.get('vertexColors'), \
+            GetTubeRingColorIndex(counts))
+
+    def BuildGlyphMatrices(self,positions,tensors,scale):
+        # positions: (M,3), tensors: (M,6) as CompactTensors stores them
+        num=positions.shape[0]
+        numShards=min(self.processes*self.shardsPerProcess,max(num,1))
+        bounds=np.linspace(0,num,numShards+1).astype(np.int64)
+        shards=[(int(bounds[i]),int(bounds[i+1]),scale) \
+            for i in range(numShards) if bounds[i+1]>bounds[i]]
+        return self._Run(_GlyphShard,shards, \
+            {'positions':positions,'tensors':tensors}, \
+            {'mats':((num,4,4),np.float32)})['mats']
+
+#==============================================================================
+# For Test
+#==============================================================================
+def _SyntheticBundle(numLines,numPoints,seed=0):
+    # random walk lines with numPoints points each
+    rng=np.random.RandomState(seed)
+    steps=rng.randn(numLines,numPoints,3).astype(np.float32)
+    positions=np.cumsum(steps,axis=1).reshape(-1,3)
+    counts=np.full(numLines,numPoints,dtype=np.int64)
+    radii=rng.rand(positions.shape[0])
+    colors=rng.randint(0,256,(positions.shape[0],4)).astype(np.uint8)
+    return positions,radii,counts,colors
+
+def _SingleProcessTubeMesh(positions,radii,counts,slices,colors):
+    offsets=np.zeros(counts.shape[0]+1,dtype=np.int64)
+    offsets[1:]=np.cumsum(counts)
+    frames=BuildFiberFrames(FiberIndex(offsets,np.arange(positions.shape[0]), \
+        positions))
+    return BuildTubeMesh(positions,frames.normals,frames.binormals,radii, \
+        counts,slices,colors)
+
+#==============================================================================
+# ParallelBuildTest(processes=None)
+#    The parallel builders must give exactly the single process results,
+#    build after build on the same pool, which leaves no shared file.
+#==============================================================================
+def ParallelBuildTest(processes=None):
+    positions,radii,counts,colors=_SyntheticBundle(300,57)
+    # lines of unequal length
+    counts=np.array([1,2,150]+[57]*300,dtype=np.int64)[:300]
+    counts[-1]+=positions.shape[0]-counts.sum()
+    slices=10
+
+    expected=_SingleProcessTubeMesh(positions,radii,counts,slices,colors)
+    tensors=SymmetricTensor6(_SyntheticTensors(5000)).astype(np.float32)
+    glyphPositions=positions[:5000]
+    eigens=CompactTensors(tensors).CalEigens()
+    expectedMats=BuildGlyphMatrices(glyphPositions,eigens.eigVecs,eigens.eigVals,2000)
+    folder=_SHARED_FOLDER or tempfile.gettempdir()
+    files=set(os.listdir(folder))
+    passed=True
+    for n in sorted(set([1,2,processes or multiprocessing.cpu_count()])):
+        builder=ParallelBuilder(n)
+        pool=builder.Start()
+        try:
+            for k in range(2):
+                mesh=builder.BuildTubeMesh(positions,radii,counts,slices,colors)
+                same=np.array_equal(mesh.vertices,expected.vertices) and \
+                     np.array_equal(mesh.normals,expected.normals) and \
+                     np.array_equal(mesh.colors,expected.colors) and \
+                     np.array_equal(mesh.indices,expected.indices)
+                mats=builder.BuildGlyphMatrices(glyphPositions,tensors,2000)
+                same=same and np.array_equal(mats,expectedMats) and builder.pool is pool
+                print 'build',k+1,'with',n,'processes:','identical' if same else 'DIFFERENT'
+                passed=passed and same
+        finally:
+            builder.Close()
+    left=set(os.listdir(folder))-files
+    print 'shared files left:',len(left)
+    return passed and not left
+
+#==============================================================================
+# ParallelBuildBenchmark(numLines=20000,numPoints=100,slices=10,repeat=3)
+#    Time the tube mesh and glyph builds with 1,2,4,... processes.
+#==============================================================================
+def ParallelBuildBenchmark(numLines=20000,numPoints=100,slices=10,repeat=3):
+    positions,radii,counts,colors=_SyntheticBundle(numLines,numPoints)
+    tensors=SymmetricTensor6(_SyntheticTensors(positions.shape[0]//10)). \
+        astype(np.float32)
+    glyphPositions=positions[:tensors.shape[0]]
+    print 'points:',positions.shape[0],'glyphs:',tensors.shape[0], \
+        'cores:',multiprocessing.cpu_count()
+
+    processes=[1]
+    while processes[-1]*2<=multiprocessing.cpu_count():
+        processes.append(processes[-1]*2)
+    if processes[-1]<multiprocessing.cpu_count():
+        processes.append(multiprocessing.cpu_count())
+
+    base=None
+    for n in processes:
+        builder=ParallelBuilder(n)
+        builder.Start()
+        best=None
+        for i in range(repeat):
+            t=time.time()
+            builder.BuildTubeMesh(positions,radii,counts,slices,colors)
+            builder.BuildGlyphMatrices(glyphPositions,tensors,2000)
+            t=time.time()-t
+            best=t if best is None else min(best,t)
+        builder.Close()
+        if base is None:
+            base=best
+        print '%2d processes: %.3f s, speedup %.2f'%(n,best,base/best)
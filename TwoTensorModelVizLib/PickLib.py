@@ -0,0 +1,521 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It picks the fiber and the glyph under the mouse with a ray cast.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import time
+
+import numpy as np
+
+from PolyDataLib import *
+from PolyDataLib import _GetCachedObject,_FiberIndexKey
+from TensorLib import _TestDataFile
+from SpatialIndexLib import ConcatRanges
+from TensorLib import GetTensorEigens
+from TensorRenderLib import BuildGlyphMatrices
+from TubeRenderLib import GetTubeRadii
+from DecimateLib import GetRenderFiberIndex
+from SceneLib import SelectLineNums,GetGlyphIndex
+
+# radius of the fibers when no tube is shown
+PICK_RADIUS=0.5
+
+BVH_LEAF_SIZE=8
+
+def _MortonCodes(centers):
+    # 30 bit codes of the centers in a 1024^3 grid of their bounds
+    lower=centers.min(axis=0)
+    extent=np.maximum(centers.max(axis=0)-lower,1e-12)
+    cells=np.minimum(((centers-lower)/extent*1024).astype(np.int64),1023)
+    codes=np.zeros(centers.shape[0],dtype=np.int64)
+    for bit in range(10):
+        for k in range(3):
+            codes|=((cells[:,k]>>bit)&1)<<(3*bit+2-k)
+    return codes
+
+#==============================================================================
+# SegmentBVH(positions,radii,counts,leafSize=BVH_LEAF_SIZE)
+#    Bounding volume hierarchy over the segments of lines stored one after
+#    another (positions, radii of the points, counts points per line); a
+#    segment is a capsule of the larger radius of its two ends.
+#    Segments are sorted along a Morton curve and packed leafSize to a leaf;
+#    levels[0] is the root and the children of node j of a level are nodes
+#    2j and 2j+1 of the next one, down to the leaves in levels[-1]. Each
+#    level holds the (lower,upper) bounds of its nodes.
+#    segmentRows: CSR position of the first end of each sorted segment.
+#==============================================================================
+class SegmentBVH:
+    def __init__(self,positions,radii,counts,leafSize=BVH_LEAF_SIZE):
+        positions=np.asarray(positions,dtype=np.float64)
+        counts=np.asarray(counts,dtype=np.int64)
+        num=positions.shape[0]
+        isSegment=np.ones(max(num-1,0),dtype=bool)
+        ends=np.cumsum(counts)
+        isSegment[ends[ends<num]-1]=False
+        rows=np.nonzero(isSegment)[0]
+
+        a,b=positions[rows],positions[rows+1]
+        r=np.maximum(radii[rows],radii[rows+1])[:,np.newaxis]
+        lower=np.minimum(a,b)-r
+        upper=np.maximum(a,b)+r
+        order=np.argsort(_MortonCodes(0.5*(a+b)),kind='mergesort') \
+            if rows.shape[0]>0 else rows
+        self.segmentRows=rows[order]
+        self.starts=a[order]
+        self.vectors=(b-a)[order]
+        self.radii=r[order,0]
+        self.leafSize=leafSize
+
+        levels=[]
+        if rows.shape[0]>0:
+            leaves=np.arange(0,rows.shape[0],leafSize)
+            levels.append((np.minimum.reduceat(lower[order],leaves,axis=0), \
+                np.maximum.reduceat(upper[order],leaves,axis=0)))
+            while levels[-1][0].shape[0]>1:
+                nodeLower,nodeUpper=levels[-1]
+                pairs=np.arange(0,nodeLower.shape[0],2)
+                levels.append((np.minimum.reduceat(nodeLower,pairs,axis=0), \
+                    np.maximum.reduceat(nodeUpper,pairs,axis=0)))
+        self.levels=levels[::-1]
+
+    def GetNumberOfSegments(self):
+        return self.segmentRows.shape[0]
+
+    def _Leaves(self,origin,direction):
+        # leaves whose bounds the ray crosses, one level at a time
+        if not self.levels:
+            return np.zeros(0,dtype=np.int64)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            inverse=1.0/direction
+        nodes=np.zeros(1,dtype=np.int64)
+        for k,(lower,upper) in enumerate(self.levels):
+            if k>0:
+                nodes=np.concatenate([2*nodes,2*nodes+1])
+                nodes=nodes[nodes<lower.shape[0]]
+            with np.errstate(invalid='ignore'):
+                t1=(lower[nodes]-origin)*inverse
+                t2=(upper[nodes]-origin)*inverse
+            # NaN of a zero direction on a box face does not cut the ray
+            near=np.fmax.reduce(np.fmin(t1,t2),axis=1)
+            far=np.fmin.reduce(np.fmax(t1,t2),axis=1)
+            nodes=nodes[far>=np.maximum(near,0)]
+            if nodes.shape[0]==0:
+                break
+        return nodes
+
+    def GetSegments(self,origin,direction):
+        # the sorted segments in the leaves the ray crosses, a superset of
+        # the capsules it hits
+        leaves=self._Leaves(origin,direction)
+        return ConcatRanges(leaves*self.leafSize, \
+            np.minimum((leaves+1)*self.leafSize,self.segmentRows.shape[0]))
+
+    def CastRay(self,origin,direction):
+        # (t,segment,s): the first capsule along the ray origin+t*direction,
+        # t>=0, at its point nearest to the ray, the position s (0..1) of
+        # that point on the sorted segment; None when nothing is hit
+        origin=np.asarray(origin,dtype=np.float64)
+        direction=np.asarray(direction,dtype=np.float64)
+        direction=direction/np.sqrt(np.square(direction).sum())
+        segments=self.GetSegments(origin,direction)
+        if segments.shape[0]==0:
+            return None
+
+        # closest points of the ray and the segments
+        v=self.vectors[segments]
+        w=origin-self.starts[segments]
+        b=np.dot(v,direction)
+        c=np.square(v).sum(axis=1)
+        d=np.dot(w,direction)
+        e=(v*w).sum(axis=1)
+        denom=c-b*b
+        with np.errstate(divide='ignore',invalid='ignore'):
+            s=np.where(denom>1e-12*np.maximum(c,1e-300),(e-b*d)/denom,0.0)
+            s=np.clip(s,0,1)
+            t=np.maximum(b*s-d,0)
+            s=np.where(c>0,np.clip((e+b*t)/c,0,1),0.0)
+        t=np.maximum(b*s-d,0)
+        gap=w+t[:,np.newaxis]*direction-s[:,np.newaxis]*v
+        hit=np.square(gap).sum(axis=1)<=np.square(self.radii[segments])
+        if not hit.any():
+            return None
+        first=np.nonzero(hit)[0][np.argmin(t[hit])]
+        return float(t[first]),int(segments[first]),float(s[first])
+
+#==============================================================================
+# FiberPick
+#    What a ray hit: lineNum (1,2,...) of the fiber, pointId and position
+#    of its point nearest to the hit, hitPosition where the ray meets the
+#    fiber axis or the glyph surface, distance along the ray, and when the
+#    ray hits a glyph first, glyphPointId of the glyph and the tensor1,
+#    tensor2 3x3 tensors there of the glyphs shown (None otherwise).
+#==============================================================================
+class FiberPick:
+    def __init__(self):
+        self.lineNum=None
+        self.pointId=None
+        self.position=None
+        self.hitPosition=None
+        self.distance=None
+        self.glyphPointId=None
+        self.tensor1=None
+        self.tensor2=None
+
+def _PickKey(inpd,params,names):
+    # lineNum only selects the lines with onlyOneLine
+    key,mtime=_FiberIndexKey(inpd)
+    values=dict((name,params.get(name)) for name in names)
+    if not values['onlyOneLine']:
+        values['lineNum']=None
+    return (key,)+tuple(values[name] for name in names),mtime
+
+#==============================================================================
+# FiberPicker(inpd,params)
+#    Ray picking of the fibers of inpd as they are drawn with params: only
+#    the lines of SelectLineNums, on their points simplified within
+#    decimateTolerance, with their tube radius when tubes are shown,
+#    PICK_RADIUS otherwise. Pick also takes the GlyphPicker of the scene,
+#    a glyph in front of the fibers is picked with its fiber.
+#    pointIds: the point of each row of the hierarchy, lines one after
+#    another as in lineNums with offsets.
+#==============================================================================
+class FiberPicker:
+    def __init__(self,inpd,params):
+        self.inpd=inpd
+        self.fiberIndex=GetFiberIndex(inpd)
+        self.lineNums=np.asarray(SelectLineNums(inpd,params),dtype=np.int64)
+        renderIndex=GetRenderFiberIndex(inpd,params)
+        rows,counts=renderIndex.GetLineRows(self.lineNums)
+        self.pointIds=renderIndex.pointIds[rows]
+        self.offsets=np.zeros(counts.shape[0]+1,dtype=np.int64)
+        self.offsets[1:]=np.cumsum(counts)
+        if params.get('showTubes'):
+            radii=GetTubeRadii(inpd,params,self.pointIds)
+        else:
+            radii=np.empty(self.pointIds.shape[0])
+            radii[:]=params.get('pickRadius',PICK_RADIUS)
+        self.bvh=SegmentBVH(renderIndex.points[self.pointIds],radii,counts)
+
+    def Pick(self,origin,direction,glyphs=None):
+        hit=self.bvh.CastRay(origin,direction)
+        glyphHit=glyphs.CastRay(origin,direction) if glyphs is not None else None
+        if glyphHit is not None and (hit is None or glyphHit[0]<=hit[0]):
+            return glyphs.GetPick(origin,direction,*glyphHit)
+        if hit is None:
+            return None
+        t,segment,s=hit
+        row=int(self.bvh.segmentRows[segment])
+        pick=FiberPick()
+        pick.distance=t
+        pick.hitPosition=self.bvh.starts[segment]+s*self.bvh.vectors[segment]
+        line=int(np.searchsorted(self.offsets,row,side='right'))-1
+        pick.lineNum=int(self.lineNums[line])
+        if s>0.5:
+            row+=1
+        pick.pointId=int(self.pointIds[row])
+        pick.position=np.asarray(self.fiberIndex.points[pick.pointId],dtype=np.float64)
+        return pick
+
+#==============================================================================
+# GlyphPicker(inpd,params)
+#    Ray picking of the tensor glyphs as they are drawn with params: the
+#    cylinders of the shown tensors at the points glyphSpace,2*glyphSpace,...
+#    of the lines of SelectLineNums, glyphScale times their eigen values.
+#    Each cylinder is bounded by a capsule of a SegmentBVH, and the ray is
+#    tested against the exact cylinders of the leaves it crosses.
+#    axes: the rows of the glyph matrices (x,y,z axes scaled), centers,
+#    lineNums, pointIds and tensor names of each glyph.
+#==============================================================================
+class GlyphPicker:
+    def __init__(self,inpd,params):
+        self.inpd=inpd
+        fiberIndex=GetFiberIndex(inpd)
+        lineNums=np.asarray(SelectLineNums(inpd,params),dtype=np.int64)
+        rows,counts=fiberIndex.GetLineRows(lineNums)
+        glyphIndex=GetGlyphIndex(counts,int(params['glyphSpace']))
+        lines=lineNums[np.repeat(np.arange(counts.shape[0]),counts)[glyphIndex]]
+        pids=fiberIndex.pointIds[rows][glyphIndex]
+        centers=fiberIndex.points[pids].astype(np.float64)
+
+        registry=GetArrayRegistry(inpd)
+        self.shown=[tname for tname,show in \
+            [('tensor1','showTensor1'),('tensor2','showTensor2')] \
+            if params.get(show) and registry.HasPointArray(tname)]
+        axes=[]
+        for tname in self.shown:
+            eigens=GetTensorEigens(inpd,tname)
+            axes.append(BuildGlyphMatrices(centers,eigens.eigVecs[pids], \
+                eigens.eigVals[pids],int(params['glyphScale']))[:,:3,:3])
+        numShown=len(self.shown)
+        self.axes=np.concatenate(axes).astype(np.float64) if axes else \
+            np.zeros((0,3,3))
+        self.centers=np.tile(centers,(numShown,1))
+        self.lineNums=np.tile(lines,numShown)
+        self.pointIds=np.tile(pids,numShown)
+
+        # capsules along the cylinder axes, as wide as the widest radius
+        half=0.5*self.axes[:,2]
+        radii=0.5*np.sqrt(np.square(self.axes[:,:2]).sum(axis=2).max(axis=1)) \
+            if numShown else np.zeros(0)
+        ends=np.concatenate([(self.centers-half)[:,np.newaxis], \
+            (self.centers+half)[:,np.newaxis]],axis=1).reshape(-1,3)
+        self.bvh=SegmentBVH(ends,np.repeat(radii,2), \
+            np.full(self.centers.shape[0],2,dtype=np.int64))
+
+    def CastRay(self,origin,direction):
+        # (t,glyph): the first glyph along the ray origin+t*direction,
+        # t>=0 with direction normalized; None when nothing is hit
+        origin=np.asarray(origin,dtype=np.float64)
+        direction=np.asarray(direction,dtype=np.float64)
+        direction=direction/np.sqrt(np.square(direction).sum())
+        glyphs=self.bvh.segmentRows[self.bvh.GetSegments(origin,direction)]//2
+        if glyphs.shape[0]==0:
+            return None
+        t=CylinderRayDistances(origin,direction,self.centers[glyphs],self.axes[glyphs])
+        first=int(np.argmin(t))
+        if not np.isfinite(t[first]):
+            return None
+        return float(t[first]),int(glyphs[first])
+
+    def GetPick(self,origin,direction,t,glyph):
+        direction=np.asarray(direction,dtype=np.float64)
+        pick=FiberPick()
+        pick.distance=t
+        pick.hitPosition=np.asarray(origin,dtype=np.float64)+ \
+            t*direction/np.sqrt(np.square(direction).sum())
+        pick.lineNum=int(self.lineNums[glyph])
+        pick.pointId=pick.glyphPointId=int(self.pointIds[glyph])
+        pick.position=self.centers[glyph].copy()
+        registry=GetArrayRegistry(self.inpd)
+        for tname in self.shown:
+            tensor=registry.GetPointValues(tname)[pick.glyphPointId]
+            setattr(pick,tname,np.asarray(tensor,dtype=np.float64).reshape(3,3))
+        return pick
+
+#==============================================================================
+# CylinderRayDistances(origin,direction,centers,axes)
+#    Distance along the ray origin+t*direction, t>=0, at which it enters
+#    each glyph cylinder (inf where it misses). A glyph is the cylinder of
+#    radius 0.5 from z=-0.5 to 0.5 (see drawCylinderWithColors) with its
+#    x,y,z axes mapped to the rows of axes (N,3,3), around centers (N,3).
+#    The rows are orthogonal, so the ray is taken to the cylinder frame by
+#    projecting onto them.
+#==============================================================================
+def CylinderRayDistances(origin,direction,centers,axes):
+    lengths=np.maximum(np.square(axes).sum(axis=2),1e-24)
+    o=np.einsum('nij,nj->ni',axes,origin-centers)/lengths
+    d=np.einsum('nij,j->ni',axes,direction)/lengths
+    a=np.square(d[:,:2]).sum(axis=1)
+    b=2*(o[:,:2]*d[:,:2]).sum(axis=1)
+    c=np.square(o[:,:2]).sum(axis=1)-0.25
+    with np.errstate(divide='ignore',invalid='ignore'):
+        # inside the round side, NaN where the ray misses it
+        root=np.sqrt(b*b-4*a*c)
+        sideNear=np.where(a>0,(-b-root)/(2*a),np.where(c<=0,-np.inf,np.inf))
+        sideFar=np.where(a>0,(-b+root)/(2*a),np.where(c<=0,np.inf,-np.inf))
+        # between the caps
+        z1=(-0.5-o[:,2])/d[:,2]
+        z2=(0.5-o[:,2])/d[:,2]
+        inside=np.fabs(o[:,2])<=0.5
+        capNear=np.where(d[:,2]!=0,np.minimum(z1,z2),np.where(inside,-np.inf,np.inf))
+        capFar=np.where(d[:,2]!=0,np.maximum(z1,z2),np.where(inside,np.inf,-np.inf))
+        near=np.maximum(np.maximum(sideNear,capNear),0)
+        far=np.minimum(sideFar,capFar)
+        return np.where(near<=far,near,np.inf)
+
+#==============================================================================
+# GetFiberPicker(inpd,params)
+#    Return the FiberPicker of inpd for the params that change the fibers
+#    as drawn, rebuilt only when they or the lines of inpd change. lineNum
+#    only selects the lines with onlyOneLine, so picking a fiber while all
+#    are shown does not rebuild the picker.
+# GetGlyphPicker(inpd,params)
+#    The same for the GlyphPicker and the params of the glyphs, so changing
+#    the glyphs does not rebuild the hierarchy of the fibers.
+#==============================================================================
+PICK_PARAMS=['lineNum','lineSpace','onlyOneLine', \
+    'roiType','roiCenter','roiRadius','roiSlabAxis','decimateTolerance', \
+    'showTubes','tubeSizeFlag','tubeFixedSize','tubeScale', \
+    'tubeMappedToName','pickRadius']
+
+GLYPH_PICK_PARAMS=['lineNum','lineSpace','onlyOneLine', \
+    'roiType','roiCenter','roiRadius','roiSlabAxis', \
+    'showTensor1','showTensor2','glyphSpace','glyphScale']
+
+_fiberPickerCache={}
+_glyphPickerCache={}
+
+def GetFiberPicker(inpd,params):
+    key,mtime=_PickKey(inpd,params,PICK_PARAMS)
+    return _GetCachedObject(_fiberPickerCache,key,mtime, \
+        FiberPicker,inpd,params,maxEntries=4)
+
+def GetGlyphPicker(inpd,params):
+    key,mtime=_PickKey(inpd,params,GLYPH_PICK_PARAMS)
+    return _GetCachedObject(_glyphPickerCache,key,mtime, \
+        GlyphPicker,inpd,params,maxEntries=4)
+
+#==============================================================================
+# GetPickRay(renderer,x,y)
+#    The ray (origin,direction) of the display position x,y of renderer,
+#    from the near to the far clipping plane of its camera.
+#==============================================================================
+def GetPickRay(renderer,x,y):
+    points=[]
+    for z in [0.0,1.0]:
+        renderer.SetDisplayPoint(x,y,z)
+        renderer.DisplayToWorld()
+        point=np.array(renderer.GetWorldPoint(),dtype=np.float64)
+        points.append(point[:3]/point[3])
+    return points[0],points[1]-points[0]
+
+#==============================================================================
+# For Test
+#==============================================================================
+def _BruteForceRay(positions,radii,counts,origin,direction):
+    # the same capsule test on every segment
+    bvh=SegmentBVH(positions,radii,counts,leafSize=1<<30)
+    return bvh.CastRay(origin,direction)
+
+def _TestParams(showTubes,lineSpace=1,decimateTolerance=0,showTensors=(False,False)):
+    return {'lineNum':1,'lineSpace':lineSpace,'onlyOneLine':False,'roiType':'', \
+        'decimateTolerance':decimateTolerance,'showTubes':showTubes, \
+        'tubeSizeFlag':1,'tubeFixedSize':1,'tubeScale':2, \
+        'tubeMappedToName':'FA1','showTensor1':showTensors[0], \
+        'showTensor2':showTensors[1],'glyphSpace':10,'glyphScale':2000}
+
+def _CylinderTest():
+    # a cylinder of radius 1 and length 4 along z at the origin
+    axes=np.diag([2.0,2.0,4.0])[np.newaxis]
+    centers=np.zeros((1,3))
+    rays=[((0,0,-10),(0,0,1),8.0),((-10,0,0),(1,0,0),9.0), \
+          ((-10,0.5,1.9),(1,0,0),10-np.sqrt(0.75)),((-10,1.01,0),(1,0,0),np.inf), \
+          ((-10,0,2.01),(1,0,0),np.inf),((0,0,0),(0,1,0),0.0), \
+          ((0,0,10),(0,0,1),np.inf)]
+    same=True
+    for origin,direction,expected in rays:
+        t=CylinderRayDistances(np.array(origin,dtype=np.float64), \
+            np.array(direction,dtype=np.float64),centers,axes)[0]
+        same=same and (t==expected or abs(t-expected)<1e-9)
+    return same
+
+#==============================================================================
+# PickTest(filename=None,numRays=300)
+#    Rays through random drawn fiber points must hit the first capsule
+#    that a test of every drawn segment hits, and the picked fiber must be
+#    drawn and hold the picked point. Rays at random glyphs must enter the
+#    first cylinder that a test of every glyph enters, and a glyph in front
+#    of the fibers is picked with the tensors shown on its fiber.
+#==============================================================================
+def PickTest(filename=None,numRays=300):
+    if filename is None:
+        filename=_TestDataFile()
+    inpd=LoadPolyData(filename)
+    fiberIndex=GetFiberIndex(inpd)
+    rng=np.random.RandomState(0)
+    passed=True
+    for showTubes,lineSpace,tolerance in [(False,1,0),(True,1,0),(True,3,0.5)]:
+        params=_TestParams(showTubes,lineSpace,tolerance)
+        picker=GetFiberPicker(inpd,params)
+        lineNums=SelectLineNums(inpd,params)
+        renderIndex=GetRenderFiberIndex(inpd,params)
+        rows,counts=renderIndex.GetLineRows(lineNums)
+        pids=renderIndex.pointIds[rows]
+        positions=fiberIndex.points[pids]
+        radii=GetTubeRadii(inpd,params,pids) \
+            if showTubes else np.full(positions.shape[0],PICK_RADIUS)
+        same=True
+        hits=0
+        for i in range(numRays):
+            target=positions[rng.randint(positions.shape[0])]
+            direction=rng.randn(3)
+            origin=target-direction*50
+            expected=_BruteForceRay(positions,radii,counts,origin,direction)
+            hit=picker.bvh.CastRay(origin,direction)
+            if expected is None or hit is None:
+                same=same and expected is hit
+                continue
+            hits+=1
+            same=same and abs(hit[0]-expected[0])<1e-9
+            pick=picker.Pick(origin,direction)
+            ids=fiberIndex.GetLinePointIds(pick.lineNum)
+            same=same and pick.lineNum in lineNums and pick.pointId in ids and \
+                pick.glyphPointId is None and pick.tensor1 is None
+        same=same and GetFiberPicker(inpd,dict(params,lineNum=7)) is picker
+        print 'tubes' if showTubes else 'lines','lineSpace %d tolerance %.1f:'% \
+            (lineSpace,tolerance),hits,'hits,','identical' if same else 'DIFFERENT'
+        passed=passed and same
+
+    same=_CylinderTest()
+    print 'cylinder distances:','identical' if same else 'DIFFERENT'
+    passed=passed and same
+    for showTensors in [(True,False),(True,True),(False,False)]:
+        params=_TestParams(False,3,0,showTensors)
+        picker=GetFiberPicker(inpd,params)
+        glyphs=GetGlyphPicker(inpd,params)
+        lineNums=SelectLineNums(inpd,params)
+        rows,counts=fiberIndex.GetLineRows(lineNums)
+        centers=fiberIndex.points[fiberIndex.pointIds[rows]][GetGlyphIndex(counts,10)]
+        same=True
+        hits=0
+        for i in range(numRays):
+            target=centers[rng.randint(centers.shape[0])]
+            direction=rng.randn(3)
+            origin=target-direction*50
+            distances=CylinderRayDistances(origin,direction/np.linalg.norm(direction), \
+                glyphs.centers,glyphs.axes)
+            hit=glyphs.CastRay(origin,direction)
+            if hit is None:
+                same=same and not np.isfinite(distances).any()
+                continue
+            hits+=1
+            same=same and abs(hit[0]-distances.min())<1e-9
+            pick=picker.Pick(origin,direction,glyphs)
+            fiberHit=picker.bvh.CastRay(origin,direction)
+            if fiberHit is not None and fiberHit[0]<hit[0]:
+                same=same and pick.glyphPointId is None
+                continue
+            ids=fiberIndex.GetLinePointIds(pick.lineNum)
+            same=same and pick.lineNum in lineNums and pick.glyphPointId in ids and \
+                pick.glyphPointId==glyphs.pointIds[hit[1]]
+            same=same and (pick.tensor1 is not None)==showTensors[0] and \
+                (pick.tensor2 is not None)==showTensors[1]
+        same=same and GetGlyphPicker(inpd,dict(params,glyphScale=1000)) is not glyphs and \
+            GetFiberPicker(inpd,dict(params,glyphScale=1000)) is picker
+        print 'glyphs of tensor1 %s, tensor2 %s:'%showTensors,hits,'hits,', \
+            'identical' if same else 'DIFFERENT'
+        passed=passed and same
+    return passed
+
+#==============================================================================
+# PickBenchmark(numLines=20000,numPoints=100,numRays=200)
+#    Time building the hierarchy and casting rays on random walk lines.
+#==============================================================================
+def PickBenchmark(numLines=20000,numPoints=100,numRays=200):
+    rng=np.random.RandomState(0)
+    starts=rng.rand(numLines,1,3)*100
+    positions=(starts+np.cumsum(rng.randn(numLines,numPoints,3)*0.5,axis=1)). \
+        reshape(-1,3)
+    counts=np.full(numLines,numPoints,dtype=np.int64)
+    radii=np.full(positions.shape[0],0.2)
+    t=time.time()
+    bvh=SegmentBVH(positions,radii,counts)
+    print 'segments: %d, levels: %d, build: %.3f s'% \
+        (bvh.GetNumberOfSegments(),len(bvh.levels),time.time()-t)
+    t=time.time()
+    hits=0
+    for i in range(numRays):
+        target=positions[rng.randint(positions.shape[0])]
+        direction=rng.randn(3)
+        hits+=bvh.CastRay(target-direction*200,direction) is not None
+    print 'ray: %.2f ms, %d of %d hit'%(1000*(time.time()-t)/numRays,hits,numRays)
@@ -0,0 +1,617 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It reads polydata files straight into numpy arrays.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import os
+import shutil
+import tempfile
+import time
+import urllib
+import zlib
+from xml.etree import ElementTree
+
+import numpy as np
+
+import vtk
+from vtk.util import numpy_support
+
+from PolyDataLib import *
+from TensorLib import _TestDataFile
+
+#==============================================================================
+# PolyDataFile(filename)
+#    The arrays of a polydata file.
+#    points: (N,3) array.
+#    cells: 'VERTICES','LINES','POLYGONS','TRIANGLE_STRIPS' -> (numCells,
+#    legacy) for the legacy [n,id0,id1,...] layout, or (numCells,offsets,
+#    connectivity).
+#    pointArrays, cellArrays: name -> (tuples,components) array; the names
+#    in file order are in pointArrayNames, cellArrayNames, and the arrays
+#    read as SCALARS, TENSORS, ... are in pointAttributes, cellAttributes.
+#    Readers may leave the points, cells and arrays as loaders: they are
+#    read on first access (see LazyArrays).
+#==============================================================================
+class PolyDataFile:
+    def __init__(self,filename):
+        self.filename=filename
+        self.pointsLoader=None
+        self.cells=LazyArrays()
+        self.pointArrays=LazyArrays()
+        self.pointArrayNames=[]
+        self.pointAttributes={}
+        self.cellArrays=LazyArrays()
+        self.cellArrayNames=[]
+        self.cellAttributes={}
+
+    def __getattr__(self,name):
+        # points are read on first access
+        if name!='points':
+            raise AttributeError(name)
+        if self.pointsLoader is None:
+            self.points=np.zeros((0,3),dtype=np.float32)
+        else:
+            self.points=self.pointsLoader()
+        return self.points
+
+    def GetNumberOfPoints(self):
+        return self.points.shape[0]
+
+    def GetPointArray(self,name):
+        # same lookup as ArrayRegistry: case insensitive, first one wins
+        for key in self.pointArrayNames:
+            if key.upper()==name.upper():
+                return self.pointArrays[key]
+        return None
+
+    def GetCells(self,section):
+        # (offsets,pointIds) of the cells of section
+        cells=self.cells.get(section)
+        if cells is None:
+            return np.zeros(1,dtype=np.int64),np.zeros(0,dtype=np.int64)
+        if len(cells)==3:
+            return cells[1].astype(np.int64),cells[2].astype(np.int64)
+        return UnpackLegacyCells(cells[1],cells[0])
+
+    def GetFiberIndex(self):
+        offsets,pointIds=self.GetCells('LINES')
+        return FiberIndex(offsets,pointIds,self.points)
+
+    def ToPolyData(self):
+        # a vtkPolyData with native byte order copies of the arrays
+        inpd=vtk.vtkPolyData()
+        points=vtk.vtkPoints()
+        points.SetData(_ToVTKArray(self.points))
+        inpd.SetPoints(points)
+        for section,setter in [('VERTICES',inpd.SetVerts),('LINES',inpd.SetLines), \
+                               ('POLYGONS',inpd.SetPolys), \
+                               ('TRIANGLE_STRIPS',inpd.SetStrips)]:
+            if section in self.cells:
+                setter(_ToVTKCellArray(self.cells[section]))
+
+        for names,arrays,attributes,data in \
+            [(self.pointArrayNames,self.pointArrays,self.pointAttributes, \
+              inpd.GetPointData()), \
+             (self.cellArrayNames,self.cellArrays,self.cellAttributes, \
+              inpd.GetCellData())]:
+            for name in names:
+                array=_ToVTKArray(arrays[name])
+                array.SetName(name)
+                attribute=attributes.get(name)
+                if attribute=='SCALARS':
+                    data.SetScalars(array)
+                elif attribute=='VECTORS':
+                    data.SetVectors(array)
+                elif attribute=='NORMALS':
+                    data.SetNormals(array)
+                elif attribute=='TENSORS':
+                    data.SetTensors(array)
+                elif attribute=='TEXTURE_COORDINATES':
+                    data.SetTCoords(array)
+                else:
+                    data.AddArray(array)
+        return inpd
+
+#==============================================================================
+# LazyArrays()
+#    A dict whose values may be Loader objects, which are called on first
+#    access and replaced by what they return. shapes[key] is the
+#    (tuples,components) shape of the array, known without loading it.
+#==============================================================================
+class Loader:
+    def __init__(self,function,*args):
+        self.function=function
+        self.args=args
+
+    def __call__(self):
+        return self.function(*self.args)
+
+class LazyArrays(dict):
+    def __init__(self):
+        dict.__init__(self)
+        self.shapes={}
+
+    def __getitem__(self,key):
+        value=dict.__getitem__(self,key)
+        if isinstance(value,Loader):
+            value=value()
+            dict.__setitem__(self,key,value)
+        return value
+
+    def get(self,key,default=None):
+        return self[key] if key in self else default
+
+    def IsLoaded(self,key):
+        return not isinstance(dict.__getitem__(self,key),Loader)
+
+def _ToVTKArray(values):
+    values=np.ascontiguousarray(values,dtype=values.dtype.newbyteorder('='))
+    return numpy_support.numpy_to_vtk(values,deep=1)
+
+def _ToVTKCellArray(cells):
+    if len(cells)==3:
+        numCells,offsets,connectivity=cells
+        counts=np.diff(offsets.astype(np.int64))
+        legacy=np.empty(counts.shape[0]+connectivity.shape[0],dtype=np.int64)
+        heads=offsets[:-1].astype(np.int64)+np.arange(counts.shape[0])
+        keep=np.ones(legacy.shape[0],dtype=bool)
+        keep[heads]=False
+        legacy[heads]=counts
+        legacy[keep]=connectivity
+    else:
+        numCells,legacy=cells
+    cellArray=vtk.vtkCellArray()
+    cellArray.SetCells(numCells,numpy_support.numpy_to_vtkIdTypeArray( \
+        np.ascontiguousarray(legacy,dtype=numpy_support.ID_TYPE_CODE),deep=1))
+    return cellArray
+
+#==============================================================================
+# Legacy .vtk parsing
+#==============================================================================
+_LEGACY_TYPES={'unsigned_char':'u1','char':'i1','unsigned_short':'u2', \
+    'short':'i2','unsigned_int':'u4','int':'i4','unsigned_long':'u8', \
+    'long':'i8','float':'f4','double':'f8','vtkidtype':'i8', \
+    'vtktypeint8':'i1','vtktypeuint8':'u1','vtktypeint16':'i2', \
+    'vtktypeuint16':'u2','vtktypeint32':'i4','vtktypeuint32':'u4', \
+    'vtktypeint64':'i8','vtktypeuint64':'u8'}
+
+_CELL_SECTIONS=['VERTICES','LINES','POLYGONS','TRIANGLE_STRIPS']
+
+_ATTRIBUTE_COMPONENTS={'VECTORS':3,'NORMALS':3,'TENSORS':9,'TENSORS6':6}
+
+class _LegacyReader:
+    def __init__(self,filename):
+        self.data=np.memmap(filename,dtype=np.uint8,mode='r')
+        self.size=self.data.shape[0]
+        self.pos=0
+        self.binary=False
+
+    def ReadLine(self):
+        end=self.pos
+        while end<self.size:
+            chunk=self.data[end:end+256].tostring()
+            k=chunk.find('\n')
+            if k>=0:
+                end+=k
+                break
+            end+=len(chunk)
+        line=self.data[self.pos:end].tostring()
+        self.pos=min(end+1,self.size)
+        return line.rstrip('\r')
+
+    def ReadWords(self):
+        # words of the next non empty line, [] at the end of the file
+        while self.pos<self.size:
+            words=self.ReadLine().split()
+            if words:
+                return words
+        return []
+
+    def ReadArray(self,typeName,count):
+        if typeName.lower() not in _LEGACY_TYPES:
+            raise ValueError('Unsupported data type: '+typeName)
+        if not self.binary:
+            dtype=np.dtype(_LEGACY_TYPES[typeName.lower()])
+            values=[]
+            while len(values)<count:
+                words=self.ReadWords()
+                if not words:
+                    raise ValueError('Unexpected end of file')
+                values.extend(words)
+            return np.array(values[:count],dtype=dtype)
+        # legacy binary files are big-endian
+        dtype=np.dtype('>'+_LEGACY_TYPES[typeName.lower()])
+        if self.pos+count*dtype.itemsize>self.size:
+            raise ValueError('Unexpected end of file')
+        values=np.frombuffer(self.data,dtype=dtype,count=count,offset=self.pos)
+        self.pos+=count*dtype.itemsize
+        return values
+
+def _DecodeName(name):
+    # the writer escapes spaces and other characters as %xx
+    return urllib.unquote(name)
+
+def _AddArray(arrays,names,attributes,name,values,attribute=None,shape=None):
+    if name not in arrays:
+        names.append(name)
+    arrays[name]=values
+    arrays.shapes[name]=values.shape if shape is None else shape
+    if attribute is not None:
+        attributes[name]=attribute
+
+#==============================================================================
+# ReadLegacyPolyData(filename)
+#    Read a legacy .vtk POLYDATA file into a PolyDataFile.
+#    The file is memory mapped and every section of a BINARY file is a
+#    big-endian numpy view of it, nothing is copied or converted until used.
+#    ASCII files are parsed into native arrays.
+#==============================================================================
+def ReadLegacyPolyData(filename):
+    reader=_LegacyReader(filename)
+    pd=PolyDataFile(filename)
+
+    if not reader.ReadLine().startswith('# vtk DataFile'):
+        raise ValueError('Not a legacy VTK file: '+filename)
+    reader.ReadLine()
+    reader.binary=reader.ReadWords()[0].upper()=='BINARY'
+    words=reader.ReadWords()
+    if len(words)<2 or words[1].upper()!='POLYDATA':
+        raise ValueError('Not a polydata file: '+filename)
+
+    arrays,names,attributes=None,None,None
+    count=0
+    while True:
+        words=reader.ReadWords()
+        if not words:
+            break
+        key=words[0].upper()
+        if key=='POINTS':
+            num=int(words[1])
+            pd.points=reader.ReadArray(words[2],num*3).reshape(num,3)
+        elif key in _CELL_SECTIONS:
+            numCells,size=int(words[1]),int(words[2])
+            pos=reader.pos
+            nextWords=reader.ReadWords()
+            if nextWords and nextWords[0].upper()=='OFFSETS':
+                # file version 5: numCells is the number of offsets
+                offsets=reader.ReadArray(nextWords[1],numCells)
+                nextWords=reader.ReadWords()
+                connectivity=reader.ReadArray(nextWords[1],size)
+                pd.cells[key]=(numCells-1,offsets,connectivity)
+            else:
+                reader.pos=pos
+                pd.cells[key]=(numCells,reader.ReadArray('int',size))
+        elif key in ('POINT_DATA','CELL_DATA'):
+            count=int(words[1])
+            if key=='POINT_DATA':
+                arrays,names,attributes= \
+                    pd.pointArrays,pd.pointArrayNames,pd.pointAttributes
+            else:
+                arrays,names,attributes= \
+                    pd.cellArrays,pd.cellArrayNames,pd.cellAttributes
+        elif key=='METADATA':
+            _SkipMetaData(reader)
+        elif arrays is None:
+            raise ValueError('Unsupported section '+key+' in '+filename)
+        elif key=='SCALARS':
+            comps=int(words[3]) if len(words)>3 else 1
+            pos=reader.pos
+            if reader.ReadWords()[:1]!=['LOOKUP_TABLE']:
+                reader.pos=pos
+            _AddArray(arrays,names,attributes,_DecodeName(words[1]), \
+                reader.ReadArray(words[2],count*comps).reshape(count,comps),key)
+        elif key=='COLOR_SCALARS':
+            comps=int(words[2])
+            if reader.binary:
+                values=reader.ReadArray('unsigned_char',count*comps)
+            else:
+                values=(reader.ReadArray('float',count*comps)*255).astype(np.uint8)
+            _AddArray(arrays,names,attributes,_DecodeName(words[1]), \
+                values.reshape(count,comps),'SCALARS')
+        elif key in _ATTRIBUTE_COMPONENTS:
+            comps=_ATTRIBUTE_COMPONENTS[key]
+            values=reader.ReadArray(words[2],count*comps).reshape(count,comps)
+            if key=='TENSORS6':
+                # xx,yy,zz,xy,yz,xz to the full 3x3 matrix
+                values=values[:,[0,3,5,3,1,4,5,4,2]]
+            _AddArray(arrays,names,attributes,_DecodeName(words[1]),values, \
+                'TENSORS' if key=='TENSORS6' else key)
+        elif key=='TEXTURE_COORDINATES':
+            comps=int(words[2])
+            _AddArray(arrays,names,attributes,_DecodeName(words[1]), \
+                reader.ReadArray(words[3],count*comps).reshape(count,comps),key)
+        elif key=='LOOKUP_TABLE':
+            size=int(words[2])
+            if reader.binary:
+                reader.ReadArray('unsigned_char',size*4)
+            else:
+                reader.ReadArray('float',size*4)
+        elif key=='FIELD':
+            for k in range(int(words[2])):
+                fieldWords=reader.ReadWords()
+                if fieldWords[0].upper()=='NULL_ARRAY':
+                    continue
+                comps,tuples=int(fieldWords[1]),int(fieldWords[2])
+                _AddArray(arrays,names,attributes,_DecodeName(fieldWords[0]), \
+                    reader.ReadArray(fieldWords[3],comps*tuples).reshape(tuples,comps))
+                pos=reader.pos
+                if reader.ReadWords()[:1]==['METADATA']:
+                    _SkipMetaData(reader)
+                else:
+                    reader.pos=pos
+        else:
+            raise ValueError('Unsupported section '+key+' in '+filename)
+    return pd
+
+def _SkipMetaData(reader):
+    # information keys up to an empty line
+    while reader.pos<reader.size and reader.ReadLine().strip():
+        pass
+
+#==============================================================================
+# XML .vtp parsing
+#==============================================================================
+_XML_TYPES={'Int8':'i1','UInt8':'u1','Int16':'i2','UInt16':'u2', \
+    'Int32':'i4','UInt32':'u4','Int64':'i8','UInt64':'u8', \
+    'Float32':'f4','Float64':'f8'}
+
+_XML_CELL_SECTIONS={'Verts':'VERTICES','Lines':'LINES','Polys':'POLYGONS', \
+    'Strips':'TRIANGLE_STRIPS'}
+
+_XML_ATTRIBUTES={'Scalars':'SCALARS','Vectors':'VECTORS','Normals':'NORMALS', \
+    'Tensors':'TENSORS','TCoords':'TEXTURE_COORDINATES'}
+
+class _AppendedData:
+    def __init__(self,filename,start,byteOrder,headerType,compressed):
+        self.data=np.memmap(filename,dtype=np.uint8,mode='r')
+        self.start=start
+        order='<' if byteOrder=='LittleEndian' else '>'
+        self.order=order
+        self.headerType=np.dtype(order+_XML_TYPES[headerType])
+        self.compressed=compressed
+
+    def _Header(self,pos,count):
+        return np.frombuffer(self.data,dtype=self.headerType,count=count, \
+            offset=pos).astype(np.int64)
+
+    def ReadBlock(self,offset,typeName,comps):
+        # the DataArray at offset in the appended data, a view of the map
+        # when it is not compressed
+        dtype=np.dtype(self.order+_XML_TYPES[typeName])
+        pos=self.start+offset
+        size=self.headerType.itemsize
+        if not self.compressed:
+            nbytes=int(self._Header(pos,1)[0])
+            values=np.frombuffer(self.data,dtype=dtype, \
+                count=nbytes//dtype.itemsize,offset=pos+size)
+        else:
+            numBlocks,blockSize,lastSize=self._Header(pos,3)
+            sizes=self._Header(pos+3*size,int(numBlocks))
+            pos+=(3+int(numBlocks))*size
+            raw=bytearray()
+            for blockBytes in sizes:
+                raw.extend(zlib.decompress( \
+                    self.data[pos:pos+blockBytes].tostring()))
+                pos+=blockBytes
+            values=np.frombuffer(raw,dtype=dtype, \
+                count=len(raw)//dtype.itemsize)
+        return values.reshape(-1,comps)
+
+def _ReadXMLHeader(filename):
+    # the XML text up to the appended data and where that data begins
+    header=''
+    with open(filename,'rb') as f:
+        while True:
+            chunk=f.read(65536)
+            if not chunk:
+                raise ValueError('No appended data in '+filename)
+            header+=chunk
+            tag=header.find('<AppendedData')
+            if tag<0:
+                continue
+            mark=header.find('_',header.find('>',tag))
+            if mark>=0:
+                break
+    tag=header.find('<AppendedData')
+    element=header[tag:header.find('>',tag)+1]
+    text=header[:tag]+element+'</AppendedData></VTKFile>'
+    return text,mark+1
+
+def _LoadCells(appended,connectivity,offsets):
+    # XML offsets are the ends of the cells
+    ends=appended.ReadBlock(*offsets)[:,0]
+    starts=np.zeros(ends.shape[0]+1,dtype=ends.dtype)
+    starts[1:]=ends
+    return (ends.shape[0],starts,appended.ReadBlock(*connectivity)[:,0])
+
+#==============================================================================
+# ReadXMLPolyData(filename)
+#    Read a .vtp file with appended raw data into a PolyDataFile.
+#    Only the XML header is parsed: the points, cells and arrays are read
+#    on first access as views of a memory map of the file, or decompressed
+#    then when the file is zlib compressed.
+#==============================================================================
+def ReadXMLPolyData(filename):
+    text,start=_ReadXMLHeader(filename)
+    root=ElementTree.fromstring(text)
+    if root.get('type')!='PolyData':
+        raise ValueError('Not a polydata file: '+filename)
+    appendedData=root.find('AppendedData')
+    if appendedData.get('encoding')!='raw':
+        raise ValueError('Only raw appended data is supported: '+filename)
+    compressor=root.get('compressor')
+    if compressor not in (None,'','vtkZLibDataCompressor'):
+        raise ValueError('Unsupported compressor '+compressor+' in '+filename)
+    appended=_AppendedData(filename,start,root.get('byte_order','LittleEndian'), \
+        root.get('header_type','UInt32'),bool(compressor))
+
+    def Block(element):
+        if element.get('format')!='appended':
+            raise ValueError('DataArray '+element.get('Name','')+ \
+                ' is not in the appended data of '+filename)
+        return (int(element.get('offset')),element.get('type'), \
+            int(element.get('NumberOfComponents','1')))
+
+    pd=PolyDataFile(filename)
+    piece=root.find('PolyData').find('Piece')
+    points=piece.find('Points')
+    if points is not None and points.find('DataArray') is not None:
+        pd.pointsLoader=Loader(appended.ReadBlock,*Block(points.find('DataArray')))
+
+    for tag,section in _XML_CELL_SECTIONS.items():
+        element=piece.find(tag)
+        if element is None or int(piece.get('NumberOf'+tag,'0'))==0:
+            continue
+        blocks=dict((array.get('Name'),Block(array)) \
+            for array in element.findall('DataArray'))
+        pd.cells[section]=Loader(_LoadCells,appended,blocks['connectivity'], \
+            blocks['offsets'])
+
+    numCells=sum(int(piece.get('NumberOf'+tag,'0')) for tag in _XML_CELL_SECTIONS)
+    for tag,arrays,names,attributes,count in \
+        [('PointData',pd.pointArrays,pd.pointArrayNames,pd.pointAttributes, \
+          int(piece.get('NumberOfPoints','0'))), \
+         ('CellData',pd.cellArrays,pd.cellArrayNames,pd.cellAttributes,numCells)]:
+        element=piece.find(tag)
+        if element is None:
+            continue
+        for array in element.findall('DataArray'):
+            name=array.get('Name')
+            block=Block(array)
+            _AddArray(arrays,names,attributes,name, \
+                Loader(appended.ReadBlock,*block),shape=(count,block[2]))
+        for key,attribute in _XML_ATTRIBUTES.items():
+            if element.get(key) in arrays:
+                attributes[element.get(key)]=attribute
+    return pd
+
+#==============================================================================
+# ReadPolyDataFile(filename)
+#    Read a .vtk or .vtp file into a PolyDataFile.
+#==============================================================================
+def ReadPolyDataFile(filename):
+    if filename.upper().endswith('.VTP'):
+        return ReadXMLPolyData(filename)
+    return ReadLegacyPolyData(filename)
+
+#==============================================================================
+# For Test
+#==============================================================================
+def _ReadWithVTK(filename):
+    if filename.upper().endswith('.VTP'):
+        reader=vtk.vtkXMLPolyDataReader()
+        reader.SetFileName(filename)
+        reader.Update()
+        return reader.GetOutput()
+    reader=vtk.vtkPolyDataReader()
+    reader.SetFileName(filename)
+    reader.ReadAllScalarsOn()
+    reader.ReadAllVectorsOn()
+    reader.ReadAllNormalsOn()
+    reader.ReadAllTensorsOn()
+    reader.ReadAllFieldsOn()
+    reader.Update()
+    return reader.GetOutput()
+
+def _SamePolyData(pd,inpd):
+    # every array of pd must equal that of the VTK polydata inpd
+    same=np.array_equal(pd.points, \
+        numpy_support.vtk_to_numpy(inpd.GetPoints().GetData()))
+    for section,cells in [('VERTICES',inpd.GetVerts()),('LINES',inpd.GetLines()), \
+                          ('POLYGONS',inpd.GetPolys()), \
+                          ('TRIANGLE_STRIPS',inpd.GetStrips())]:
+        legacy=numpy_support.vtk_to_numpy(cells.GetData())
+        if section in pd.cells:
+            offsets,pointIds=pd.GetCells(section)
+            expected=UnpackLegacyCells(legacy,cells.GetNumberOfCells())
+            same=same and np.array_equal(offsets,expected[0]) and \
+                np.array_equal(pointIds,expected[1])
+        else:
+            same=same and legacy.shape[0]==0
+    for names,arrays,data in [(pd.pointArrayNames,pd.pointArrays,inpd.GetPointData()), \
+                              (pd.cellArrayNames,pd.cellArrays,inpd.GetCellData())]:
+        same=same and len(names)==data.GetNumberOfArrays()
+        for name in names:
+            array=data.GetArray(name)
+            if array is None:
+                return False
+            expected=numpy_support.vtk_to_numpy(array).reshape(arrays[name].shape)
+            same=same and np.array_equal(arrays[name],expected)
+    return same
+
+#==============================================================================
+# PolyDataFileTest(filename=None)
+#    The numpy readers must give exactly what the VTK readers read, as
+#    must the vtkPolyData rebuilt from it.
+#==============================================================================
+def PolyDataFileTest(filename=None):
+    if filename is None:
+        filename=_TestDataFile()
+
+    t=time.time()
+    inpd=_ReadWithVTK(filename)
+    tvtk=time.time()-t
+    t=time.time()
+    pd=ReadPolyDataFile(filename)
+    fiberIndex=pd.GetFiberIndex()
+    tnumpy=time.time()-t
+    print 'VTK reader: %.4f s, ReadPolyDataFile: %.4f s'%(tvtk,tnumpy)
+
+    passed=_SamePolyData(pd,inpd)
+    print 'arrays:','identical' if passed else 'DIFFERENT'
+
+    expected=BuildFiberIndex(inpd)
+    same=np.array_equal(fiberIndex.offsets,expected.offsets) and \
+         np.array_equal(fiberIndex.pointIds,expected.pointIds) and \
+         np.array_equal(fiberIndex.GetLinePoints(1),expected.GetLinePoints(1))
+    print 'fiber index:','identical' if same else 'DIFFERENT'
+    passed=passed and same
+
+    same=_SamePolyData(pd,pd.ToPolyData())
+    print 'round trip:','identical' if same else 'DIFFERENT'
+    return passed and same
+
+#==============================================================================
+# XMLPolyDataTest(filename=None)
+#    Write filename as raw and zlib compressed .vtp files, which must read
+#    as PolyDataFileTest expects, loading no array before it is used.
+#==============================================================================
+def XMLPolyDataTest(filename=None):
+    if filename is None:
+        filename=_TestDataFile()
+    inpd=_ReadWithVTK(filename)
+    folder=tempfile.mkdtemp()
+    passed=True
+    try:
+        for compressed in [False,True]:
+            vtpFile=os.path.join(folder,'zlib.vtp' if compressed else 'raw.vtp')
+            writer=vtk.vtkXMLPolyDataWriter()
+            writer.SetInputData(inpd)
+            writer.SetFileName(vtpFile)
+            writer.SetDataModeToAppended()
+            writer.EncodeAppendedDataOff()
+            if not compressed:
+                writer.SetCompressorTypeToNone()
+            writer.Write()
+            print os.path.basename(vtpFile)
+
+            pd=ReadXMLPolyData(vtpFile)
+            lazy=not any(pd.pointArrays.IsLoaded(name) for name in pd.pointArrayNames)
+            pd.GetPointArray('tensor1')
+            lazy=lazy and pd.pointArrays.IsLoaded('tensor1') and \
+                not pd.pointArrays.IsLoaded('FA1')
+            print 'lazy arrays:','yes' if lazy else 'NO'
+            passed=passed and lazy and PolyDataFileTest(vtpFile)
+    finally:
+        shutil.rmtree(folder)
+    return passed
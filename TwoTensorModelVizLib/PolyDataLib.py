@@ -15,13 +15,29 @@ zhwenyao@bit.edu.cn
 
 import numpy as np
 import vtk
+from vtk.util import numpy_support
 
 #==============================================================================
-# LoadPolyData(filename, showFileInfo=0)
+# LoadPolyData(filename, showFileInfo=0, cache=False)
 #    Load the poly data from the file, and
 #    return a inpd (vtkPolyData) object
+#    cache=True keeps the arrays and what is derived from them in a sidecar
+#    cache next to the file and maps it on later loads (see SidecarCacheLib)
 #==============================================================================
-def LoadPolyData(filename, showFileInfo=0):
+def LoadPolyData(filename, showFileInfo=0, cache=False):
+    if cache:
+        from SidecarCacheLib import LoadCachedPolyData
+        inpd=LoadCachedPolyData(filename)
+    else:
+        inpd=ReadPolyData(filename)
+    
+    if showFileInfo==1:
+        print "Polydata File:",filename
+        ShowPolyDataInfo(inpd)
+
+    return inpd
+
+def ReadPolyData(filename):
     loc=filename.rfind(".");
     extension = filename[loc:filename.__len__()];
     extension =extension.upper();
@@ -37,11 +53,6 @@ def LoadPolyData(filename, showFileInfo=0):
         polyDataReader.SetFileName( filename );
         polyDataReader.Update();
         inpd = polyDataReader.GetOutput();
-    
-    if showFileInfo==1:
-        print "Polydata File:",filename
-        ShowPolyDataInfo(inpd)
-
     return inpd
 
 #==============================================================================
@@ -86,66 +97,340 @@ def ShowPolyDataInfo(inpd):
             print "    Size:", array.GetSize()
 
 
+#==============================================================================
+# _GetCachedObject(cache,key,mtime,builder,*args,**kwargs)
+#    Return cache[key] if it was built at mtime, otherwise call
+#    builder(*args), store the result with mtime and return it.
+#    The cache is emptied when it holds maxEntries objects (default 8).
+#==============================================================================
+def _GetCachedObject(cache,key,mtime,builder,*args,**kwargs):
+    maxEntries=kwargs.get('maxEntries',8)
+    entry=cache.get(key)
+    if entry is None or entry[0]!=mtime:
+        if len(cache)>=maxEntries:
+            cache.clear()
+        entry=(mtime,builder(*args))
+        cache[key]=entry
+    return entry[1]
+
+def _SetCachedObject(cache,key,mtime,obj,maxEntries=8):
+    # store an object built elsewhere, as _GetCachedObject would
+    if key not in cache and len(cache)>=maxEntries:
+        cache.clear()
+    cache[key]=(mtime,obj)
+
+#==============================================================================
+# ArrayRegistry(inpd)
+#    Case-insensitive lookup tables for the point and cell arrays of inpd.
+#    Each name maps to the vtkDataArray and to a numpy view of its values,
+#    so a lookup in the render loop is a single dict access.
+#    When several arrays share a name, the first one wins.
+#==============================================================================
+class ArrayRegistry:
+    def __init__(self,inpd):
+        self.pointArrays,self.pointValues=self._Register(inpd.GetPointData())
+        self.cellArrays,self.cellValues=self._Register(inpd.GetCellData())
+    
+    def _Register(self,fieldData):
+        arrays={}
+        values={}
+        for ia in range(0,fieldData.GetNumberOfArrays()):
+            array=fieldData.GetArray(ia)
+            name=fieldData.GetArrayName(ia)
+            if array is None or name is None:
+                continue
+            key=str.upper(name)
+            if key in arrays:
+                continue
+            arrays[key]=array
+            try:
+                values[key]=numpy_support.vtk_to_numpy(array)
+            except Exception:
+                # e.g. vtkBitArray has no numpy view
+                values[key]=None
+        return arrays,values
+    
+    def HasPointArray(self,name):
+        return str.upper(name) in self.pointArrays
+    
+    def GetPointArray(self,name):
+        return self.pointArrays.get(str.upper(name))
+    
+    def GetPointValues(self,name):
+        return self.pointValues.get(str.upper(name))
+    
+    def GetCellArray(self,name):
+        return self.cellArrays.get(str.upper(name))
+    
+    def GetCellValues(self,name):
+        return self.cellValues.get(str.upper(name))
+
+#==============================================================================
+# GetArrayRegistry(inpd)
+#    Return the ArrayRegistry of inpd. It is rebuilt only when inpd or its
+#    point data have been modified since the last call.
+#==============================================================================
+_arrayRegistryCache={}
+
+def GetArrayRegistry(inpd):
+    key=inpd.GetAddressAsString('vtkPolyData')
+    mtime=(inpd.GetMTime(),inpd.GetPointData().GetMTime())
+    return _GetCachedObject(_arrayRegistryCache,key,mtime,ArrayRegistry,inpd)
+
 #==============================================================================
 # GetPointArrayByName(inpd,name)
 #==============================================================================
 def GetPointArrayByName(inpd,name):
-    inpointdata = inpd.GetPointData()
-    for ia in range(0,inpointdata.GetNumberOfArrays()):
-        #print inpointdata.GetArrayName(ia)
-        if str.upper(inpointdata.GetArrayName(ia))==str.upper(name):
-            retArray=inpointdata.GetArray(ia)
-            #print 'True return'
-            return retArray
-    # print 'No array named ',name    
-    return None
+    return GetArrayRegistry(inpd).GetPointArray(name)
 
 #==============================================================================
 # GetCellArrayByName(inpd,name)
 #==============================================================================
 def GetCellArrayByName(inpd,name):
-    incelldata = inpd.GetCellData()
-    for ia in range(0,incelldata.GetNumberOfArrays()):
-        print incelldata.GetArrayName(ia)
-        if str.upper(incelldata.GetArrayName(ia))==str.upper(name):
-            retArray=incelldata.GetArray(ia)
-            print 'Found'
-            return retArray
+    return GetArrayRegistry(inpd).GetCellArray(name)
+
+#==============================================================================
+# ArrayStatistics(values=None,bins=256,fields=None)
+#    values: numpy array with one row per tuple
+#    Range, mean and histogram of the finite values of an array, each from
+#    one pass over them, without sorting or converting them. Multi-component
+#    arrays are summarized by the magnitude of their tuples (as
+#    vtkDataArray.GetRange(-1) does); the per-component ranges are kept in
+#    componentMin/componentMax. Percentiles are read from the histogram.
+#    fields: the ARRAY_STATISTICS_FIELDS (name -> value) of statistics
+#    computed before, instead of values; missing fields are None.
+#==============================================================================
+ARRAY_STATISTICS_FIELDS=['count','min','max','mean','histogram', \
+    'histogramEdges','componentMin','componentMax']
+
+class ArrayStatistics:
+    def __init__(self,values=None,bins=256,fields=None):
+        if fields is not None:
+            for field in ARRAY_STATISTICS_FIELDS:
+                setattr(self,field,fields.get(field))
+            return
+        values=np.asarray(values)
+        if values.ndim>1 and values.shape[1]>1:
+            finite=np.isfinite(values).all(axis=1)
+            if not finite.all():
+                values=values[finite]
+            self.componentMin=values.min(axis=0) if values.shape[0]>0 else None
+            self.componentMax=values.max(axis=0) if values.shape[0]>0 else None
+            values=np.sqrt(np.square(values,dtype=np.float64).sum(axis=1))
+        else:
+            values=values.reshape(-1)
+            finite=np.isfinite(values)
+            if not finite.all():
+                values=values[finite]
+            self.componentMin=None
+            self.componentMax=None
+        
+        self.count=values.shape[0]
+        if self.count==0:
+            self.min=None
+            self.max=None
+            self.mean=None
+            self.histogram=np.zeros(bins,dtype=np.int64)
+            self.histogramEdges=None
+            return
         
-    print 'No'
-    return None
+        self.min=float(values.min())
+        self.max=float(values.max())
+        self.mean=float(values.mean(dtype=np.float64))
+        self.histogram,self.histogramEdges=np.histogram(values,bins, \
+            range=(self.min,self.max))
+    
+    def GetRange(self):
+        return self.min,self.max
+    
+    def GetPercentile(self,q):
+        # interpolated in the cumulative histogram, within one bin width
+        if self.count==0:
+            return None
+        cumulative=np.concatenate(([0],np.cumsum(self.histogram)))
+        return float(np.interp(q/100.0*self.count,cumulative,self.histogramEdges))
+
+#==============================================================================
+# GetArrayStatistics(array,bins=256)
+#    array: vtkDataArray
+#    Return the ArrayStatistics of array. They are computed once and kept
+#    until the array is modified, or set by SetArrayStatistics.
+#==============================================================================
+_arrayStatisticsCache={}
+
+def _BuildArrayStatistics(array,bins):
+    return ArrayStatistics(numpy_support.vtk_to_numpy(array),bins)
+
+def GetArrayStatistics(array,bins=256):
+    key=(array.GetAddressAsString('vtkDataArray'),bins)
+    return _GetCachedObject(_arrayStatisticsCache,key,array.GetMTime(), \
+        _BuildArrayStatistics,array,bins,maxEntries=64)
+
+def SetArrayStatistics(array,statistics,bins=256):
+    key=(array.GetAddressAsString('vtkDataArray'),bins)
+    _SetCachedObject(_arrayStatisticsCache,key,array.GetMTime(),statistics, \
+        maxEntries=64)
 
 #==============================================================================
 # GetMinMaxInArray(array)
+#    Multi-component arrays return the range of the tuple magnitudes.
 #==============================================================================
 def GetMinMaxInArray(array):
-    if array.GetNumberOfComponents()>1:
-        min=None
-        max=None
-        return min,max
+    return GetArrayStatistics(array).GetRange()
+
+#==============================================================================
+# FiberIndex
+#    Columnar (CSR) layout of the lines in a polydata:
+#    offsets:  int64 array with L+1 entries, line i (0-based) owns
+#              pointIds[offsets[i]:offsets[i+1]]
+#    pointIds: int64 array with the point ids of all lines
+#    points:   (N,3) numpy view of the point coordinates
+#    Line numbers passed to the methods are 1,2,... as in GetLinePointList.
+#==============================================================================
+class FiberIndex:
+    def __init__(self,offsets,pointIds,points):
+        self.offsets=offsets
+        self.pointIds=pointIds
+        self.points=points
+        
+        # When the ids of every line are consecutive (the usual layout of
+        # tractography files), the coordinates of a line are a slice of
+        # points and can be returned without copying.
+        # Steps across the end of a line do not count; an empty line has
+        # no end of its own.
+        jumps=np.diff(pointIds)!=1
+        counts=np.diff(offsets)
+        ends=offsets[1:-1][counts[:-1]>0]-1
+        jumps[ends[ends<jumps.shape[0]]]=False
+        self.contiguous=not jumps.any()
+    
+    def GetNumberOfLines(self):
+        return self.offsets.shape[0]-1
+    
+    def GetNumberOfLinePoints(self,lineNum):
+        return int(self.offsets[lineNum]-self.offsets[lineNum-1])
+    
+    def GetLineRange(self,lineNum):
+        # positions of the line in pointIds
+        lineNum=min(lineNum,self.GetNumberOfLines())
+        return int(self.offsets[lineNum-1]),int(self.offsets[lineNum])
+    
+    def GetLinePointIds(self,lineNum):
+        start,end=self.GetLineRange(lineNum)
+        return self.pointIds[start:end]
+    
+    def GetLinePoints(self,lineNum):
+        pids=self.GetLinePointIds(lineNum)
+        if pids.shape[0]==0:
+            return self.points[0:0]
+        if self.contiguous:
+            first=pids[0]
+            return self.points[first:first+pids.shape[0]]
+        return self.points.take(pids,axis=0)
+    
+    def GetLineRows(self,lineNums):
+        # positions in pointIds of all points of the lines, one line after
+        # another, and the number of points of each line
+        lines=np.minimum(np.asarray(lineNums,dtype=np.int64).reshape(-1), \
+            self.GetNumberOfLines())-1
+        starts=self.offsets[lines]
+        counts=self.offsets[lines+1]-starts
+        total=int(counts.sum())
+        first=np.repeat(np.cumsum(counts)-counts,counts)
+        rows=np.repeat(starts,counts)+np.arange(total)-first
+        return rows,counts
+    
+    def GetSampledPointIds(self,lineNums,space):
+        # ids of the points space,2*space,... of each line, as the glyphs
+        # of RenderTensorWithCustomColors are placed
+        lines=np.asarray(lineNums,dtype=np.int64).reshape(-1)-1
+        starts=self.offsets[lines]
+        counts=np.maximum((self.offsets[lines+1]-starts-1)//space,0)
+        total=int(counts.sum())
+        if total==0:
+            return self.pointIds[0:0]
+        first=np.repeat(np.cumsum(counts)-counts,counts)
+        steps=np.arange(1,total+1)-first
+        return self.pointIds[np.repeat(starts,counts)+steps*space]
+
+#==============================================================================
+# UnpackLegacyCells(legacy,numCells)
+#    Split the legacy [n,id0,id1,...] cell layout into (offsets,pointIds).
+#    Only the cell sizes are read one by one, straight from the array.
+#==============================================================================
+def UnpackLegacyCells(legacy,numCells):
+    counts=np.empty(numCells,dtype=np.int64)
+    item=legacy.item
+    pos=0
+    for lidx in xrange(numCells):
+        count=item(pos)
+        counts[lidx]=count
+        pos+=count+1
+    offsets=np.zeros(numCells+1,dtype=np.int64)
+    np.cumsum(counts,out=offsets[1:])
+    keep=np.ones(legacy.shape[0],dtype=bool)
+    keep[offsets[:-1]+np.arange(numCells)]=False
+    pointIds=legacy[keep].astype(np.int64,copy=False)
+    return offsets,pointIds
+
+#==============================================================================
+# BuildFiberIndex(inpd)
+#    Build a FiberIndex from the lines of inpd.
+#    VTK 9 cell arrays are already stored as offsets/connectivity and are
+#    used without copying; the legacy [n,id0,id1,...] layout is unpacked once.
+#==============================================================================
+def BuildFiberIndex(inpd):
+    inlines=inpd.GetLines()
+    numLines=inlines.GetNumberOfCells()
+    
+    if hasattr(inlines,'GetOffsetsArray'):
+        offsets=numpy_support.vtk_to_numpy(inlines.GetOffsetsArray())
+        pointIds=numpy_support.vtk_to_numpy(inlines.GetConnectivityArray())
+        offsets=offsets.astype(np.int64,copy=False)
+        pointIds=pointIds.astype(np.int64,copy=False)
+    else:
+        legacy=numpy_support.vtk_to_numpy(inlines.GetData())
+        offsets,pointIds=UnpackLegacyCells(legacy,numLines)
     
-    min=array.GetComponent(0,0)
-    max=array.GetComponent(0,0)
-    for i in range(0,array.GetNumberOfTuples()):
-        if array.GetComponent(i,0)>max:
-            max=array.GetComponent(i,0)
-        if array.GetComponent(i,0)<min:
-            min=array.GetComponent(i,0)
-    return min,max
+    if inpd.GetPoints() is None:
+        points=np.zeros((0,3))
+    else:
+        points=numpy_support.vtk_to_numpy(inpd.GetPoints().GetData())
+    
+    return FiberIndex(offsets,pointIds,points)
+
+#==============================================================================
+# GetFiberIndex(inpd)
+#    Return the FiberIndex of inpd, building it only when the lines or the
+#    points of inpd have been modified since the last call.
+#    SetFiberIndex(inpd,fiberIndex) stores one read from a cache file.
+#==============================================================================
+_fiberIndexCache={}
+
+def _FiberIndexKey(inpd):
+    mtime=inpd.GetLines().GetMTime()
+    if inpd.GetPoints() is not None:
+        mtime=max(mtime,inpd.GetPoints().GetMTime())
+    return inpd.GetAddressAsString('vtkPolyData'),mtime
+
+def GetFiberIndex(inpd):
+    key,mtime=_FiberIndexKey(inpd)
+    return _GetCachedObject(_fiberIndexCache,key,mtime,BuildFiberIndex,inpd)
+
+def SetFiberIndex(inpd,fiberIndex):
+    key,mtime=_FiberIndexKey(inpd)
+    _SetCachedObject(_fiberIndexCache,key,mtime,fiberIndex)
 
 #==============================================================================
 # GetLinePointList(inpd,lineNum)
 #    lineNum=1,2,...
 #==============================================================================
 def GetLinePointList(inpd,lineNum):
-    if lineNum>inpd.GetNumberOfLines:
-        lineNum=inpd.GetNumberOfLines
+    pids=GetFiberIndex(inpd).GetLinePointIds(lineNum)
     ptids = vtk.vtkIdList()
-    inlines = inpd.GetLines()
-    inlines.InitTraversal();
-    for lidx in range(0,lineNum):
-        # fetch a line into ptids
-        inlines.GetNextCell(ptids)
+    ptids.SetNumberOfIds(pids.shape[0])
+    for i in range(0,pids.shape[0]):
+        ptids.SetId(i,pids[i])
     return ptids
 
 #==============================================================================
@@ -213,30 +498,39 @@ def GetMaxEigs(eigVects,eigVals):
 # If existed, return True, else False
 #==============================================================================
 def ExistTensor1(inpd):
-    inpointdata = inpd.GetPointData()
-    for ia in range(0,inpointdata.GetNumberOfArrays()):
-        if str.upper(inpointdata.GetArrayName(ia))==str.upper('tensor1'):
-           return True
-    
-    return False
+    return GetArrayRegistry(inpd).HasPointArray('tensor1')
 
 #==============================================================================
 # ExistTensor2(inpd)
-# Check if Tensor1 is existed in inpd.
+# Check if Tensor2 is existed in inpd.
 # If existed, return True, else False
 #==============================================================================
 def ExistTensor2(inpd):
-    inpointdata = inpd.GetPointData()
-    for ia in range(0,inpointdata.GetNumberOfArrays()):
-        if str.upper(inpointdata.GetArrayName(ia))==str.upper('tensor2'):
-           return True
-    
-    return False
+    return GetArrayRegistry(inpd).HasPointArray('tensor2')
 
 #==============================================================================
 # For Test
 #==============================================================================
+def FiberIndexTest():
+    # lines without points, at the end, in the middle and first
+    points=np.arange(30,dtype=np.float64).reshape(10,3)
+    passed=True
+    for offsets,pointIds in [([0,3,3],[5,6,7]),([0,0,3],[5,6,9]), \
+                             ([0,2,2,4],[0,1,5,6]),([0,0,2],[3,4])]:
+        fiberIndex=FiberIndex(np.array(offsets,dtype=np.int64), \
+            np.array(pointIds,dtype=np.int64),points)
+        same=True
+        for lineNum in range(1,fiberIndex.GetNumberOfLines()+1):
+            same=same and np.array_equal(fiberIndex.GetLinePoints(lineNum), \
+                points[fiberIndex.GetLinePointIds(lineNum)])
+        print offsets,pointIds,'contiguous' if fiberIndex.contiguous else 'gathered', \
+            'identical' if same else 'DIFFERENT'
+        passed=passed and same
+    return passed
+
 def PolyDataTest():
+    FiberIndexTest()
+    
     # Load the polydata
     #filename="E:\WorkInSPL\Proj-Lauren\FiberViz\MyTestFibers.vtp"
     filename="D:\TractsWork\TestData\Lipeng\GS_cc_caudalmiddlefrontal.vtp"
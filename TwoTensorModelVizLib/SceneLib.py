@@ -0,0 +1,643 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It keeps the rendered scene on the GPU between renders.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+from OpenGL.GL import *
+
+import numpy as np
+
+from PolyDataLib import *
+from LineRenderLib import *
+from TensorRenderLib import *
+from TubeRenderLib import *
+from BuilderLib import *
+from ParallelBuildLib import GetParallelBuilder,CloseParallelBuilder
+from ColorMapLib import GetColorIndex
+from SpatialIndexLib import GetFiberGrid,ConcatRanges
+from DecimateLib import GetRenderFiberIndex
+
+#==============================================================================
+# Parameters that change the scene.
+# The camera is not one of them, so rotating the view only redraws.
+#==============================================================================
+GEOMETRY_PARAMS=['lineNum','lineSpace','onlyOneLine', \
+    'roiType','roiCenter','roiRadius','roiSlabAxis', \
+    'showLines','showTensor1','showTensor2','showTubes', \
+    'glyphSpace','glyphScale','cylinderSlices','cylinderStacks', \
+    'bodRFlag','bodGFlag','bodBFlag','bodAFlag', \
+    'bodRValue','bodGValue','bodBValue','bodAValue', \
+    'bodRName','bodGName','bodBName','bodAName', \
+    'tubeScale','tubeSlices','tubeColorFlag','tubeSizeFlag', \
+    'tubeFixedColor','tubeFixedSize','tubeMappedToName','decimateTolerance']
+
+#==============================================================================
+# The parts of the retained scene that each parameter changes. A part is
+# updated when one of its parameters changed, or a part in PART_DEPENDENTS
+# it depends on was updated:
+#    selection   the lines drawn
+#    decimation  the simplified points of the lines and tubes
+#    lines       ranges drawn from the line buffer
+#    glyphs      glyph positions and orientations
+#    The glyphs and tubes of lines already built are kept when only the
+#    selection changes, see SceneCache.SelectChunks.
+#    glyphScale  glyph instance matrices
+#    glyphColors glyph instance colors
+#    tubes       tube mesh
+#    tubeColors  tube vertex colors
+#==============================================================================
+PARAM_PARTS={'lineNum':'selection','lineSpace':'selection', \
+    'onlyOneLine':'selection','roiType':'selection','roiCenter':'selection', \
+    'roiRadius':'selection','roiSlabAxis':'selection','showLines':'lines', \
+    'showTensor1':'glyphs','showTensor2':'glyphs','glyphSpace':'glyphs', \
+    'glyphScale':'glyphScale', \
+    'showTubes':'tubes','tubeScale':'tubes','tubeSlices':'tubes', \
+    'tubeSizeFlag':'tubes','tubeFixedSize':'tubes','tubeMappedToName':'tubes', \
+    'tubeColorFlag':'tubeColors','tubeFixedColor':'tubeColors', \
+    'decimateTolerance':'decimation'}
+for _c in 'RGBA':
+    for _p in ['Flag','Value','Name']:
+        PARAM_PARTS['bod'+_c+_p]='glyphColors'
+
+PART_DEPENDENTS={'selection':['lines'], \
+    'decimation':['lines','tubes'], \
+    'glyphs':['glyphScale','glyphColors'],'tubes':['tubeColors']}
+
+SCENE_PARTS=['selection','decimation','lines','glyphs','glyphScale','glyphColors', \
+    'tubes','tubeColors']
+
+def _ParamValue(value):
+    # qt.QColor is compared by its components
+    if hasattr(value,'red') and hasattr(value,'alpha'):
+        return (value.red(),value.green(),value.blue(),value.alpha())
+    return value
+
+def _SceneValues(params):
+    # lineNum only selects the lines with onlyOneLine
+    values=dict([(name,_ParamValue(params.get(name))) for name in GEOMETRY_PARAMS])
+    if not values['onlyOneLine']:
+        values['lineNum']=None
+    return values
+
+#==============================================================================
+# GetChangedParts(oldValues,values,params,unchanged=[])
+#    The scene parts to update when the parameter values (name -> value, see
+#    _ParamValue) change from oldValues to values. lineNum only counts with
+#    onlyOneLine. The parts in unchanged are known to stay the same although
+#    their parameters changed, such as a selection of the same lines.
+#==============================================================================
+def GetChangedParts(oldValues,values,params,unchanged=[]):
+    parts=set()
+    for name,part in PARAM_PARTS.items():
+        if part in unchanged:
+            continue
+        if name=='lineNum' and not values.get('onlyOneLine'):
+            continue
+        if oldValues.get(name)!=values.get(name):
+            parts.add(part)
+            # the tubes share the glyph body colors
+            if part=='glyphColors' and params['tubeColorFlag']==2:
+                parts.add('tubeColors')
+    todo=list(parts)
+    while todo:
+        for part in PART_DEPENDENTS.get(todo.pop(),[]):
+            if part not in parts:
+                parts.add(part)
+                todo.append(part)
+    return parts
+
+#==============================================================================
+# SelectLineNums(inpd,params)
+#    Line numbers (1,2,...) to render: the specific fiber lineNum, or one of
+#    every lineSpace fibers, of those passing through the region of
+#    interest when there is one (see SelectROILineNums).
+#==============================================================================
+def SelectLineNums(inpd,params):
+    if params['onlyOneLine']:
+        return [int(params['lineNum'])]
+    if params.get('roiType'):
+        return SelectROILineNums(inpd,params)[::int(params['lineSpace'])].tolist()
+    return range(1,inpd.GetNumberOfLines()+1,int(params['lineSpace']))
+
+#==============================================================================
+# SelectROILineNums(inpd,params)
+#    Line numbers of the fibers with a point in the region of interest
+#    around roiCenter with half sizes roiRadius (x,y,z), by roiType:
+#    'sphere' of the smallest half size, 'box', or 'slab' across axis
+#    roiSlabAxis (0,1,2) as thick as the box along it.
+#==============================================================================
+def SelectROILineNums(inpd,params):
+    grid=GetFiberGrid(inpd)
+    center=np.asarray(params['roiCenter'],dtype=np.float64)
+    radius=np.asarray(params['roiRadius'],dtype=np.float64)
+    roiType=params['roiType']
+    if roiType=='sphere':
+        return grid.QuerySphere(center,radius.min())
+    if roiType=='box':
+        return grid.QueryBox(center-radius,center+radius)
+    if roiType=='slab':
+        axis=int(params['roiSlabAxis'])
+        return grid.QuerySlab(np.eye(3)[axis],center[axis],2*radius[axis])
+    raise ValueError('Unknown roiType: '+str(roiType))
+
+#==============================================================================
+# SceneStreams
+#    Geometry of all enabled view items of a set of lines:
+#    positions, counts: points of the lines, one line after another
+#    lineColors: (M,4) uint8 segment colors of the lines, or None
+#    glyphs: list of (mats,rgbaTop,rgbaBody,rgbaBottom), one per tensor
+#    tubes: TubeMesh or None
+#==============================================================================
+class SceneStreams:
+    def __init__(self):
+        self.positions=None
+        self.counts=None
+        self.lineColors=None
+        self.glyphs=[]
+        self.tubes=None
+
+#==============================================================================
+# GetGlyphIndex(counts,space)
+#    Index of the glyph points space,2*space,... of each line in the points
+#    of lines stored one after another.
+#==============================================================================
+def GetGlyphIndex(counts,space):
+    local=np.arange(int(np.sum(counts)))-np.repeat(np.cumsum(counts)-counts,counts)
+    return np.nonzero((local>0)&(local%space==0))[0]
+
+def _Complement(rgba):
+    rgba=rgba.copy()
+    rgba[:,:3]=255-rgba[:,:3]
+    return rgba
+
+#==============================================================================
+# BuildSceneStreams(inpd,params,lineNums)
+#    Gather the points of the lines once and fill every enabled view item
+#    from them. The lines and tubes take the points simplified within
+#    decimateTolerance, the glyphs sample all points. The segment colors
+#    are shared by the lines and the orientation colored tubes, the glyph
+#    colors of tensor2 are the complement of those of tensor1.
+#==============================================================================
+def BuildSceneStreams(inpd,params,lineNums):
+    streams=SceneStreams()
+    showGlyphs=[(tname,mode) for tname,mode,show in \
+        [('tensor1',0,params['showTensor1']),('tensor2',1,params['showTensor2'])] \
+        if show]
+    showTubes=params['showTubes']
+    tubeColorFlag=params['tubeColorFlag']
+    
+    fiberIndex=GetFiberIndex(inpd)
+    rows,counts=fiberIndex.GetLineRows(lineNums)
+    pids=fiberIndex.pointIds[rows]
+    positions=fiberIndex.points[pids]
+    
+    renderIndex=GetRenderFiberIndex(inpd,params)
+    renderRows,renderCounts=renderIndex.GetLineRows(lineNums)
+    renderPids=renderIndex.pointIds[renderRows]
+    streams.positions=renderIndex.points[renderPids]
+    streams.counts=renderCounts
+    
+    segmentColors=None
+    if params['showLines'] or (showTubes and tubeColorFlag==1):
+        segmentColors=CalSegmentColors(streams.positions,renderCounts)
+    if params['showLines']:
+        streams.lineColors=segmentColors
+    
+    if showGlyphs:
+        # glyphs at points space,2*space,... of each line
+        space=int(params['glyphSpace'])
+        scale=int(params['glyphScale'])
+        glyphIndex=GetGlyphIndex(counts,space)
+        glyphPids=pids[glyphIndex]
+        glyphPositions=positions[glyphIndex]
+        
+        rgbaTop,rgbaBody,rgbaBottom=CalGlyphColors(inpd,params,glyphPids,0)
+        
+        for tname,mode in showGlyphs:
+            eigens=GetTensorEigens(inpd,tname)
+            mats=BuildGlyphMatrices(glyphPositions,eigens.eigVecs[glyphPids], \
+                eigens.eigVals[glyphPids],scale)
+            if mode==1:
+                streams.glyphs.append((mats,_Complement(rgbaTop), \
+                    _Complement(rgbaBody),_Complement(rgbaBottom)))
+            else:
+                streams.glyphs.append((mats,rgbaTop,rgbaBody,rgbaBottom))
+    
+    if showTubes and (renderCounts>1).any():
+        if tubeColorFlag==1:
+            colors=segmentColors
+        else:
+            colors=CalTubeColors(inpd,params,renderRows,renderCounts,renderIndex)
+        frames=GetFiberFrames(renderIndex)
+        radii=GetTubeRadii(inpd,params,renderPids)
+        streams.tubes=BuildTubeMesh(streams.positions,frames.normals[renderRows], \
+            frames.binormals[renderRows],radii,renderCounts, \
+            int(params['tubeSlices']),colors)
+    return streams
+
+#==============================================================================
+# DrawSceneStreams(streams,slices,stacks,drawGlyphs=True,drawLines=True)
+#==============================================================================
+def DrawSceneStreams(streams,slices,stacks,drawGlyphs=True,drawLines=True):
+    if drawGlyphs:
+        for mats,rgbaTop,rgbaBody,rgbaBottom in streams.glyphs:
+            if mats.shape[0]==0:
+                continue
+            if not RenderCylinderInstances(mats,rgbaTop,rgbaBody,rgbaBottom, \
+                                           slices,stacks):
+                RenderCylinderGlyphs(mats,rgbaTop,rgbaBody,rgbaBottom, \
+                    slices,stacks)
+    
+    if drawLines and streams.lineColors is not None:
+        DrawLineStrips(streams.positions,streams.lineColors,streams.counts)
+    
+    if streams.tubes is not None:
+        glShadeModel(GL_SMOOTH)
+        glEnable(GL_NORMALIZE)
+        DrawTubeMesh(streams.tubes,streams.tubes.GetStripIndices())
+    return
+
+#==============================================================================
+# RenderSceneImmediate(inpd,params,lineNums,drawGlyphs=True)
+#    Draw the enabled view items of the lines in lineNums in immediate mode.
+#==============================================================================
+def RenderSceneImmediate(inpd,params,lineNums,drawGlyphs=True):
+    streams=BuildSceneStreams(inpd,params,lineNums)
+    DrawSceneStreams(streams,int(params['cylinderSlices']), \
+        int(params['cylinderStacks']),drawGlyphs)
+    return
+
+#==============================================================================
+# SceneChunk(lineNums)
+#    Glyphs and tubes of a chunk of lines. BuildSceneChunk fills the numpy
+#    arrays without calling OpenGL, so it can run on a worker thread; Upload
+#    then moves them to buffer objects in the thread that draws.
+#    values: the parameter values (see _ParamValue) it was built with.
+#    rows, counts: the points of the tubes in fiberIndex, the simplified
+#    FiberIndex they were built from.
+#    glyphCounts, segmentCounts: glyphs and tube segments of each line,
+#    one line after another in the arrays, so SetSelection can draw the
+#    ranges of some of the lines without building them again. The glyph
+#    matrices and colors stay in memory for that, the tube vertices only
+#    on the GPU.
+#==============================================================================
+class SceneChunk:
+    def __init__(self,lineNums):
+        self.lineNums=lineNums
+        self.selected=None
+        self.values={}
+        self.fiberIndex=None
+        self.rows=None
+        self.counts=None
+        self.glyphPids=None
+        self.glyphCounts=None
+        self.glyphRows=None
+        self.glyphMats=[]
+        self.glyphColors=None
+        self.segmentCounts=None
+        self.segmentIndices=None
+        self.tubeMesh=None
+        self.glyphs=[]
+        self.tubes=None
+
+    def Upload(self,params,selected=None):
+        for mats,mode in self.glyphMats:
+            self.glyphs.append((CylinderInstances(),mode))
+        if self.tubeMesh is not None:
+            self.tubes=TubeBuffers()
+            self.tubes.SetMesh(self.tubeMesh)
+            self.segmentIndices=self.tubeMesh.indices.reshape(-1, \
+                self.tubeMesh.segmentSize)
+        self.tubeMesh=None
+        if selected is None:
+            selected=np.ones(len(self.lineNums),dtype=bool)
+        self.SetSelection(selected,params)
+
+    def SetSelection(self,selected,params):
+        # draw only the lines selected (a bool per line of the chunk)
+        if self.selected is not None and np.array_equal(selected,self.selected):
+            return
+        self.selected=selected
+        if self.glyphs:
+            self.glyphRows=_SelectRanges(self.glyphCounts,selected)
+            self._SetGlyphMatrices(int(params['glyphScale']))
+            if self.glyphColors is not None:
+                self._SetGlyphColors(*self.glyphColors)
+        if self.tubes is not None:
+            segments=self.segmentIndices[_SelectRanges(self.segmentCounts,selected)]
+            self.tubes.SetStripIndices(JoinTubeSegments(segments).reshape(-1)[:-2])
+
+    def Update(self,inpd,params,parts):
+        if 'glyphScale' in parts and self.glyphs:
+            self._SetGlyphMatrices(int(params['glyphScale']))
+        if 'glyphColors' in parts and self.glyphs:
+            self.glyphColors=CalGlyphColors(inpd,params,self.glyphPids,0)
+            self._SetGlyphColors(*self.glyphColors)
+        if 'tubeColors' in parts and self.tubes is not None:
+            self.tubes.SetRingColors(CalTubeColors(inpd,params,self.rows, \
+                self.counts,self.fiberIndex))
+
+    def _SetGlyphMatrices(self,scale):
+        for k,(mats,mode) in enumerate(self.glyphMats):
+            self.glyphs[k][0].SetMatrices(ScaleGlyphMatrices(mats[self.glyphRows],scale))
+
+    def _SetGlyphColors(self,rgbaTop,rgbaBody,rgbaBottom):
+        rows=self.glyphRows
+        rgbaTop,rgbaBody,rgbaBottom=rgbaTop[rows],rgbaBody[rows],rgbaBottom[rows]
+        for glyphs,mode in self.glyphs:
+            if mode==1:
+                glyphs.SetColors(_Complement(rgbaTop),_Complement(rgbaBody), \
+                    _Complement(rgbaBottom))
+            else:
+                glyphs.SetColors(rgbaTop,rgbaBody,rgbaBottom)
+
+    def Draw(self,slices,stacks):
+        for glyphs,mode in self.glyphs:
+            glyphs.Draw(slices,stacks)
+        if self.tubes is not None:
+            self.tubes.Draw()
+
+    def Release(self):
+        for glyphs,mode in self.glyphs:
+            glyphs.Release()
+        self.glyphs=[]
+        if self.tubes is not None:
+            self.tubes.Release()
+        self.tubes=None
+
+def _SelectRanges(counts,selected):
+    # rows of the selected lines in arrays of lines with counts rows each
+    ends=np.cumsum(counts)
+    return ConcatRanges((ends-counts)[selected],ends[selected])
+
+#==============================================================================
+# BuildSceneChunk(inpd,params,lineNums,builder=None)
+#    Return a SceneChunk of the lines in lineNums with its arrays filled.
+#    A ParallelBuilder builder builds the tube mesh over the cores.
+#    The glyphs read the cached eigens of the bundle (GetTensorEigens) and
+#    frames are built only for its lines, so a chunk costs the same wherever
+#    it is in the bundle. The tubes are built on the points simplified
+#    within decimateTolerance.
+#==============================================================================
+def BuildSceneChunk(inpd,params,lineNums,builder=None):
+    chunk=SceneChunk(lineNums)
+    chunk.values=_SceneValues(params)
+    fiberIndex=GetFiberIndex(inpd)
+    rows,counts=fiberIndex.GetLineRows(lineNums)
+    pids=fiberIndex.pointIds[rows]
+    positions=fiberIndex.points[pids]
+    
+    glyphIndex=GetGlyphIndex(counts,int(params['glyphSpace']))
+    chunk.glyphPids=pids[glyphIndex]
+    lines=np.repeat(np.arange(counts.shape[0]),counts)
+    chunk.glyphCounts=np.bincount(lines[glyphIndex],minlength=counts.shape[0])
+    for tname,mode,show in [('tensor1',0,'showTensor1'),('tensor2',1,'showTensor2')]:
+        if not params[show]:
+            continue
+        eigens=GetTensorEigens(inpd,tname)
+        chunk.glyphMats.append((BuildGlyphMatrices(positions[glyphIndex], \
+            eigens.eigVecs[chunk.glyphPids],eigens.eigVals[chunk.glyphPids],1),mode))
+    if chunk.glyphMats:
+        chunk.glyphColors=CalGlyphColors(inpd,params,chunk.glyphPids,0)
+    
+    if not params['showTubes']:
+        return chunk
+    chunk.fiberIndex=GetRenderFiberIndex(inpd,params)
+    chunk.rows,chunk.counts=chunk.fiberIndex.GetLineRows(lineNums)
+    chunk.segmentCounts=np.maximum(chunk.counts-1,0)
+    if (chunk.counts>1).any():
+        tubePids=chunk.fiberIndex.pointIds[chunk.rows]
+        radii=GetTubeRadii(inpd,params,tubePids)
+        colors=CalTubeColors(inpd,params,chunk.rows,chunk.counts,chunk.fiberIndex)
+        if builder is not None:
+            chunk.tubeMesh=builder.BuildTubeMesh(fiberIndex.points[tubePids], \
+                radii,chunk.counts,int(params['tubeSlices']),colors)
+            return chunk
+        offsets=np.zeros(chunk.counts.shape[0]+1,dtype=np.int64)
+        offsets[1:]=np.cumsum(chunk.counts)
+        frames=BuildFiberFrames(FiberIndex(offsets,tubePids,fiberIndex.points))
+        chunk.tubeMesh=BuildTubeMesh(fiberIndex.points[tubePids],frames.normals, \
+            frames.binormals,radii,chunk.counts,int(params['tubeSlices']),colors)
+    return chunk
+
+#==============================================================================
+# PrepareSceneChunks(inpd,params)
+#    Build the per-bundle data that BuildSceneChunk reads (line index and
+#    its simplified one, array registry, ranges and color indices, tensor
+#    eigens) before chunks are built on another thread, so the worker does
+#    not call into VTK to create them.
+#==============================================================================
+def PrepareSceneChunks(inpd,params):
+    GetFiberIndex(inpd)
+    if params['showTubes']:
+        GetRenderFiberIndex(inpd,params)
+    registry=GetArrayRegistry(inpd)
+    for name in ['bodRName','bodGName','bodBName','bodAName','tubeMappedToName']:
+        array=registry.GetPointArray(params[name])
+        if array is not None:
+            GetMinMaxInArray(array)
+    for c in 'RGBA':
+        if params['bod'+c+'Flag']!=0 and \
+           registry.GetPointArray(params['bod'+c+'Name']) is not None:
+            GetColorIndex(inpd,params['bod'+c+'Name'])
+    for tname,show in [('tensor1','showTensor1'),('tensor2','showTensor2')]:
+        if params[show]:
+            GetTensorEigens(inpd,tname)
+
+#==============================================================================
+# SceneCache(chunkLines=SCENE_CHUNK_LINES)
+#    Retained-mode copy of the scene. Render only updates the parts of the
+#    scene that a parameter change affects (see PARAM_PARTS) and draws.
+#    Lines are drawn as ranges of one buffer with all lines of the bundle.
+#    Glyphs and tubes are kept in SceneChunks of chunkLines lines. When
+#    they have to be rebuilt for more than one chunk, the chunks are built
+#    on a worker thread and shown as they arrive; a newer change cancels
+#    the build. IsBuilding tells the caller to keep rendering until done.
+#    Their tubes are built over the cores by the pool of GetParallelBuilder,
+#    which Invalidate closes when the scene is released.
+#    Without buffer objects or instancing, the whole scene goes to a
+#    display list that is rebuilt on every change.
+#    GL objects are created and released inside Render, where the context
+#    of the 3D view is current.
+#==============================================================================
+SCENE_CHUNK_LINES=2000
+
+class SceneCache:
+    def __init__(self,chunkLines=SCENE_CHUNK_LINES):
+        self.chunkLines=chunkLines
+        self.dataKey=None
+        self.values={}
+        self.retained=False
+        self.displayList=0
+        self.slices=0
+        self.stacks=0
+        
+        self.lineNums=[]
+        self.lines=None
+        self.chunks=[]
+        self.builder=ThreadBuilder()
+
+    def Invalidate(self):
+        self.dataKey=None
+        self.builder.Cancel()
+        CloseParallelBuilder()
+
+    def IsBuilding(self):
+        return self.builder.IsRunning()
+
+    def Render(self,inpd,params):
+        dataKey=(inpd.GetAddressAsString('vtkPolyData'),inpd.GetMTime())
+        values=_SceneValues(params)
+        if dataKey!=self.dataKey:
+            self.Release()
+            self.retained=InstancedGlyphsSupported() and VertexBuffersSupported()
+            parts=set(SCENE_PARTS)
+            self.lineNums=SelectLineNums(inpd,params)
+        else:
+            parts=GetChangedParts(self.values,values,params)
+            if 'selection' in parts:
+                lineNums=SelectLineNums(inpd,params)
+                if np.array_equal(lineNums,self.lineNums):
+                    # e.g. a region moved over the same fibers
+                    parts=GetChangedParts(self.values,values,params,['selection'])
+                self.lineNums=lineNums
+        self.slices=int(params['cylinderSlices'])
+        self.stacks=int(params['cylinderStacks'])
+        
+        # a display list also holds the cylinder slices and stacks
+        if parts or (not self.retained and values!=self.values):
+            if self.retained:
+                self.Update(inpd,params,parts)
+            else:
+                self.Build(inpd,params)
+        self.dataKey=dataKey
+        self.values=values
+        
+        # chunks finished by the worker since the last render
+        for chunk in self.builder.GetResults():
+            self.AddChunk(inpd,params,chunk)
+        self.Draw()
+
+    def Update(self,inpd,params,parts):
+        fiberIndex=GetRenderFiberIndex(inpd,params)
+        
+        if 'decimation' in parts:
+            self.ReleaseLines()
+        
+        if 'lines' in parts:
+            if not params['showLines']:
+                self.ReleaseLines()
+            else:
+                if self.lines is None:
+                    # all lines of the bundle, the selection picks ranges
+                    offsets=fiberIndex.offsets
+                    allCounts=offsets[1:]-offsets[:-1]
+                    positions=fiberIndex.points[fiberIndex.pointIds]
+                    self.lines=LineStrips()
+                    self.lines.SetLines(positions, \
+                        CalSegmentColors(positions,allCounts),allCounts)
+                lines=np.minimum(np.asarray(self.lineNums,dtype=np.int64), \
+                    fiberIndex.GetNumberOfLines())
+                self.lines.SetRanges(fiberIndex.offsets[lines-1], \
+                    fiberIndex.offsets[lines]-fiberIndex.offsets[lines-1])
+        
+        if 'glyphs' in parts or 'tubes' in parts:
+            self.ReleaseChunks()
+            self.BuildChunks(inpd,params,self.lineNums)
+            return
+        missing=[]
+        if 'selection' in parts:
+            missing=self.SelectChunks(inpd,params)
+        for chunk in self.chunks:
+            chunk.Update(inpd,params,parts)
+        self.BuildChunks(inpd,params,missing)
+
+    def SelectChunks(self,inpd,params):
+        # keep the chunks with a selected line and draw only those lines,
+        # return the selected lines no chunk has; chunks the worker has
+        # finished are kept before the rest of its build is cancelled
+        for chunk in self.builder.GetResults():
+            self.AddChunk(inpd,params,chunk)
+        self.builder.Cancel()
+        lineNums=np.asarray(self.lineNums,dtype=np.int64)
+        kept=[]
+        built=[]
+        for chunk in self.chunks:
+            selected=np.in1d(chunk.lineNums,lineNums)
+            if selected.any():
+                chunk.SetSelection(selected,params)
+                kept.append(chunk)
+                built.append(np.asarray(chunk.lineNums,dtype=np.int64))
+            else:
+                chunk.Release()
+        self.chunks=kept
+        if built:
+            lineNums=lineNums[~np.in1d(lineNums,np.concatenate(built))]
+        return lineNums.tolist()
+
+    def BuildChunks(self,inpd,params,lineNums):
+        jobs=SplitJobs(lineNums,self.chunkLines)
+        if len(jobs)==1:
+            self.AddChunk(inpd,params,BuildSceneChunk(inpd,params,jobs[0]))
+        elif len(jobs)>1:
+            PrepareSceneChunks(inpd,params)
+            snapshot=dict(params)
+            # tubes over the cores when worker processes can be started
+            builder=GetParallelBuilder() if params['showTubes'] else None
+            self.builder.Start(lambda lineNums: \
+                BuildSceneChunk(inpd,snapshot,lineNums,builder),jobs)
+
+    def AddChunk(self,inpd,params,chunk):
+        chunk.Upload(params,np.in1d(chunk.lineNums, \
+            np.asarray(self.lineNums,dtype=np.int64)))
+        # parameters changed while the chunk was being built, Upload has
+        # already taken the current glyph scale
+        parts=GetChangedParts(chunk.values,_SceneValues(params),params)
+        parts.discard('glyphScale')
+        chunk.Update(inpd,params,parts)
+        self.chunks.append(chunk)
+
+    def Build(self,inpd,params):
+        self.Release()
+        streams=BuildSceneStreams(inpd,params,self.lineNums)
+        
+        self.displayList=glGenLists(1)
+        glNewList(self.displayList,GL_COMPILE)
+        DrawSceneStreams(streams,self.slices,self.stacks)
+        glEndList()
+
+    def Draw(self):
+        if self.displayList:
+            glCallList(self.displayList)
+        if self.lines is not None:
+            self.lines.Draw()
+        for chunk in self.chunks:
+            chunk.Draw(self.slices,self.stacks)
+
+    def ReleaseLines(self):
+        if self.lines is not None:
+            self.lines.Release()
+        self.lines=None
+
+    def ReleaseChunks(self):
+        self.builder.Cancel()
+        for chunk in self.chunks:
+            chunk.Release()
+        self.chunks=[]
+
+    def Release(self):
+        if self.displayList:
+            glDeleteLists(self.displayList,1)
+        self.displayList=0
+        self.ReleaseLines()
+        self.ReleaseChunks()
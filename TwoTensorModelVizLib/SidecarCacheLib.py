@@ -0,0 +1,386 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It keeps a polydata file and what is derived from it in a sidecar cache.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import os
+import shutil
+import tempfile
+import time
+import json
+import hashlib
+import zipfile
+import zlib
+
+import numpy as np
+
+import vtk
+from vtk.util import numpy_support
+
+from PolyDataLib import *
+from TensorLib import *
+from TensorLib import _TestDataFile
+
+#==============================================================================
+# Sidecar cache
+# filename.cache is a directory next to filename with
+#    manifest.json   CACHE_VERSION, the source key (see GetSourceKey) and
+#                    the names, shapes and dtypes of the files below (of
+#                    each field of the .npz files)
+#    points.npy, cells_<section>.npy (legacy layout), offsets.npy,
+#    pointIds.npy, point_<i>.npy, cell_<i>.npy
+#    tensors_<i>.npy, eigVals_<i>.npy, eigVecs_<i>.npy, degenerate_<i>.npy
+#                    CompactTensors (float32) and TensorEigens ('closedform')
+#                    of each 9-component point array i
+#    statistics_<i>.npz   ArrayStatistics of each point array i
+# The manifest is written last and the directory is renamed into place, so
+# a cache is either complete or missing. Arrays are memory mapped on load.
+#==============================================================================
+CACHE_VERSION=2
+CACHE_SUFFIX='.cache'
+
+_CELL_SECTIONS=[('VERTICES','GetVerts','SetVerts'),('LINES','GetLines','SetLines'), \
+    ('POLYGONS','GetPolys','SetPolys'),('TRIANGLE_STRIPS','GetStrips','SetStrips')]
+
+def GetSidecarPath(filename):
+    return filename+CACHE_SUFFIX
+
+#==============================================================================
+# HashFile(filename,blockSize=65536,samples=64)
+#    sha1 of the content of filename. Files up to samples blocks are hashed
+#    whole, larger ones by samples blocks spread over the file, including
+#    the first and the last one, so a multi-GB file is not read through.
+#==============================================================================
+def HashFile(filename,blockSize=65536,samples=64):
+    size=os.path.getsize(filename)
+    sha=hashlib.sha1()
+    with open(filename,'rb') as f:
+        if size<=blockSize*samples:
+            sha.update(f.read())
+        else:
+            for pos in np.linspace(0,size-blockSize,samples).astype(np.int64):
+                f.seek(int(pos))
+                sha.update(f.read(blockSize))
+    return sha.hexdigest()
+
+#==============================================================================
+# GetSourceKey(filename)
+#    What a cache of filename must have been built from.
+#==============================================================================
+def GetSourceKey(filename):
+    stat=os.stat(filename)
+    return {'path':os.path.abspath(filename),'size':stat.st_size, \
+            'mtime':stat.st_mtime,'hash':HashFile(filename)}
+
+#==============================================================================
+# WriteSidecar(filename,inpd)
+#    Write the cache of filename from inpd, the polydata read from it.
+#==============================================================================
+def WriteSidecar(filename,inpd):
+    path=GetSidecarPath(filename)
+    key=GetSourceKey(filename)
+    folder=tempfile.mkdtemp(prefix=os.path.basename(path)+'.', \
+        dir=os.path.dirname(os.path.abspath(path)))
+    files={}
+
+    def Save(name,values):
+        values=np.ascontiguousarray(values)
+        np.save(os.path.join(folder,name+'.npy'),values)
+        files[name]=[list(values.shape),values.dtype.str]
+
+    try:
+        Save('points',numpy_support.vtk_to_numpy(inpd.GetPoints().GetData()))
+        cells=[]
+        for section,getter,setter in _CELL_SECTIONS:
+            cellArray=getattr(inpd,getter)()
+            if cellArray.GetNumberOfCells()>0:
+                Save('cells_'+section,numpy_support.vtk_to_numpy(cellArray.GetData()))
+                cells.append([section,cellArray.GetNumberOfCells()])
+        fiberIndex=GetFiberIndex(inpd)
+        Save('offsets',fiberIndex.offsets)
+        Save('pointIds',fiberIndex.pointIds)
+
+        pointArrays=[]
+        data=inpd.GetPointData()
+        for i in range(data.GetNumberOfArrays()):
+            array=data.GetArray(i)
+            if array is None:
+                continue
+            name=array.GetName()
+            Save('point_%d'%i,numpy_support.vtk_to_numpy(array))
+            entry={'name':name,'file':'point_%d'%i, \
+                   'attribute':data.IsArrayAnAttribute(i)}
+
+            statistics=GetArrayStatistics(array)
+            fields=dict((field,np.asarray(getattr(statistics,field))) \
+                for field in ARRAY_STATISTICS_FIELDS \
+                if getattr(statistics,field) is not None)
+            np.savez(os.path.join(folder,'statistics_%d.npz'%i),**fields)
+            files['statistics_%d'%i]=dict((field,[list(value.shape),value.dtype.str]) \
+                for field,value in fields.items())
+            entry['statistics']='statistics_%d'%i
+
+            if array.GetNumberOfComponents()==9 and \
+               GetPointArrayByName(inpd,name) is array:
+                compact=GetCompactTensors(inpd,name)
+                eigens=GetTensorEigens(inpd,name)
+                Save('tensors_%d'%i,compact.data)
+                Save('eigVals_%d'%i,eigens.eigVals)
+                Save('eigVecs_%d'%i,eigens.eigVecs)
+                Save('degenerate_%d'%i,eigens.degenerate)
+                entry['tensors']=i
+                entry['scale']=compact.scale
+            pointArrays.append(entry)
+
+        cellArrays=[]
+        data=inpd.GetCellData()
+        for i in range(data.GetNumberOfArrays()):
+            array=data.GetArray(i)
+            if array is None:
+                continue
+            Save('cell_%d'%i,numpy_support.vtk_to_numpy(array))
+            cellArrays.append({'name':array.GetName(),'file':'cell_%d'%i, \
+                               'attribute':data.IsArrayAnAttribute(i)})
+
+        manifest={'version':CACHE_VERSION,'source':key,'files':files, \
+                  'cells':cells,'pointArrays':pointArrays,'cellArrays':cellArrays}
+        with open(os.path.join(folder,'manifest.json'),'w') as f:
+            json.dump(manifest,f)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(folder,path)
+    except:
+        shutil.rmtree(folder,ignore_errors=True)
+        raise
+
+#==============================================================================
+# ReadSidecar(filename)
+#    Return the polydata of filename from its cache, with the fiber index,
+#    compact tensors, eigens and statistics in the caches of PolyDataLib
+#    and TensorLib, or None when the cache is missing, stale or corrupt.
+#    Whatever is wrong with a cache only makes it rebuilt: truncated or
+#    rewritten files fail in numpy, zipfile or zlib, a manifest of the
+#    wrong structure in the lookups into it.
+#==============================================================================
+def ReadSidecar(filename):
+    path=GetSidecarPath(filename)
+    manifestFile=os.path.join(path,'manifest.json')
+    if not os.path.isfile(manifestFile):
+        return None
+    try:
+        with open(manifestFile) as f:
+            manifest=json.load(f)
+        if not isinstance(manifest,dict) or \
+           manifest.get('version')!=CACHE_VERSION or \
+           manifest.get('source')!=GetSourceKey(filename):
+            return None
+        return _BuildFromSidecar(path,manifest)
+    except (IOError,OSError,ValueError,KeyError,IndexError,TypeError, \
+            AttributeError,zipfile.BadZipfile,zlib.error):
+        return None
+
+def _LoadArray(path,manifest,name):
+    # copy on write maps: VTK wants writable buffers, pages are only read
+    values=np.load(os.path.join(path,name+'.npy'),mmap_mode='c')
+    shape,dtype=manifest['files'][name]
+    if list(values.shape)!=shape or values.dtype.str!=dtype:
+        raise ValueError('Corrupt cache file '+name)
+    return values
+
+def _LoadStatistics(path,manifest,name):
+    expected=manifest['files'][name]
+    fields={}
+    filename=os.path.join(path,name+'.npz')
+    # np.load leaves a half made NpzFile behind on a broken archive
+    if not zipfile.is_zipfile(filename):
+        raise ValueError('Corrupt cache file '+name)
+    with np.load(filename) as values:
+        if sorted(values.files)!=sorted(expected):
+            raise ValueError('Corrupt cache file '+name)
+        for field in values.files:
+            value=values[field]
+            shape,dtype=expected[field]
+            if list(value.shape)!=shape or value.dtype.str!=dtype:
+                raise ValueError('Corrupt cache file '+name)
+            fields[field]=value if value.ndim>0 else value.item()
+    return ArrayStatistics(fields=fields)
+
+def _ToVTKArray(values,name=None):
+    array=numpy_support.numpy_to_vtk(values,deep=0)
+    if name is not None:
+        array.SetName(name.encode('utf-8'))
+    return array
+
+def _BuildFromSidecar(path,manifest):
+    inpd=vtk.vtkPolyData()
+    points=vtk.vtkPoints()
+    points.SetData(_ToVTKArray(_LoadArray(path,manifest,'points')))
+    inpd.SetPoints(points)
+    for section,numCells in manifest['cells']:
+        setter=[s for name,g,s in _CELL_SECTIONS if name==section][0]
+        cellArray=vtk.vtkCellArray()
+        cellArray.SetCells(numCells,numpy_support.numpy_to_vtkIdTypeArray( \
+            _LoadArray(path,manifest,'cells_'+section),deep=0))
+        getattr(inpd,setter)(cellArray)
+
+    for entries,data in [(manifest['pointArrays'],inpd.GetPointData()), \
+                         (manifest['cellArrays'],inpd.GetCellData())]:
+        for entry in entries:
+            data.AddArray(_ToVTKArray(_LoadArray(path,manifest,entry['file']), \
+                entry['name']))
+            if entry['attribute']>=0:
+                data.SetActiveAttribute(entry['name'].encode('utf-8'),entry['attribute'])
+
+    SetFiberIndex(inpd,FiberIndex(_LoadArray(path,manifest,'offsets'), \
+        _LoadArray(path,manifest,'pointIds'),numpy_support.vtk_to_numpy( \
+        inpd.GetPoints().GetData())))
+    data=inpd.GetPointData()
+    for entry in manifest['pointArrays']:
+        name=entry['name'].encode('utf-8')
+        SetArrayStatistics(data.GetArray(name), \
+            _LoadStatistics(path,manifest,entry['statistics']))
+        if 'tensors' in entry:
+            i=entry['tensors']
+            SetCompactTensors(inpd,name,CompactTensors( \
+                _LoadArray(path,manifest,'tensors_%d'%i),entry['scale']))
+            SetTensorEigens(inpd,name,TensorEigens( \
+                _LoadArray(path,manifest,'eigVals_%d'%i), \
+                _LoadArray(path,manifest,'eigVecs_%d'%i), \
+                _LoadArray(path,manifest,'degenerate_%d'%i)))
+    return inpd
+
+#==============================================================================
+# LoadCachedPolyData(filename)
+#    Read filename from its sidecar cache; when there is none or it does not
+#    match the file any more, read the file and write the cache again.
+#==============================================================================
+def LoadCachedPolyData(filename):
+    inpd=ReadSidecar(filename)
+    if inpd is not None:
+        return inpd
+    inpd=ReadPolyData(filename)
+    try:
+        WriteSidecar(filename,inpd)
+    except (IOError,OSError),e:
+        # a read-only folder only costs the cache
+        print 'Sidecar cache not written:',e
+    return inpd
+
+#==============================================================================
+# For Test
+#==============================================================================
+def _SameData(inpd,expected):
+    same=np.array_equal(numpy_support.vtk_to_numpy(inpd.GetPoints().GetData()), \
+        numpy_support.vtk_to_numpy(expected.GetPoints().GetData()))
+    same=same and np.array_equal(numpy_support.vtk_to_numpy(inpd.GetLines().GetData()), \
+        numpy_support.vtk_to_numpy(expected.GetLines().GetData()))
+    for data,expectedData in [(inpd.GetPointData(),expected.GetPointData()), \
+                              (inpd.GetCellData(),expected.GetCellData())]:
+        same=same and data.GetNumberOfArrays()==expectedData.GetNumberOfArrays()
+        for i in range(expectedData.GetNumberOfArrays()):
+            array=expectedData.GetArray(i)
+            same=same and np.array_equal( \
+                numpy_support.vtk_to_numpy(data.GetArray(array.GetName())), \
+                numpy_support.vtk_to_numpy(array))
+            same=same and data.IsArrayAnAttribute(i)==expectedData.IsArrayAnAttribute(i)
+    return same
+
+def _SameDerived(inpd,expected):
+    same=np.array_equal(GetFiberIndex(inpd).pointIds,GetFiberIndex(expected).pointIds)
+    for tname in ['tensor1','tensor2']:
+        if GetPointArrayByName(expected,tname) is None:
+            continue
+        same=same and np.array_equal(GetCompactTensors(inpd,tname).data, \
+            GetCompactTensors(expected,tname).data)
+        same=same and np.array_equal(GetTensorEigens(inpd,tname).eigVecs, \
+            GetTensorEigens(expected,tname).eigVecs)
+    for name in ['FA1','FreeWater']:
+        same=same and GetMinMaxInArray(GetPointArrayByName(inpd,name))== \
+            GetMinMaxInArray(GetPointArrayByName(expected,name))
+    return same
+
+def _FromCache(inpd):
+    # the derived data of a cache hit are mapped, not computed
+    return isinstance(GetFiberIndex(inpd).offsets,np.memmap) and \
+        isinstance(GetTensorEigens(inpd,'tensor1').eigVals,np.memmap)
+
+#==============================================================================
+# SidecarCacheTest(filename=None)
+#    Load a copy of filename through its cache: the first load writes it,
+#    the next ones map it, a corrupt or stale cache is rebuilt, and every
+#    load gives the arrays and derived data of a plain load.
+#==============================================================================
+def SidecarCacheTest(filename=None):
+    if filename is None:
+        filename=_TestDataFile()
+    folder=tempfile.mkdtemp()
+    try:
+        copy=os.path.join(folder,os.path.basename(filename))
+        shutil.copyfile(filename,copy)
+        t=time.time()
+        expected=LoadPolyData(copy)
+        _SameDerived(expected,expected)
+        print 'plain load: %.4f s'%(time.time()-t)
+
+        t=time.time()
+        inpd=LoadPolyData(copy,cache=True)
+        print 'first load: %.4f s'%(time.time()-t)
+        passed=os.path.isfile(os.path.join(GetSidecarPath(copy),'manifest.json'))
+
+        t=time.time()
+        inpd=LoadPolyData(copy,cache=True)
+        hit=_FromCache(inpd)
+        same=_SameData(inpd,expected) and _SameDerived(inpd,expected)
+        print 'cached load: %.4f s,'%(time.time()-t), \
+            'mapped' if hit else 'NOT MAPPED','identical' if same else 'DIFFERENT'
+        passed=passed and hit and same
+
+        # truncate the points
+        points=os.path.join(GetSidecarPath(copy),'points.npy')
+        with open(points,'r+b') as f:
+            f.truncate(os.path.getsize(points)//2)
+        inpd=LoadPolyData(copy,cache=True)
+        rebuilt=not _FromCache(inpd) and _SameData(inpd,expected) and \
+            _FromCache(LoadPolyData(copy,cache=True))
+        print 'corrupt cache:','rebuilt' if rebuilt else 'NOT REBUILT'
+        passed=passed and rebuilt
+
+        # truncate the statistics, then a manifest that is not a dict
+        statistics=os.path.join(GetSidecarPath(copy),'statistics_0.npz')
+        with open(statistics,'r+b') as f:
+            f.truncate(os.path.getsize(statistics)//2)
+        inpd=LoadPolyData(copy,cache=True)
+        rebuilt=not _FromCache(inpd) and _SameData(inpd,expected) and \
+            _SameDerived(LoadPolyData(copy,cache=True),expected)
+        with open(os.path.join(GetSidecarPath(copy),'manifest.json'),'w') as f:
+            json.dump([CACHE_VERSION],f)
+        inpd=LoadPolyData(copy,cache=True)
+        rebuilt=rebuilt and not _FromCache(inpd) and _SameData(inpd,expected)
+        print 'corrupt statistics and manifest:','rebuilt' if rebuilt else 'NOT REBUILT'
+        passed=passed and rebuilt
+
+        # same size, a point moved and a new time
+        with open(copy,'r+b') as f:
+            f.seek(f.read(1024).find('float\n')+6)
+            f.write('\0\0\0\0')
+        os.utime(copy,(time.time()+10,time.time()+10))
+        expected=LoadPolyData(copy)
+        inpd=LoadPolyData(copy,cache=True)
+        rebuilt=not _FromCache(inpd) and _SameData(inpd,expected) and \
+            _SameData(LoadPolyData(copy,cache=True),expected)
+        print 'stale cache:','rebuilt' if rebuilt else 'NOT REBUILT'
+        passed=passed and rebuilt
+    finally:
+        shutil.rmtree(folder)
+    return passed
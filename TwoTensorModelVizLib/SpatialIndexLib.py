@@ -0,0 +1,277 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It finds the fibers passing through a region of interest.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import time
+
+import numpy as np
+
+from PolyDataLib import *
+from PolyDataLib import _GetCachedObject,_FiberIndexKey
+from TensorLib import _TestDataFile
+
+#==============================================================================
+# ConcatRanges(starts,ends)
+#    Positions starts[0]..ends[0]-1, starts[1]..ends[1]-1, ... in one array.
+#==============================================================================
+def ConcatRanges(starts,ends):
+    lengths=ends-starts
+    total=int(lengths.sum())
+    if total==0:
+        return np.zeros(0,dtype=np.int64)
+    shift=np.repeat(starts-(np.cumsum(lengths)-lengths),lengths)
+    return np.arange(total,dtype=np.int64)+shift
+
+#==============================================================================
+# FiberGrid(fiberIndex,cellSize=None)
+#    Uniform grid over the points of all lines of a FiberIndex.
+#    Only occupied cells are stored, sorted by cell number:
+#    cells:      (K,) cell numbers ix+nx*(iy+ny*iz)
+#    cellCoords: (K,3) cell coordinates (ix,iy,iz)
+#    positions, lines: the line points and their line (0-based), grouped
+#                by cell, cell k owns positions[pointStarts[k]:pointStarts[k+1]]
+#    cellLines:  the distinct lines of each cell, cell k owns
+#                cellLines[lineStarts[k]:lineStarts[k+1]]
+#    A query finds the cells overlapping the region: lines of cells inside
+#    it are taken whole, points of cells on its border are tested one by one.
+#    The default cellSize gives about 8 points per cell of the bounding box.
+#    Query results are line numbers 1,2,... of the lines with a point in
+#    the region.
+#==============================================================================
+class FiberGrid:
+    def __init__(self,fiberIndex,cellSize=None):
+        offsets=fiberIndex.offsets
+        counts=offsets[1:]-offsets[:-1]
+        numLines=counts.shape[0]
+        positions=np.asarray(fiberIndex.points[fiberIndex.pointIds],dtype=np.float32)
+        lines=np.repeat(np.arange(numLines,dtype=np.int64),counts)
+        self.numLines=numLines
+
+        if positions.shape[0]==0:
+            self.origin=np.zeros(3)
+            self.cellSize=1.0
+            self.dims=np.ones(3,dtype=np.int64)
+        else:
+            self.origin=positions.min(axis=0).astype(np.float64)
+            extent=positions.max(axis=0)-self.origin
+            if cellSize is None:
+                volume=np.prod(np.maximum(extent,1e-6))
+                cellSize=(8.0*volume/positions.shape[0])**(1.0/3)
+            self.cellSize=float(cellSize)
+            self.dims=(extent//self.cellSize).astype(np.int64)+1
+
+        coords=self._CellCoords(positions)
+        cellNums=self._CellNumbers(coords)
+        order=np.argsort(cellNums,kind='mergesort')
+        cellNums=cellNums[order]
+        self.positions=positions[order]
+        self.lines=lines[order]
+        self.cells,starts=np.unique(cellNums,return_index=True)
+        self.pointStarts=np.append(starts,cellNums.shape[0]).astype(np.int64)
+        self.cellCoords=coords[order[starts]]
+
+        pairs=np.unique(cellNums*max(numLines,1)+self.lines)
+        pairCells=pairs//max(numLines,1)
+        self.cellLines=pairs-pairCells*max(numLines,1)
+        self.lineStarts=np.searchsorted(pairCells, \
+            np.append(self.cells,np.iinfo(np.int64).max)).astype(np.int64)
+
+    def _CellCoords(self,positions):
+        coords=np.floor((positions-self.origin)/self.cellSize).astype(np.int64)
+        return np.clip(coords,0,self.dims-1)
+
+    def _CellNumbers(self,coords):
+        return coords[:,0]+self.dims[0]*(coords[:,1]+self.dims[1]*coords[:,2])
+
+    def GetNumberOfCells(self):
+        return self.cells.shape[0]
+
+    def _CellsInBox(self,lower,upper):
+        # occupied cells overlapping the box [lower,upper]
+        lower=np.floor((np.asarray(lower,dtype=np.float64)-self.origin)/self.cellSize)
+        upper=np.floor((np.asarray(upper,dtype=np.float64)-self.origin)/self.cellSize)
+        lower=np.maximum(lower,0).astype(np.int64)
+        upper=np.minimum(upper,self.dims-1).astype(np.int64)
+        if (upper<lower).any():
+            return np.zeros(0,dtype=np.int64)
+        sizes=upper-lower+1
+        if np.prod(sizes)<=self.cells.shape[0]:
+            # few cells in the box: look each one up
+            ix,iy,iz=np.meshgrid(*[np.arange(lower[k],upper[k]+1) for k in range(3)], \
+                indexing='ij')
+            wanted=self._CellNumbers(np.column_stack([ix.ravel(),iy.ravel(),iz.ravel()]))
+            found=np.searchsorted(self.cells,wanted)
+            found=found[found<self.cells.shape[0]]
+            return np.unique(found[np.in1d(self.cells[found],wanted)])
+        inside=((self.cellCoords>=lower)&(self.cellCoords<=upper)).all(axis=1)
+        return np.nonzero(inside)[0]
+
+    def _Collect(self,cells,whole,test):
+        # lines of the cells whole, plus those of the points of the other
+        # cells that pass test
+        parts=[self.cellLines[ConcatRanges(self.lineStarts[cells[whole]], \
+            self.lineStarts[cells[whole]+1])]]
+        border=cells[~whole]
+        rows=ConcatRanges(self.pointStarts[border],self.pointStarts[border+1])
+        if rows.shape[0]>0:
+            parts.append(self.lines[rows[test(self.positions[rows])]])
+        return np.unique(np.concatenate(parts))+1
+
+    def _CellBounds(self,cells):
+        lower=self.origin+self.cellCoords[cells]*self.cellSize
+        return lower,lower+self.cellSize
+
+    def QueryBox(self,lower,upper):
+        lower=np.asarray(lower,dtype=np.float64)
+        upper=np.asarray(upper,dtype=np.float64)
+        cells=self._CellsInBox(lower,upper)
+        cellLower,cellUpper=self._CellBounds(cells)
+        whole=((cellLower>=lower)&(cellUpper<=upper)).all(axis=1)
+        return self._Collect(cells,whole, \
+            lambda p: ((p>=lower)&(p<=upper)).all(axis=1))
+
+    def QuerySphere(self,center,radius):
+        center=np.asarray(center,dtype=np.float64)
+        cells=self._CellsInBox(center-radius,center+radius)
+        cellLower,cellUpper=self._CellBounds(cells)
+        # nearest and farthest point of each cell from the center
+        nearest=np.clip(center,cellLower,cellUpper)-center
+        farthest=np.maximum(np.abs(cellLower-center),np.abs(cellUpper-center))
+        radius2=radius*radius
+        keep=np.square(nearest).sum(axis=1)<=radius2
+        whole=np.square(farthest).sum(axis=1)<=radius2
+        cells,whole=cells[keep],whole[keep]
+        return self._Collect(cells,whole, \
+            lambda p: np.square(p-center).sum(axis=1)<=radius2)
+
+    def QuerySlab(self,normal,offset,thickness):
+        # points p with |dot(p,normal)-offset| <= thickness/2, normal unit
+        normal=np.asarray(normal,dtype=np.float64)
+        normal=normal/np.sqrt(np.square(normal).sum())
+        half=0.5*thickness
+        lower,upper=self._CellBounds(np.arange(self.cells.shape[0]))
+        distance=np.abs(np.dot(0.5*(lower+upper),normal)-offset)
+        reach=0.5*self.cellSize*np.abs(normal).sum()
+        cells=np.nonzero(distance<=half+reach)[0]
+        whole=distance[cells]+reach<=half
+        return self._Collect(cells,whole, \
+            lambda p: np.abs(np.dot(p,normal)-offset)<=half)
+
+#==============================================================================
+# GetFiberGrid(inpd,cellSize=None)
+#    Return the FiberGrid of the lines of inpd, rebuilt only when the lines
+#    or the points of inpd are modified.
+#==============================================================================
+_fiberGridCache={}
+
+def _BuildFiberGrid(inpd,cellSize):
+    return FiberGrid(GetFiberIndex(inpd),cellSize)
+
+def GetFiberGrid(inpd,cellSize=None):
+    key,mtime=_FiberIndexKey(inpd)
+    return _GetCachedObject(_fiberGridCache,(key,cellSize),mtime, \
+        _BuildFiberGrid,inpd,cellSize)
+
+#==============================================================================
+# For Test
+#==============================================================================
+def _RandomWalkIndex(numLines,numPoints,seed=0):
+    rng=np.random.RandomState(seed)
+    starts=rng.rand(numLines,1,3)*100
+    steps=rng.randn(numLines,numPoints,3)*0.5
+    points=(starts+np.cumsum(steps,axis=1)).reshape(-1,3).astype(np.float32)
+    offsets=np.arange(0,numLines*numPoints+1,numPoints,dtype=np.int64)
+    return FiberIndex(offsets,np.arange(points.shape[0],dtype=np.int64),points)
+
+def _BruteForce(fiberIndex,test):
+    points=np.asarray(fiberIndex.points[fiberIndex.pointIds],dtype=np.float32)
+    counts=np.diff(fiberIndex.offsets)
+    lines=np.repeat(np.arange(counts.shape[0]),counts)
+    return np.unique(lines[test(points)])+1
+
+def _Queries(fiberIndex,rng,num):
+    points=np.asarray(fiberIndex.points[fiberIndex.pointIds],dtype=np.float64)
+    lower,upper=points.min(axis=0),points.max(axis=0)
+    extent=(upper-lower).max()
+    queries=[]
+    for i in range(num):
+        center=lower+rng.rand(3)*(upper-lower)
+        size=extent*rng.choice([0.01,0.05,0.2,0.6])
+        normal=rng.randn(3)
+        normal/=np.sqrt(np.square(normal).sum())
+        queries.append(('sphere',(center,size)))
+        queries.append(('box',(center-size*rng.rand(3),center+size*rng.rand(3))))
+        queries.append(('slab',(normal,np.dot(center,normal),size*0.2)))
+        queries.append(('slab',(np.eye(3)[i%3],center[i%3],size*0.2)))
+    return queries
+
+def _Run(grid,kind,args):
+    if kind=='sphere':
+        return grid.QuerySphere(*args)
+    if kind=='box':
+        return grid.QueryBox(*args)
+    return grid.QuerySlab(*args)
+
+def _Expected(fiberIndex,kind,args):
+    if kind=='sphere':
+        center,radius=args
+        center=np.asarray(center)
+        return _BruteForce(fiberIndex, \
+            lambda p: np.square(p-center).sum(axis=1)<=radius*radius)
+    if kind=='box':
+        lower,upper=args
+        return _BruteForce(fiberIndex,lambda p: ((p>=lower)&(p<=upper)).all(axis=1))
+    normal,offset,thickness=args
+    return _BruteForce(fiberIndex, \
+        lambda p: np.abs(np.dot(p,normal)-offset)<=0.5*thickness)
+
+#==============================================================================
+# SpatialIndexTest(filename=None)
+#    Sphere, box and slab queries must find the lines a test of every point
+#    finds, on the test data and on random walk lines.
+#==============================================================================
+def SpatialIndexTest(filename=None):
+    if filename is None:
+        filename=_TestDataFile()
+    rng=np.random.RandomState(1)
+    passed=True
+    for label,fiberIndex in [('test data',GetFiberIndex(LoadPolyData(filename))), \
+                             ('random walks',_RandomWalkIndex(2000,100))]:
+        same=True
+        for cellSize in [None,0.7,25.0]:
+            grid=FiberGrid(fiberIndex,cellSize)
+            for kind,args in _Queries(fiberIndex,rng,20):
+                same=same and np.array_equal(_Run(grid,kind,args), \
+                    _Expected(fiberIndex,kind,args))
+        print label+':','identical' if same else 'DIFFERENT'
+        passed=passed and same
+    return passed
+
+#==============================================================================
+# SpatialIndexBenchmark(numLines=20000,numPoints=100,numQueries=50)
+#    Time building the grid and its queries on random walk lines.
+#==============================================================================
+def SpatialIndexBenchmark(numLines=20000,numPoints=100,numQueries=50):
+    fiberIndex=_RandomWalkIndex(numLines,numPoints)
+    t=time.time()
+    grid=FiberGrid(fiberIndex)
+    print 'points: %d, cells: %d, build: %.3f s'% \
+        (numLines*numPoints,grid.GetNumberOfCells(),time.time()-t)
+    queries=_Queries(fiberIndex,np.random.RandomState(2),numQueries)
+    for name in ['sphere','box','slab']:
+        selected=[args for kind,args in queries if kind==name]
+        t=time.time()
+        found=sum(_Run(grid,name,args).shape[0] for args in selected)
+        print '%s: %.2f ms per query, %d lines per query'% \
+            (name,1000*(time.time()-t)/len(selected),found//len(selected))
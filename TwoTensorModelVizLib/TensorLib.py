@@ -0,0 +1,482 @@
+#! /usr/bin/env python
+#coding=utf-8
+
+'''
+This is a support library for
+Two-tensor Model Visualization Extension Module for 3D Slicer.
+
+It precomputes the eigen decomposition of the tensors defined on line points.
+
+Wenyao Zhang
+School of Computer Science, Beijing Institute of Technology
+zhwenyao@bit.edu.cn
+2014.9-2015.6
+'''
+
+import os
+import time
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from PolyDataLib import *
+from PolyDataLib import _GetCachedObject,_SetCachedObject
+
+#==============================================================================
+# CalTensorEigsBatch(tensors)
+#    tensors: numpy array with shape (N,9) or (N,3,3)
+#    return eigen values (N,3) sorted in descending order, and eigen vectors
+#    (N,3,3) where eigVecs[i,:,k] belongs to eigVals[i,k]
+#==============================================================================
+def CalTensorEigsBatch(tensors):
+    mats=np.asarray(tensors,dtype=np.float64).reshape(-1,3,3)
+    # the tensors are symmetric, remove rounding noise before eigh
+    mats=0.5*(mats+mats.transpose(0,2,1))
+    eigVals,eigVecs=np.linalg.eigh(mats)  # in ascending order
+    return eigVals[:,::-1],eigVecs[:,:,::-1]
+
+#==============================================================================
+# Degenerate eigen values
+#    Two eigen values are taken as equal when their gap is below
+#    EIG_EQUAL_TOL times the largest absolute eigen value.
+#    DEGENERATE_MAJOR: eigVals[0]~eigVals[1] (oblate, disk like tensor)
+#    DEGENERATE_MINOR: eigVals[1]~eigVals[2] (prolate, e.g. UKF tensors)
+#    Both bits are set for isotropic tensors.
+#==============================================================================
+EIG_EQUAL_TOL=1e-5
+DEGENERATE_MAJOR=1
+DEGENERATE_MINOR=2
+
+def FindDegenerateEigs(eigVals,tol=EIG_EQUAL_TOL):
+    ref=tol*np.abs(eigVals).max(axis=1)
+    flags=np.zeros(eigVals.shape[0],dtype=np.uint8)
+    flags[eigVals[:,0]-eigVals[:,1]<=ref]|=DEGENERATE_MAJOR
+    flags[eigVals[:,1]-eigVals[:,2]<=ref]|=DEGENERATE_MINOR
+    return flags
+
+#==============================================================================
+# SymmetricTensor6(tensors)
+#    tensors: numpy array with shape (N,9) or (N,3,3)
+#    return (N,6) float64 array with the unique components in the order
+#    xx,xy,xz,yy,yz,zz (off-diagonal components are averaged)
+#==============================================================================
+def SymmetricTensor6(tensors):
+    t=np.asarray(tensors,dtype=np.float64).reshape(-1,9)
+    t6=np.empty((t.shape[0],6))
+    t6[:,0]=t[:,0]
+    t6[:,1]=0.5*(t[:,1]+t[:,3])
+    t6[:,2]=0.5*(t[:,2]+t[:,6])
+    t6[:,3]=t[:,4]
+    t6[:,4]=0.5*(t[:,5]+t[:,7])
+    t6[:,5]=t[:,8]
+    return t6
+
+def _Dot(a,b):
+    return (a*b).sum(axis=1)
+
+def _Normalize(a):
+    norm=np.sqrt(_Dot(a,a))
+    return a/np.maximum(norm,1e-300)[:,np.newaxis]
+
+#==============================================================================
+# CalSymEigs6(t6,tol=EIG_EQUAL_TOL,chunkSize=4096)
+#    t6: (N,6) symmetric tensors as returned by SymmetricTensor6
+#    Closed-form eigen decomposition using only numpy array operations:
+#    the eigen values come from the trigonometric solution of the
+#    characteristic cubic, the eigen vector of the most isolated eigen value
+#    from cross products of the rows of (T-lambda*I), and the remaining pair
+#    from an exact 2x2 rotation in the orthogonal plane, which stays
+#    accurate when the pair is (nearly) degenerate.
+#    The tensors are processed in chunks so the temporaries stay in cache.
+#    return eigVals (N,3) in descending order, eigVecs (N,3,3) with
+#    eigVecs[i,:,k] belonging to eigVals[i,k] and det(eigVecs[i])=+1, and
+#    the degenerate flags of FindDegenerateEigs
+#==============================================================================
+def CalSymEigs6(t6,tol=EIG_EQUAL_TOL,chunkSize=4096):
+    t6=np.asarray(t6).reshape(-1,6)
+    n=t6.shape[0]
+    eigVals=np.empty((n,3))
+    eigVecs=np.empty((n,3,3))
+    for start in range(0,n,chunkSize):
+        end=min(start+chunkSize,n)
+        cols=np.ascontiguousarray(t6[start:end].T,dtype=np.float64)
+        _SymEigs6Chunk(cols,eigVals[start:end],eigVecs[start:end])
+    return eigVals,eigVecs,FindDegenerateEigs(eigVals,tol)
+
+def _SymEigs6Chunk(cols,eigVals,eigVecs):
+    a00,a01,a02,a11,a12,a22=cols
+    n=a00.shape[0]
+    
+    # eigen values of the deviatoric part: m+2*sqrt(p)*cos(phi+2k*pi/3)
+    m=(a00+a11+a22)*(1.0/3.0)
+    b00=a00-m
+    b11=a11-m
+    b22=a22-m
+    p=(b00*b00+b11*b11+b22*b22+2.0*(a01*a01+a02*a02+a12*a12))*(1.0/6.0)
+    detB=b00*(b11*b22-a12*a12)-a01*(a01*b22-a12*a02)+a02*(a01*a12-b11*a02)
+    sp=np.sqrt(p)
+    den=2.0*p*sp
+    r=np.zeros(n)
+    np.divide(detB,den,out=r,where=den>0)
+    phi=np.arccos(np.clip(r,-1.0,1.0))*(1.0/3.0)
+    l0=m+2.0*sp*np.cos(phi)
+    l2=m+2.0*sp*np.cos(phi+2.0*np.pi/3.0)
+    l1=3.0*m-l0-l2
+    
+    # eigen vector of the largest or the smallest eigen value, whichever
+    # is more isolated: the longest cross product of two rows of T-li*I
+    top=(l0-l1)>=(l1-l2)
+    li=np.where(top,l0,l2)
+    d0=a00-li
+    d1=a11-li
+    d2=a22-li
+    c01=(a01*a12-a02*d1,a02*a01-d0*a12,d0*d1-a01*a01)
+    c02=(a01*d2-a02*a12,a02*a02-d0*d2,d0*a12-a01*a02)
+    c12=(d1*d2-a12*a12,a12*a02-a01*d2,a01*a12-d1*a02)
+    n01=c01[0]*c01[0]+c01[1]*c01[1]+c01[2]*c01[2]
+    n02=c02[0]*c02[0]+c02[1]*c02[1]+c02[2]*c02[2]
+    n12=c12[0]*c12[0]+c12[1]*c12[1]+c12[2]*c12[2]
+    use01=(n01>=n02)&(n01>=n12)
+    use02=(n02>=n12)&~use01
+    ex=np.where(use01,c01[0],np.where(use02,c02[0],c12[0]))
+    ey=np.where(use01,c01[1],np.where(use02,c02[1],c12[1]))
+    ez=np.where(use01,c01[2],np.where(use02,c02[2],c12[2]))
+    norm=np.maximum(np.maximum(n01,n02),n12)
+    # a zero tensor has no usable row, any direction will do
+    zero=norm==0
+    ex[zero]=1.0
+    norm[zero]=1.0
+    inv=1.0/np.sqrt(norm)
+    ex*=inv
+    ey*=inv
+    ez*=inv
+    
+    # orthonormal basis (u,v) of the plane perpendicular to e, from the
+    # coordinate axis least aligned with e; (e,u,v) is right-handed
+    ax=np.abs(ex)
+    ay=np.abs(ey)
+    az=np.abs(ez)
+    useX=(ax<=ay)&(ax<=az)
+    useY=(ay<=az)&~useX
+    ux=np.where(useX,0.0,np.where(useY,-ez,ey))
+    uy=np.where(useX,ez,np.where(useY,0.0,-ex))
+    uz=np.where(useX,-ey,np.where(useY,ex,0.0))
+    inv=1.0/np.sqrt(ux*ux+uy*uy+uz*uz)
+    ux*=inv
+    uy*=inv
+    uz*=inv
+    vx=ey*uz-ez*uy
+    vy=ez*ux-ex*uz
+    vz=ex*uy-ey*ux
+    
+    # the remaining 2x2 problem [[a,b],[b,c]] in that plane
+    tux=a00*ux+a01*uy+a02*uz
+    tuy=a01*ux+a11*uy+a12*uz
+    tuz=a02*ux+a12*uy+a22*uz
+    a=ux*tux+uy*tuy+uz*tuz
+    b=vx*tux+vy*tuy+vz*tuz
+    c=vx*(a00*vx+a01*vy+a02*vz)+vy*(a01*vx+a11*vy+a12*vz)+ \
+      vz*(a02*vx+a12*vy+a22*vz)
+    mid=0.5*(a+c)
+    rad=np.hypot(0.5*(a-c),b)
+    theta=0.5*np.arctan2(2.0*b,a-c)
+    cs=np.cos(theta)
+    sn=np.sin(theta)
+    muHigh=np.where(top,np.minimum(mid+rad,li),mid+rad)
+    muLow=np.where(top,mid-rad,np.maximum(mid-rad,li))
+    
+    eigVals[:,0]=np.where(top,li,muHigh)
+    eigVals[:,1]=np.where(top,muHigh,muLow)
+    eigVals[:,2]=np.where(top,muLow,li)
+    
+    # wHigh=cs*u+sn*v, wLow=e x wHigh; both (e,wHigh,wLow) and its cyclic
+    # permutation (wHigh,wLow,e) are proper rotations
+    for k,(uk,vk,ek) in enumerate([(ux,vx,ex),(uy,vy,ey),(uz,vz,ez)]):
+        wHigh=cs*uk+sn*vk
+        wLow=cs*vk-sn*uk
+        eigVecs[:,k,0]=np.where(top,ek,wHigh)
+        eigVecs[:,k,1]=np.where(top,wHigh,wLow)
+        eigVecs[:,k,2]=np.where(top,wLow,ek)
+
+#==============================================================================
+# TensorEigens(eigVals,eigVecs)
+#    Per point eigen values and eigen vectors of a tensor array,
+#    with scalar measures derived from them.
+#==============================================================================
+class TensorEigens:
+    def __init__(self,eigVals,eigVecs,degenerate=None):
+        self.eigVals=eigVals
+        self.eigVecs=eigVecs
+        if degenerate is None:
+            degenerate=FindDegenerateEigs(eigVals)
+        self.degenerate=degenerate
+
+    def GetNumberOfTensors(self):
+        return self.eigVals.shape[0]
+
+    def GetMaxEigs(self):
+        return self.eigVecs[:,:,0],self.eigVals[:,0]
+
+    def GetTrace(self):
+        return self.eigVals.sum(axis=1)
+
+    def GetFA(self):
+        mean=self.eigVals.mean(axis=1)
+        num=np.square(self.eigVals-mean[:,np.newaxis]).sum(axis=1)
+        den=np.square(self.eigVals).sum(axis=1)
+        fa=np.zeros(mean.shape[0])
+        valid=den>0
+        fa[valid]=np.sqrt(1.5*num[valid]/den[valid])
+        return fa
+
+#==============================================================================
+# CompactTensors(data,scale)
+#    Symmetric tensors stored as their 6 unique components (order of
+#    SymmetricTensor6) in a contiguous float32 or float16 array; the tensor
+#    of point i is data[i]*scale.
+#    Memory per tensor: 24 bytes (float32) or 12 bytes (float16), against
+#    36 bytes for a float 9-component vtk array and 72 bytes for double.
+#
+#    Error bounds, per component t and its stored value t'
+#      float32: |t-t'| <= 2^-24*|t|                 (scale is 1)
+#      float16: |t-t'| <= max(2^-11*|t|,2^-25*scale)
+#    float16 data are divided by scale=max|t| of the array first, so that
+#    diffusivities (~1e-3 mm^2/s) stay inside the float16 normal range;
+#    only components below 6.1e-5*scale lose relative precision.
+#    By Weyl's theorem every eigen value moves at most by the Frobenius norm
+#    of the component errors, which GetEigenValueErrorBound returns per
+#    tensor; an eigen vector turns at most by that bound divided by the gap
+#    to the nearest other eigen value.
+#==============================================================================
+class CompactTensors:
+    def __init__(self,data,scale=1.0):
+        self.data=data
+        self.scale=scale
+    
+    def GetNumberOfTensors(self):
+        return self.data.shape[0]
+    
+    def GetTensors6(self,start=0,end=None):
+        t6=self.data[start:end].astype(np.float64)
+        if self.scale!=1.0:
+            t6*=self.scale
+        return t6
+    
+    def GetEigenValueErrorBound(self):
+        t6=np.abs(self.GetTensors6())
+        if self.data.dtype==np.float16:
+            err=np.maximum(t6*2.0**-11,2.0**-25*self.scale)
+        else:
+            err=t6*2.0**-24
+        err=np.square(err)
+        # off-diagonal components appear twice in the full tensor
+        err[:,[1,2,4]]*=2.0
+        return np.sqrt(err.sum(axis=1))
+    
+    def CalEigens(self,tol=None,index=None):
+        # index: only the tensors data[index]
+        # float16 rounding alone splits equal eigen values by ~2^-11
+        if tol is None:
+            tol=2.0**-9 if self.data.dtype==np.float16 else EIG_EQUAL_TOL
+        data=self.data if index is None else self.data[index]
+        eigVals,eigVecs,degenerate=CalSymEigs6(data,tol)
+        if self.scale!=1.0:
+            eigVals*=self.scale
+        return TensorEigens(eigVals,eigVecs,degenerate)
+
+#==============================================================================
+# BuildCompactTensors(tensors,dtype=np.float32,chunkSize=65536)
+#    tensors: vtkDataArray or numpy array with 9 components per tuple
+#    Convert the tensors chunk by chunk, so no full double copy is made.
+#==============================================================================
+def BuildCompactTensors(tensors,dtype=np.float32,chunkSize=65536):
+    if isinstance(tensors,vtk.vtkDataArray):
+        tensors=numpy_support.vtk_to_numpy(tensors)
+    tensors=tensors.reshape(-1,9)
+    dtype=np.dtype(dtype)
+    n=tensors.shape[0]
+    
+    scale=1.0
+    if dtype==np.float16 and n>0:
+        scale=float(np.abs(tensors).max())
+        if scale==0.0:
+            scale=1.0
+    
+    data=np.empty((n,6),dtype=dtype)
+    for start in range(0,n,chunkSize):
+        end=min(start+chunkSize,n)
+        t6=SymmetricTensor6(tensors[start:end])
+        if scale!=1.0:
+            t6/=scale
+        data[start:end]=t6
+    return CompactTensors(data,scale)
+
+#==============================================================================
+# GetCompactTensors(inpd,tname,dtype=np.float32)
+#    Return the CompactTensors of the point array tname, or None if inpd
+#    has no such array. They are rebuilt when the tensor array is modified.
+#    SetCompactTensors stores ones read from a cache file.
+#==============================================================================
+_compactTensorsCache={}
+
+def GetCompactTensors(inpd,tname,dtype=np.float32):
+    array=GetPointArrayByName(inpd,tname)
+    if array is None:
+        return None
+    key=(array.GetAddressAsString('vtkDataArray'),np.dtype(dtype).name)
+    return _GetCachedObject(_compactTensorsCache,key,array.GetMTime(), \
+        BuildCompactTensors,array,dtype)
+
+def SetCompactTensors(inpd,tname,compact,dtype=np.float32):
+    array=GetPointArrayByName(inpd,tname)
+    key=(array.GetAddressAsString('vtkDataArray'),np.dtype(dtype).name)
+    _SetCachedObject(_compactTensorsCache,key,array.GetMTime(),compact)
+
+#==============================================================================
+# GetTensorEigens(inpd,tname,method='closedform',dtype=np.float32)
+#    Return the TensorEigens of the point array tname, or None if inpd has
+#    no such array. The eigen decomposition of all points is done in one
+#    batch and recomputed only when the tensor array is modified.
+#    method: 'closedform' solves the CompactTensors (of dtype) with
+#            CalSymEigs6, 'eigh' uses CalTensorEigsBatch on the vtk array
+#    SetTensorEigens stores ones read from a cache file.
+#==============================================================================
+_tensorEigensCache={}
+
+def _BuildTensorEigens(inpd,array,tname,method,dtype):
+    if method=='eigh':
+        tensors=numpy_support.vtk_to_numpy(array)
+        eigVals,eigVecs=CalTensorEigsBatch(tensors)
+        return TensorEigens(eigVals,eigVecs)
+    return GetCompactTensors(inpd,tname,dtype).CalEigens()
+
+def GetTensorEigens(inpd,tname,method='closedform',dtype=np.float32):
+    array=GetPointArrayByName(inpd,tname)
+    if array is None:
+        return None
+    key=(array.GetAddressAsString('vtkDataArray'),method,np.dtype(dtype).name)
+    return _GetCachedObject(_tensorEigensCache,key,array.GetMTime(), \
+        _BuildTensorEigens,inpd,array,tname,method,dtype)
+
+def SetTensorEigens(inpd,tname,eigens,method='closedform',dtype=np.float32):
+    array=GetPointArrayByName(inpd,tname)
+    key=(array.GetAddressAsString('vtkDataArray'),method,np.dtype(dtype).name)
+    _SetCachedObject(_tensorEigensCache,key,array.GetMTime(),eigens)
+
+#==============================================================================
+# For Test
+#==============================================================================
+def _Normalize4(a):
+    return a/np.sqrt(np.square(a).sum(axis=1))[:,np.newaxis]
+
+def _TestDataFile():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+        '..','TestData','two-tensor-with-water.vtk')
+
+def _SyntheticTensors(n,seed=0):
+    # random rotations with general, prolate, oblate and isotropic spectra
+    rng=np.random.RandomState(seed)
+    w,x,y,z=_Normalize4(rng.randn(n,4)).T
+    q=np.empty((n,3,3))
+    q[:,0,0]=1-2*(y*y+z*z)
+    q[:,0,1]=2*(x*y-w*z)
+    q[:,0,2]=2*(x*z+w*y)
+    q[:,1,0]=2*(x*y+w*z)
+    q[:,1,1]=1-2*(x*x+z*z)
+    q[:,1,2]=2*(y*z-w*x)
+    q[:,2,0]=2*(x*z-w*y)
+    q[:,2,1]=2*(y*z+w*x)
+    q[:,2,2]=1-2*(x*x+y*y)
+    vals=rng.uniform(1e-4,3e-3,(n,3))
+    kind=np.arange(n)%4
+    vals[kind==1,2]=vals[kind==1,1]
+    vals[kind==2,1]=vals[kind==2,0]
+    vals[kind==3,1:]=vals[kind==3,:1]
+    return np.einsum('nij,nj,nkj->nik',q,vals,q).reshape(n,9)
+
+def _CompareWithEigh(tensors,tol):
+    refVals,refVecs=CalTensorEigsBatch(tensors)
+    t6=SymmetricTensor6(tensors)
+    eigVals,eigVecs,degenerate=CalSymEigs6(t6)
+    mats=t6[:,[0,1,2,1,3,4,2,4,5]].reshape(-1,3,3)
+    scale=np.abs(refVals).max(axis=1)[:,np.newaxis]
+    scale[scale==0]=1.0
+    
+    valErr=(np.abs(eigVals-refVals)/scale).max()
+    # residual |T*v-lambda*v| is meaningful for degenerate pairs too
+    res=np.einsum('nij,njk->nik',mats,eigVecs)-eigVecs*eigVals[:,np.newaxis,:]
+    resErr=(np.sqrt(np.square(res).sum(axis=1))/scale).max()
+    orthErr=np.abs(np.einsum('nji,njk->nik',eigVecs,eigVecs)-np.eye(3)).max()
+    detErr=np.abs(np.linalg.det(eigVecs)-1.0).max()
+    # the principal direction must agree wherever it is well defined
+    distinct=(degenerate&DEGENERATE_MAJOR)==0
+    dirErr=0.0
+    if distinct.any():
+        cosang=np.abs(_Dot(eigVecs[distinct,:,0],refVecs[distinct,:,0]))
+        dirErr=(1.0-cosang).max()
+    
+    print '    eigen value error:   %g' % valErr
+    print '    residual error:      %g' % resErr
+    print '    orthonormal error:   %g' % orthErr
+    print '    determinant error:   %g' % detErr
+    print '    principal dir error: %g' % dirErr
+    print '    degenerate major/minor: %d/%d of %d' % \
+        (((degenerate&DEGENERATE_MAJOR)>0).sum(), \
+         ((degenerate&DEGENERATE_MINOR)>0).sum(),degenerate.shape[0])
+    return max(valErr,resErr,orthErr,detErr,dirErr)<tol
+
+def EigenSolverTest(filename=None,tol=1e-8):
+    if filename is None:
+        filename=_TestDataFile()
+    inpd=LoadPolyData(filename)
+    passed=True
+    for tname in ['tensor1','tensor2']:
+        print 'Test data',tname
+        array=GetPointArrayByName(inpd,tname)
+        passed=_CompareWithEigh(numpy_support.vtk_to_numpy(array),tol) and passed
+    print 'Synthetic tensors'
+    passed=_CompareWithEigh(_SyntheticTensors(20000),tol) and passed
+    print 'EigenSolverTest','passed' if passed else 'FAILED'
+    return passed
+
+def CompactTensorsTest(filename=None):
+    if filename is None:
+        filename=_TestDataFile()
+    inpd=LoadPolyData(filename)
+    passed=True
+    for tname in ['tensor1','tensor2']:
+        array=GetPointArrayByName(inpd,tname)
+        tensors=numpy_support.vtk_to_numpy(array)
+        exact=SymmetricTensor6(tensors)
+        refVals=CalSymEigs6(exact)[0]
+        for dtype in [np.float32,np.float16]:
+            compact=BuildCompactTensors(array,dtype)
+            compErr=np.abs(compact.GetTensors6()-exact)
+            eigErr=np.abs(compact.CalEigens().eigVals-refVals).max(axis=1)
+            bound=compact.GetEigenValueErrorBound()
+            # allow the solver rounding on top of the storage bound
+            ok=(eigErr<=bound+1e-12*np.abs(refVals).max()).all()
+            print '%s %s: %d bytes/tensor, max component error %g, ' \
+                'eigen value error within bound: %s' % (tname, \
+                np.dtype(dtype).name,compact.data.strides[0],compErr.max(),ok)
+            passed=passed and ok
+    print 'CompactTensorsTest','passed' if passed else 'FAILED'
+    return passed
+
+def EigenSolverBenchmark(n=1000000,repeat=3):
+    tensors=_SyntheticTensors(n)
+    t6=SymmetricTensor6(tensors)
+    timeEigh=1e30
+    timeClosed=1e30
+    for i in range(0,repeat):
+        t=time.time()
+        CalTensorEigsBatch(tensors)
+        timeEigh=min(timeEigh,time.time()-t)
+        t=time.time()
+        CalSymEigs6(t6)
+        timeClosed=min(timeClosed,time.time()-t)
+    print 'Eigen decomposition of %d tensors:' % n
+    print '    np.linalg.eigh: %.3f s' % timeEigh
+    print '    CalSymEigs6:    %.3f s (%.1fx)' % (timeClosed,timeEigh/timeClosed)
+    return timeEigh,timeClosed
@@ -19,7 +19,12 @@ from OpenGL.GLUT import *
 
 import numpy as np
 
+import ctypes
+
 from PolyDataLib import *
+from TensorLib import *
+from GLBufferLib import *
+from ColorMapLib import CalBodyColors
 
 #==============================================================================
 # RenderTensorWithCustomColors(inpd,lineNum,params,tname='tensor2',mode=0)
@@ -28,92 +33,68 @@ from PolyDataLib import *
 #       1 uses the complementary color 
 #==============================================================================
 def RenderTensorWithCustomColors(inpd,lineNum,params,tname='tensor2',mode=0):
+    RenderTensorsWithCustomColors(inpd,[lineNum],params,tname,mode)
+    return
+
+#==============================================================================
+# RenderTensorsWithCustomColors(inpd,lineNums,params,tname='tensor2',mode=0)
+# Render the tensor glyphs of all lines in lineNums (1,2,...) together:
+# one instanced draw call when the context supports it, otherwise one
+# immediate-mode cylinder per glyph.
+#==============================================================================
+def RenderTensorsWithCustomColors(inpd,lineNums,params,tname='tensor2',mode=0):
     
-    # print params
-    space=int(params['glyphSpace'])
-    scale=int(params['glyphScale'])
+    slices=int(params['cylinderSlices'])
+    stacks=int(params['cylinderStacks'])
     
-    pidList = vtk.vtkIdList()
-    if lineNum>inpd.GetNumberOfLines:
-        lineNum=inpd.GetNumberOfLines
-        
-    inlines = inpd.GetLines()
-    inlines.InitTraversal();
-    for lidx in range(0,lineNum):
-        inlines.GetNextCell(pidList)
-     
-    if pidList.GetNumberOfIds() < 2:
+    mats,rgbaTop,rgbaBody,rgbaBottom= \
+        BuildTensorGlyphs(inpd,lineNums,params,tname,mode)
+    
+    if mats.shape[0]==0:
         return
     
-    tensorArray=GetPointArrayByName(inpd,tname)
+    if not RenderCylinderInstances(mats,rgbaTop,rgbaBody,rgbaBottom, \
+                                   slices,stacks):
+        RenderCylinderGlyphs(mats,rgbaTop,rgbaBody,rgbaBottom,slices,stacks)
+    return
 
-    points=inpd.GetPoints()
+#==============================================================================
+# BuildTensorGlyphs(inpd,lineNums,params,tname='tensor2',mode=0)
+# Model matrices and colors of the glyphs of all lines in lineNums,
+# see BuildGlyphMatrices and CalGlyphColors.
+#==============================================================================
+def BuildTensorGlyphs(inpd,lineNums,params,tname='tensor2',mode=0):
+    space=int(params['glyphSpace'])
+    scale=int(params['glyphScale'])
     
-    rgbaTop=[128,128,128,255]
-    rgbaBody=[0,255,0,255]
-    rgbaBottom=[128,128,128,255]
+    fiberIndex=GetFiberIndex(inpd)
+    glyphPids=fiberIndex.GetSampledPointIds(lineNums,space)
     
-    bodRArray=GetPointArrayByName(inpd,params['bodRName'])
-    bodGArray=GetPointArrayByName(inpd,params['bodGName'])
-    bodBArray=GetPointArrayByName(inpd,params['bodBName'])
-    bodAArray=GetPointArrayByName(inpd,params['bodAName'])
+    eigens=GetTensorEigens(inpd,tname)
+    mats=BuildGlyphMatrices(fiberIndex.points[glyphPids], \
+        eigens.eigVecs[glyphPids],eigens.eigVals[glyphPids],scale)
+    rgbaTop,rgbaBody,rgbaBottom=CalGlyphColors(inpd,params,glyphPids,mode)
+    return mats,rgbaTop,rgbaBody,rgbaBottom
+
+#==============================================================================
+# CalGlyphColors(inpd,params,pids,mode=0,lutSize=256)
+# Colors of the glyphs at points pids, as (M,4) uint8 arrays for the top
+# disk, the body and the bottom disk.
+# The body colors come from the bod? params through CalBodyColors.
+# mode 1 takes the complementary rgb colors.
+#==============================================================================
+def CalGlyphColors(inpd,params,pids,mode=0,lutSize=256):
+    rgbaBody=CalBodyColors(inpd,params,pids,mode,lutSize)
     
-    bodRmin,bodRmax=GetMinMaxInArray(bodRArray)
-    bodGmin,bodGmax=GetMinMaxInArray(bodGArray)
-    bodBmin,bodBmax=GetMinMaxInArray(bodBArray)
-    bodAmin,bodAmax=GetMinMaxInArray(bodAArray)
+    rgbaTop=np.empty((pids.shape[0],4),dtype=np.uint8)
+    rgbaTop[:]=[128,128,128,255]
     
-    for i in range(space,pidList.GetNumberOfIds(),space):
-        
-        pid=pidList.GetId(i)
-        pos=points.GetPoint(pid)
-        
-        t=tensorArray.GetTuple9(pid)
-        tensor=np.array([t[0],t[1],t[2],t[3],t[4],t[5],t[6],t[7],t[8]]);
-        
-        # cal the color of cylinder body
-        if params['bodRFlag']==0:
-            rgbaBody[0]=params['bodRValue']
-        else:
-            value=bodRArray.GetComponent(pid,0)
-            rgbaBody[0]=255*(value-bodRmin)/(bodRmax-bodRmin)
-        
-        if params['bodGFlag']==0:
-            rgbaBody[1]=params['bodGValue']
-        else:
-            value=bodGArray.GetComponent(pid,0)
-            rgbaBody[1]=255*(value-bodGmin)/(bodGmax-bodGmin)
-        
-        if params['bodBFlag']==0:
-            rgbaBody[2]=params['bodBValue']
-        else:
-            value=bodBArray.GetComponent(pid,0)
-            rgbaBody[2]=255*(value-bodBmin)/(bodBmax-bodBmin)
-        
-        if params['bodAFlag']==0:
-            rgbaBody[3]=params['bodAValue']
-        else:
-            value=bodAArray.GetComponent(pid,0)
-            rgbaBody[3]=255*(value-bodAmin)/(bodAmax-bodAmin)
-        
-        # cal the complementary color
-        if mode==1:
-            rgbaTop[0]=255-rgbaTop[0]
-            rgbaTop[1]=255-rgbaTop[1]
-            rgbaTop[2]=255-rgbaTop[2]
-            rgbaBody[0]=255-rgbaBody[0]
-            rgbaBody[1]=255-rgbaBody[1]
-            rgbaBody[2]=255-rgbaBody[2]
-            rgbaBottom[0]=255-rgbaBottom[0]
-            rgbaBottom[1]=255-rgbaBottom[1]
-            rgbaBottom[2]=255-rgbaBottom[2]
-        
-        slices=int(params['cylinderSlices'])
-        stacks=int(params['cylinderStacks'])    
-        RenderTensorAsCylinder(pos,tensor,scale,rgbaTop,rgbaBody,rgbaBottom, \
-            slices,stacks)
+    # cal the complementary color
+    if mode==1:
+        rgbaTop[:,:3]=255-rgbaTop[:,:3]
+    
+    return rgbaTop,rgbaBody,rgbaTop.copy()
 
-    return
 #==============================================================================
 # RenderTensorAsCylinder(pos,tensor,scale,rgbaTop,rgbaBody,rgbaBottom,
 #                         slices,stacks)
@@ -121,223 +102,324 @@ def RenderTensorWithCustomColors(inpd,lineNum,params,tname='tensor2',mode=0):
 #==============================================================================
 def RenderTensorAsCylinder(pos,tensor,scale,rgbaTop,rgbaBody,rgbaBottom, \
                            slices=20,stacks=2):
-    glPushMatrix()
-    
     eigVec,eigVal=CalTensorEigs(tensor)
-    
-    # traslate 
-    mat=np.array([[1.0, 0.0, 0.0, 0.0],\
-               [0.0, 1.0, 0.0, 0.0],\
-               [0.0, 0.0, 1.0, 0.0],\
-               [0.0, 0.0, 0.0, 1.0]]);
-    mat[3,0] =pos[0];
-    mat[3,1] =pos[1];
-    mat[3,2] =pos[2];
-    glMultMatrixf(mat);
-    
-    # rotate    
-    matr=np.array([[0.0, 0.0, 0.0, 0.0],\
-               [0.0, 0.0, 0.0, 0.0],\
-               [0.0, 0.0, 0.0, 0.0],\
-               [0.0, 0.0, 0.0, 1.0]]);
-    # scale
-    mats=np.array([[0.0, 0.0, 0.0, 0.0],\
-               [0.0, 0.0, 0.0, 0.0],\
-               [0.0, 0.0, 0.0, 0.0],\
-               [0.0, 0.0, 0.0, 1.0]]);
-    
-    if (eigVal[0]>eigVal[1] and eigVal[0]>eigVal[2]):
-        matr[0,0]=eigVec[0,1];
-        matr[0,1]=eigVec[1,1];
-        matr[0,2]=eigVec[2,1];
-        matr[1,0]=eigVec[0,2];
-        matr[1,1]=eigVec[1,2];
-        matr[1,2]=eigVec[2,2];
-        matr[2,0]=eigVec[0,0];
-        matr[2,1]=eigVec[1,0];
-        matr[2,2]=eigVec[2,0];
-        
-        mats[0,0] =eigVal[1]*scale; 
-        mats[1,1] =eigVal[2]*scale;
-        mats[2,2] =eigVal[0]*scale;  
-    
-    if(eigVal[1]>eigVal[0] and eigVal[1]>eigVal[2]):
-        matr[0,0]=eigVec[0,2];
-        matr[0,1]=eigVec[1,2];
-        matr[0,2]=eigVec[2,2];
-        matr[1,0]=eigVec[0,0];
-        matr[1,1]=eigVec[1,0];
-        matr[1,2]=eigVec[2,0];
-        matr[2,0]=eigVec[0,1];
-        matr[2,1]=eigVec[1,1];
-        matr[2,2]=eigVec[2,1];
-        
-        mats[0,0] =eigVal[2]*scale; 
-        mats[1,1] =eigVal[0]*scale;
-        mats[2,2] =eigVal[1]*scale;
-                
-    if(eigVal[2]>eigVal[0] and eigVal[2]>eigVal[1]):
-        matr[0,0]=eigVec[0,0];
-        matr[0,1]=eigVec[1,0];
-        matr[0,2]=eigVec[2,0];
-        matr[1,0]=eigVec[0,1];
-        matr[1,1]=eigVec[1,1];
-        matr[1,2]=eigVec[2,1];
-        matr[2,0]=eigVec[0,2];
-        matr[2,1]=eigVec[1,2];
-        matr[2,2]=eigVec[2,2];
-        
-        mats[0,0] =eigVal[0]*scale; 
-        mats[1,1] =eigVal[1]*scale;
-        mats[2,2] =eigVal[2]*scale; 
-
-    # Check for the special case where  two big eigen values occurs. 
-    if np.fabs(mats[2,2]-mats[1,1])<10e-10*scale:
-        tmp0=matr[0,0]
-        tmp1=matr[0,1]
-        tmp2=matr[0,2]
-        matr[0,0]=matr[1,0];
-        matr[0,1]=matr[1,1];
-        matr[0,2]=matr[1,2];
-        matr[1,0]=matr[2,0];
-        matr[1,1]=matr[2,1];
-        matr[1,2]=matr[2,2];
-        matr[2,0]=tmp0 
-        matr[2,1]=tmp1 
-        matr[2,2]=tmp2 
-        
-        tmp=mats[0,0]
-        mats[0,0] =mats[1,1] 
-        mats[1,1] =mats[2,2] 
-        mats[2,2] =tmp 
-        
-    elif np.fabs(mats[2,2]-mats[0,0])<10e-10*scale:
-        tmp0=matr[1,0]
-        tmp1=matr[1,1]
-        tmp2=matr[1,2]
-        matr[1,0]=matr[0,0];
-        matr[1,1]=matr[0,1];
-        matr[1,2]=matr[0,2];
-        matr[0,0]=matr[2,0];
-        matr[0,1]=matr[2,1];
-        matr[0,2]=matr[2,2];
-        matr[2,0]=tmp0 
-        matr[2,1]=tmp1 
-        matr[2,2]=tmp2 
-        
-        tmp=mats[1,1]
-        mats[1,1] =mats[0,0] 
-        mats[0,0] =mats[2,2]
-        mats[2,2] =tmp 
-        
-    if np.linalg.det(matr) < 0:
-        # +/- the eigenvector is still an eigenvector
-        # so if we have the set of eigenvectors that
-        # give a negative determinant (not a rotation matrix)
-        # multiply our eigenvectors by -1 to choose 
-        # the other valid set of eigenvectors.
-        matr=np.multiply(matr,-1);
-        # fix the final entry that must be 1.0 for a valid transformation matrix
-        matr[3,3] = 1.0
-        
-    glMultMatrixf(matr)
+    RenderEigensAsCylinder(pos,np.asarray(eigVec),np.asarray(eigVal).reshape(-1), \
+        scale,rgbaTop,rgbaBody,rgbaBottom,slices,stacks)
+    return
 
-    glMultMatrixf(mats)
-    
-    drawCylinderWithTextColors(rgbaTop,rgbaBody,rgbaBottom,slices,stacks)
-    
+#==============================================================================
+# BuildGlyphMatrices(positions,eigVecs,eigVals,scale)
+#    positions: (M,3), eigVecs: (M,3,3) with eigen vectors in columns,
+#    eigVals: (M,3) in any order, e.g. rows of a TensorEigens
+#    Return (M,4,4) float32 model matrices of the cylinder glyphs, each laid
+#    out as glMultMatrixf expects it (translation in row 3).
+#    The cylinder axis (z) follows the largest eigen value p (the first one
+#    on ties), x and y follow eigen values (p+1)%3 and (p+2)%3. When the
+#    largest eigen value equals the one on y (or else the one on x), the
+#    axes are cycled so the axis follows the distinct eigen vector. Finally
+#    the eigen vectors are negated where needed to get a proper rotation.
+#==============================================================================
+def BuildGlyphMatrices(positions,eigVecs,eigVals,scale):
+    eigVals=np.asarray(eigVals,dtype=np.float64).reshape(-1,3)
+    eigVecs=np.asarray(eigVecs,dtype=np.float64).reshape(-1,3,3)
+    num=eigVals.shape[0]
+    rows=np.arange(num)[:,np.newaxis]
+    
+    # eigen value index on the x,y,z axes of the glyph
+    principal=eigVals.argmax(axis=1)
+    order=(principal[:,np.newaxis]+np.array([1,2,0]))%3
+    
+    # Check for the special case where two big eigen values occur.
+    # Eigen values are taken as equal as in FindDegenerateEigs.
+    axisVals=eigVals[rows,order]
+    eps=EIG_EQUAL_TOL*np.fabs(eigVals).max(axis=1)
+    cycle1=np.fabs(axisVals[:,2]-axisVals[:,1])<=eps
+    cycle2=~cycle1&(np.fabs(axisVals[:,2]-axisVals[:,0])<=eps)
+    order[cycle1]=order[cycle1][:,[1,2,0]]
+    order[cycle2]=order[cycle2][:,[2,0,1]]
+    
+    rot=eigVecs[rows[:,:,np.newaxis],np.arange(3)[:,np.newaxis],order[:,np.newaxis,:]]
+    
+    # +/- the eigenvector is still an eigenvector, so if the set gives a
+    # negative determinant (not a rotation) use the other valid set
+    det=rot[:,0,0]*(rot[:,1,1]*rot[:,2,2]-rot[:,1,2]*rot[:,2,1])- \
+        rot[:,0,1]*(rot[:,1,0]*rot[:,2,2]-rot[:,1,2]*rot[:,2,0])+ \
+        rot[:,0,2]*(rot[:,1,0]*rot[:,2,1]-rot[:,1,1]*rot[:,2,0])
+    rot[det<0]*=-1.0
+    
+    mats=np.zeros((num,4,4),dtype=np.float32)
+    mats[:,:3,:3]=(rot*(eigVals[rows,order]*scale)[:,np.newaxis,:]).transpose(0,2,1)
+    mats[:,3,:3]=positions
+    mats[:,3,3]=1.0
+    return mats
+
+#==============================================================================
+# ScaleGlyphMatrices(mats,scale)
+#    Matrices of BuildGlyphMatrices(...,1) for another scale, without going
+#    through the eigen vectors again.
+#==============================================================================
+def ScaleGlyphMatrices(mats,scale):
+    scaled=mats.copy()
+    scaled[:,:3,:3]*=scale
+    return scaled
+
+#==============================================================================
+# RenderEigensAsCylinder(pos,eigVec,eigVal,scale,rgbaTop,rgbaBody,rgbaBottom,
+#                        slices,stacks)
+# Visualize a tensor given by its eigen vectors (columns of eigVec) and
+# eigen values, e.g. as precomputed by GetTensorEigens.
+#==============================================================================
+def RenderEigensAsCylinder(pos,eigVec,eigVal,scale,rgbaTop,rgbaBody,rgbaBottom, \
+                           slices=20,stacks=2):
+    mat=BuildGlyphMatrices(np.reshape(pos,(1,3)),eigVec,eigVal,scale)[0]
+    RenderCylinderGlyph(mat,rgbaTop,rgbaBody,rgbaBottom,slices,stacks)
+    return
+
+#==============================================================================
+# RenderCylinderGlyphs(mats,rgbaTop,rgbaBody,rgbaBottom,slices,stacks)
+# Immediate-mode fallback of RenderCylinderInstances
+#==============================================================================
+def RenderCylinderGlyphs(mats,rgbaTop,rgbaBody,rgbaBottom,slices=20,stacks=2):
+    for i in range(0,mats.shape[0]):
+        RenderCylinderGlyph(mats[i],rgbaTop[i],rgbaBody[i],rgbaBottom[i], \
+            slices,stacks)
+    return
+
+#==============================================================================
+# RenderCylinderGlyph(mat,rgbaTop,rgbaBody,rgbaBottom,slices,stacks)
+# Draw a cylinder glyph with a model matrix from BuildGlyphMatrices
+#==============================================================================
+def RenderCylinderGlyph(mat,rgbaTop,rgbaBody,rgbaBottom,slices=20,stacks=2):
+    glPushMatrix()
+    glMultMatrixf(mat)
+    drawCylinderWithColors(rgbaTop,rgbaBody,rgbaBottom,slices,stacks)
     glPopMatrix()
     return
 
 #==============================================================================
-# drawCylinderWithTextColors(rgbaTop,rgbaBody,rgbaBottom,slices=20,stacks=2)
+# drawCylinderWithColors(rgbaTop,rgbaBody,rgbaBottom,slices=20,stacks=2)
+# The colors feed the lit material through GL_COLOR_MATERIAL.
 #==============================================================================
-def drawCylinderWithTextColors(rgbaTop,rgbaBody,rgbaBottom,slices=20,stacks=2):
-    # Generate Textures
-    tex=glGenTextures(3)
-    
+def drawCylinderWithColors(rgbaTop,rgbaBody,rgbaBottom,slices=20,stacks=2):
     radius=0.5;
     vlen=1;
     
-    ix=4
-    iy=4
-    image = bytearray(ix*iy*4)
-    
-    # Set texture for top disk
-    for i in range(0,ix):
-        for j in range(0,iy):
-            image[(i*ix+j)*4]=int(rgbaTop[0])
-            image[(i*ix+j)*4+1]=int(rgbaTop[1])
-            image[(i*ix+j)*4+2]=int(rgbaTop[2])
-            image[(i*ix+j)*4+3]=int(rgbaTop[3])
-    
-    glBindTexture(GL_TEXTURE_2D, tex[0])   
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, ix, iy, 0, GL_RGBA, GL_UNSIGNED_BYTE, image)
-    
-    # Set texture for body
-    for i in range(0,ix):
-        for j in range(0,iy):
-            image[(i*ix+j)*4]=int(rgbaBody[0])
-            image[(i*ix+j)*4+1]=int(rgbaBody[1])
-            image[(i*ix+j)*4+2]=int(rgbaBody[2])
-            image[(i*ix+j)*4+3]=int(rgbaBody[3])
-    
-    glBindTexture(GL_TEXTURE_2D, tex[1])   
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, ix, iy, 0, GL_RGBA, GL_UNSIGNED_BYTE, image)
-    
-    # Set texture for bottom disk
-    for i in range(0,ix):
-        for j in range(0,iy):
-            image[(i*ix+j)*4]=int(rgbaBottom[0])
-            image[(i*ix+j)*4+1]=int(rgbaBottom[1])
-            image[(i*ix+j)*4+2]=int(rgbaBottom[2])
-            image[(i*ix+j)*4+3]=int(rgbaBottom[3])
-    
-    glBindTexture(GL_TEXTURE_2D, tex[2])   
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, ix, iy, 0, GL_RGBA, GL_UNSIGNED_BYTE, image)
-    
     # begin to draw objects
     glPushMatrix()
 
     quadric=gluNewQuadric(); 
     gluQuadricNormals(quadric, GLU_SMOOTH);   
-    gluQuadricTexture(quadric, GL_TRUE)
     
-    glEnable(GL_TEXTURE_2D)
+    glEnable(GL_COLOR_MATERIAL)
+    glColorMaterial(GL_FRONT_AND_BACK,GL_AMBIENT_AND_DIFFUSE)
     
     # traslate
     glTranslatef( 0,0,-0.5 )
     
     # draw the first cap
-    glBindTexture(GL_TEXTURE_2D, tex[0])
+    glColor4ub(*[int(c) for c in rgbaTop])
     gluQuadricOrientation(quadric,GLU_INSIDE);
     gluDisk( quadric, 0.0, radius, slices, stacks);
     
     # draw the body
-    glBindTexture(GL_TEXTURE_2D, tex[1])
+    glColor4ub(*[int(c) for c in rgbaBody])
     gluQuadricOrientation(quadric,GLU_OUTSIDE);
     gluCylinder(quadric, radius, radius, vlen, slices, stacks);
     
     # draw the second cap
-    glBindTexture(GL_TEXTURE_2D, tex[2])
+    glColor4ub(*[int(c) for c in rgbaBottom])
     glTranslatef( 0,0,vlen);
     gluQuadricOrientation(quadric,GLU_OUTSIDE);
     gluDisk( quadric, 0.0, radius, slices, stacks);
     
-    glDisable(GL_TEXTURE_2D)
+    glDisable(GL_COLOR_MATERIAL)
     
     gluDeleteQuadric(quadric)
     
     glPopMatrix()
-    
-    # Delete texture, release display memory
-    glDeleteTextures(tex)
     return
 
 #==============================================================================
+# BuildCylinderMesh(slices=20,stacks=2)
+# Triangles of the unit glyph drawn by drawCylinderWithColors: a
+# cylinder of radius 0.5 along z from -0.5 to 0.5 with a disk at each end.
+# Return an (n,7) float32 array: position, normal and the part
+# (0 top disk at z=-0.5, 1 body, 2 bottom disk at z=0.5).
+#==============================================================================
+def BuildCylinderMesh(slices=20,stacks=2):
+    radius=0.5
+    angles=2*np.pi*np.arange(slices+1)/slices
+    cs=np.cos(angles)
+    sn=np.sin(angles)
+    
+    # grid corners (i,j) of each quad, split into two triangles
+    def quads(nu,nv):
+        i,j=np.meshgrid(np.arange(nu),np.arange(nv),indexing='ij')
+        i=i.reshape(-1,1)
+        j=j.reshape(-1,1)
+        di=np.array([0,1,1,0,1,0])
+        dj=np.array([0,0,1,0,1,1])
+        return (i+di).reshape(-1),(j+dj).reshape(-1)
+    
+    # body, stacks rows of slices quads
+    k,st=quads(slices,stacks)
+    z=-0.5+st/float(stacks)
+    body=np.column_stack((radius*cs[k],radius*sn[k],z,cs[k],sn[k], \
+        np.zeros_like(z),np.ones_like(z)))
+    
+    # disks, stacks rings of slices quads
+    k,ring=quads(slices,stacks)
+    r=radius*ring/float(stacks)
+    top=np.column_stack((r*cs[k],r*sn[k],np.zeros_like(r)-0.5, \
+        np.zeros_like(r),np.zeros_like(r),np.zeros_like(r)-1,np.zeros_like(r)))
+    bottom=top.copy()
+    bottom[:,2]=0.5
+    bottom[:,5]=1
+    bottom[:,6]=2
+    
+    return np.concatenate((top,body,bottom)).astype(np.float32)
+
+_cylinderMeshes={}
+
+def _GetCylinderMesh(slices,stacks):
+    key=(slices,stacks)
+    if key not in _cylinderMeshes:
+        mesh=BuildCylinderMesh(slices,stacks)
+        vbo=VertexBuffer()
+        vbo.Upload(mesh)
+        _cylinderMeshes[key]=(vbo,mesh.shape[0])
+    return _cylinderMeshes[key]
+
+#==============================================================================
+# Instanced cylinder glyphs
+# Per instance: the 4 rows of the glMultMatrixf layout model matrix (they
+# are the columns of the GL matrix) and the top, body and bottom colors.
+# Lighting follows the first light as the fixed pipeline would, with the
+# part color as material like drawCylinderWithColors.
+#==============================================================================
+_GLYPH_VERTEX_SHADER = """
+#version 120
+attribute vec3 position;
+attribute vec3 normal;
+attribute float part;
+attribute vec4 model0;
+attribute vec4 model1;
+attribute vec4 model2;
+attribute vec4 model3;
+attribute vec4 colorTop;
+attribute vec4 colorBody;
+attribute vec4 colorBottom;
+varying vec4 color;
+void main()
+{
+    mat4 model=mat4(model0,model1,model2,model3);
+    mat3 m3=mat3(model0.xyz,model1.xyz,model2.xyz);
+    // inverse transpose of rotation*scale, without inverting
+    vec3 s2=vec3(dot(m3[0],m3[0]),dot(m3[1],m3[1]),dot(m3[2],m3[2]));
+    vec3 n=normalize(gl_NormalMatrix*(m3*(normal/max(s2,vec3(1e-30)))));
+    vec4 eye=gl_ModelViewMatrix*model*vec4(position,1.0);
+    vec3 l=gl_LightSource[0].position.w==0.0 ?
+        normalize(gl_LightSource[0].position.xyz) :
+        normalize(gl_LightSource[0].position.xyz-eye.xyz);
+    float diffuse=abs(dot(n,l));
+    vec4 c=part<0.5 ? colorTop : (part<1.5 ? colorBody : colorBottom);
+    color=vec4(c.rgb*(0.2+0.8*diffuse),c.a);
+    gl_Position=gl_ProjectionMatrix*eye;
+}
+"""
+
+_GLYPH_FRAGMENT_SHADER = """
+#version 120
+varying vec4 color;
+void main()
+{
+    gl_FragColor=color;
+}
+"""
+
+_GLYPH_ATTRIBS={'position':0,'normal':1,'part':2, \
+    'model0':3,'model1':4,'model2':5,'model3':6, \
+    'colorTop':7,'colorBody':8,'colorBottom':9}
+
+_glyphProgram=None
+
+def InstancedGlyphsSupported():
+    return bool(_GetGlyphProgram())
+
+def _GetGlyphProgram():
+    global _glyphProgram
+    if _glyphProgram is None:
+        _glyphProgram=0
+        if InstancingSupported():
+            _glyphProgram=CreateProgram(_GLYPH_VERTEX_SHADER, \
+                _GLYPH_FRAGMENT_SHADER,_GLYPH_ATTRIBS)
+    return _glyphProgram
+
+#==============================================================================
+# CylinderInstances()
+# Instance buffers of a set of cylinder glyphs, drawn with one call.
+#==============================================================================
+class CylinderInstances:
+    def __init__(self):
+        self.matrixBuffer=VertexBuffer()
+        self.colorBuffer=VertexBuffer()
+        self.count=0
+
+    def SetMatrices(self,mats,usage=GL_STATIC_DRAW):
+        self.matrixBuffer.Upload(np.asarray(mats,dtype=np.float32). \
+            reshape(-1,16),usage)
+        self.count=mats.shape[0]
+
+    def SetColors(self,rgbaTop,rgbaBody,rgbaBottom,usage=GL_STATIC_DRAW):
+        self.colorBuffer.Upload(np.hstack((rgbaTop,rgbaBody,rgbaBottom)). \
+            astype(np.uint8),usage)
+
+    def Draw(self,slices=20,stacks=2):
+        program=_GetGlyphProgram()
+        if not program:
+            return False
+        if self.count==0:
+            return True
+        mesh,vertexCount=_GetCylinderMesh(slices,stacks)
+        
+        glUseProgram(program)
+        mesh.Bind()
+        SetVertexAttrib(0,3,GL_FLOAT,28,0)
+        SetVertexAttrib(1,3,GL_FLOAT,28,12)
+        SetVertexAttrib(2,1,GL_FLOAT,28,24)
+        self.matrixBuffer.Bind()
+        for k in range(0,4):
+            SetVertexAttrib(3+k,4,GL_FLOAT,64,16*k,divisor=1)
+        self.colorBuffer.Bind()
+        for k in range(0,3):
+            SetVertexAttrib(7+k,4,GL_UNSIGNED_BYTE,12,4*k,True,divisor=1)
+        
+        glDrawArraysInstanced(GL_TRIANGLES,0,vertexCount,self.count)
+        
+        DisableVertexAttribs(range(0,10))
+        self.colorBuffer.Unbind()
+        glUseProgram(0)
+        return True
+
+    def Release(self):
+        self.matrixBuffer.Release()
+        self.colorBuffer.Release()
+        self.count=0
+
+#==============================================================================
+# RenderCylinderInstances(mats,rgbaTop,rgbaBody,rgbaBottom,slices,stacks)
+# Draw all glyphs with one instanced call through a shared streaming set
+# of instance buffers. Return False when instancing is not available, so
+# the caller can fall back to RenderCylinderGlyph.
+#==============================================================================
+_streamInstances=None
+
+def RenderCylinderInstances(mats,rgbaTop,rgbaBody,rgbaBottom,slices=20,stacks=2):
+    global _streamInstances
+    if not _GetGlyphProgram():
+        return False
+    if _streamInstances is None:
+        _streamInstances=CylinderInstances()
+    _streamInstances.SetMatrices(mats,GL_STREAM_DRAW)
+    _streamInstances.SetColors(rgbaTop,rgbaBody,rgbaBottom,GL_STREAM_DRAW)
+    return _streamInstances.Draw(slices,stacks)
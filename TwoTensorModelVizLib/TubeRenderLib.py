@@ -16,9 +16,15 @@ from OpenGL.GL import *
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
 
+import ctypes
+
 import numpy as np
 
 from PolyDataLib import *
+from GLBufferLib import *
+from LineRenderLib import *
+from ColorMapLib import CalBodyColors
+from DecimateLib import GetRenderFiberIndex
 
 #==============================================================================
 # crossProduct(a,b) 
@@ -32,496 +38,450 @@ def crossProduct(a,b):
     return c
 
 #==============================================================================
-# RenderTubeWithCustomColors(inpd,lineNum,params)
-# params: contains the required tube color and tube size information.
-# Here it shares the color settings with the cylinder body.
+# FiberFrames(tangents,normals,binormals)
+#    Orthonormal frames at every point of every line, stored in the order
+#    of FiberIndex.pointIds (the frame of line i at its k-th point is row
+#    offsets[i]+k). Tangents follow the segment to the next point, the
+#    last point of a line takes the tangent of its last segment.
 #==============================================================================
-def RenderTubeWithCustomColors(inpd,lineNum,params):
-    glShadeModel(GL_SMOOTH)
-    glEnable(GL_NORMALIZE)
-    slices=int(params['tubeSlices'])
-    
-    pidList = vtk.vtkIdList()
-    if lineNum>inpd.GetNumberOfLines:
-        lineNum=inpd.GetNumberOfLines
-        
-    inlines = inpd.GetLines()
-    inlines.InitTraversal();
-    for lidx in range(0,lineNum):
-        inlines.GetNextCell(pidList)
-     
-    if pidList.GetNumberOfIds() < 2:
-        return
-    
-    # obtain color infor
-    bodRArray=GetPointArrayByName(inpd,params['bodRName'])
-    bodGArray=GetPointArrayByName(inpd,params['bodGName'])
-    bodBArray=GetPointArrayByName(inpd,params['bodBName'])
-    bodAArray=GetPointArrayByName(inpd,params['bodAName'])
-    
-    bodRmin,bodRmax=GetMinMaxInArray(bodRArray)
-    bodGmin,bodGmax=GetMinMaxInArray(bodGArray)
-    bodBmin,bodBmax=GetMinMaxInArray(bodBArray)
-    bodAmin,bodAmax=GetMinMaxInArray(bodAArray)
-    
-    # obtain size info
-    sizeArray=GetPointArrayByName(inpd,params['tubeMappedToName'])
-    sizeMin,sizeMax=GetMinMaxInArray(sizeArray)
+class FiberFrames:
+    def __init__(self,tangents,normals,binormals):
+        self.tangents=tangents
+        self.normals=normals
+        self.binormals=binormals
+
+def _NormalizeRows(v):
+    norm=np.sqrt((v*v).sum(axis=1))
+    valid=norm>0
+    v[valid]/=norm[valid][:,np.newaxis]
+    return valid
+
+#==============================================================================
+# BuildFiberFrames(fiberIndex)
+#    Rotation-minimizing frames (double reflection method, Wang et al. 2008)
+#    of all lines. The first normal of a line is built from its first
+#    tangent and the z (or x) axis as before; then the frames of all lines
+#    are advanced one point at a time, so numpy works across lines and the
+#    Python loop only runs over the length of the longest line.
+#==============================================================================
+def BuildFiberFrames(fiberIndex):
+    offsets=fiberIndex.offsets
+    pos=fiberIndex.points[fiberIndex.pointIds].astype(np.float64)
+    num=pos.shape[0]
+    starts=offsets[:-1]
+    counts=offsets[1:]-starts
     
-    # Initial for the first point
-    # build the unitnormal for the first point
-    p0=GetPointPos(inpd,pidList.GetId(0))
-    p1=GetPointPos(inpd,pidList.GetId(1))
+    # tangents of the segments to the next point
+    tangents=np.zeros((num,3))
+    if num>1:
+        tangents[:-1]=pos[1:]-pos[:-1]
+    lasts=offsets[1:][counts>1]-1
+    tangents[lasts]=tangents[lasts-1]
+    valid=_NormalizeRows(tangents)
     
-    a = np.array(p1)-np.array(p0)
-    b = [0,0,1]
-    c = crossProduct(a,b);
-    if c[0]==0.0 and c[1]==0.0 and c[2]==0.0:
-       b = [1,0,0];
-       c = crossProduct(a,b);
+    # repeated points have no tangent, take the previous one of the line
+    if not valid.all():
+        idx=np.where(valid,np.arange(num),0)
+        np.maximum.accumulate(idx,out=idx)
+        lineStart=np.repeat(starts,counts)
+        fill=valid[idx]&(idx>=lineStart)
+        tangents[fill]=tangents[idx[fill]]
+        tangents[~fill&~valid]=[0.0,0.0,1.0]
     
-    b = crossProduct(c,a)
-    norm = np.linalg.norm(b)
-    if norm<>0:
-       b[0] = b[0]/ norm
-       b[1] = b[1]/ norm
-       b[2] = b[2]/ norm
+    normals=np.zeros((num,3))
+    used=counts>0
+    if used.any():
+        first=starts[used]
+        t0=tangents[first]
+        c=np.cross(t0,[0.0,0.0,1.0])
+        parallel=(c*c).sum(axis=1)<1e-24
+        c[parallel]=np.cross(t0[parallel],[1.0,0.0,0.0])
+        n0=np.cross(c,t0)
+        _NormalizeRows(n0)
+        normals[first]=n0
     
-    N0=b # unitnormal
-    T0=np.array(p1)-np.array(p0)
-    norm = np.linalg.norm(T0)
-    if norm<>0:
-       T0[0] = T0[0]/norm
-       T0[1] = T0[1]/norm
-       T0[2] = T0[2]/norm
-    B0=crossProduct(T0,N0)
+    # advance the lines, longest first, so the active ones are a prefix
+    order=np.argsort(-counts,kind='mergesort')
+    sortedStarts=starts[order]
+    sortedCounts=counts[order]
+    maxCount=int(sortedCounts[0]) if sortedCounts.shape[0]>0 else 0
+    active=sortedCounts.shape[0]
+    for k in range(1,maxCount):
+        while active>0 and sortedCounts[active-1]<=k:
+            active-=1
+        cur=sortedStarts[:active]+k
+        prev=cur-1
+        r=normals[prev]
+        t=tangents[prev]
+        
+        # reflection in the bisecting plane of the two points
+        v1=pos[cur]-pos[prev]
+        c1=(v1*v1).sum(axis=1)
+        c1[c1==0]=1.0
+        rL=r-(2.0*(v1*r).sum(axis=1)/c1)[:,np.newaxis]*v1
+        tL=t-(2.0*(v1*t).sum(axis=1)/c1)[:,np.newaxis]*v1
+        
+        # reflection taking the reflected tangent to the new tangent
+        v2=tangents[cur]-tL
+        c2=(v2*v2).sum(axis=1)
+        c2[c2==0]=1.0
+        rNext=rL-(2.0*(v2*rL).sum(axis=1)/c2)[:,np.newaxis]*v2
+        
+        # remove the rounding drift from the tangent
+        tc=tangents[cur]
+        rNext-=(rNext*tc).sum(axis=1)[:,np.newaxis]*tc
+        _NormalizeRows(rNext)
+        normals[cur]=rNext
     
-    for i in range(1,pidList.GetNumberOfIds()):
-        # cal the uninormal and binormal based on its tangent
-        if i==pidList.GetNumberOfIds()-1:
-            p0=GetPointPos(inpd,pidList.GetId(i-1))
-            p1=GetPointPos(inpd,pidList.GetId(i))
-        else:
-            p0=GetPointPos(inpd,pidList.GetId(i))
-            p1=GetPointPos(inpd,pidList.GetId(i+1))
-        T1=np.array(p1)-np.array(p0)
-        norm = np.linalg.norm(T1)
-        if norm<>0:
-           T1[0] = T1[0]/norm
-           T1[1] = T1[1]/norm
-           T1[2] = T1[2]/norm
-        
-        c=crossProduct(T0,N0)
-        N1=crossProduct(c,T0)
-        norm = np.linalg.norm(N1)
-        if norm<>0:
-           N1[0] = N1[0]/norm
-           N1[1] = N1[1]/norm
-           N1[2] = N1[2]/norm
-        
-        B1=crossProduct(T1,N1)            
-        
-        # cal outer-ring points 
-        p0=GetPointPos(inpd,pidList.GetId(i-1))
-        p1=GetPointPos(inpd,pidList.GetId(i))
+    binormals=np.cross(tangents,normals)
+    return FiberFrames(tangents,normals,binormals)
 
-        # determine the tube size
-        r0=0.0
-        r1=0.0
-        if params['tubeSizeFlag']==0:
-            r0=float(params['tubeFixedSize'])
-            r1=r0
-        else:
-            r0=sizeArray.GetComponent(pidList.GetId(i-1),0)
-            r1=sizeArray.GetComponent(pidList.GetId(i),0) 
-            r0=(r0-sizeMin)/(sizeMax-sizeMin)
-            r1=(r1-sizeMin)/(sizeMax-sizeMin)
-        
-        r0=r0*float(params['tubeScale'])
-        r1=r1*float(params['tubeScale'])
-        
-        # determine the tube color
-        rgbaBody=[0,0,0,255]
-        if params['bodRFlag']==0:
-            rgbaBody[0]=params['bodRValue']
-        else:
-            value=bodRArray.GetComponent(pidList.GetId(i),0)
-            rgbaBody[0]=255*(value-bodRmin)/(bodRmax-bodRmin)
-        
-        if params['bodGFlag']==0:
-            rgbaBody[1]=params['bodGValue']
-        else:
-            value=bodGArray.GetComponent(pidList.GetId(i),0)
-            rgbaBody[1]=255*(value-bodGmin)/(bodGmax-bodGmin)
-        
-        if params['bodBFlag']==0:
-            rgbaBody[2]=params['bodBValue']
-        else:
-            value=bodBArray.GetComponent(pidList.GetId(i),0)
-            rgbaBody[2]=255*(value-bodBmin)/(bodBmax-bodBmin)
-        
-        if params['bodAFlag']==0:
-            rgbaBody[3]=params['bodAValue']
-        else:
-            value=bodAArray.GetComponent(pidList.GetId(i),0)
-            rgbaBody[3]=255*(value-bodAmin)/(bodAmax-bodAmin)
-       
-        # Generate Textures
-        tex=glGenTextures(1)
-        ix=4
-        iy=4
-        image = bytearray(ix*iy*4)
-            
-        # Set texture for tube segment, no transparency
-        for i in range(0,ix):
-            for j in range(0,iy):
-                image[(i*ix+j)*4]=int(rgbaBody[0])
-                image[(i*ix+j)*4+1]=int(rgbaBody[1])
-                image[(i*ix+j)*4+2]=int(rgbaBody[2])
-                image[(i*ix+j)*4+3]=int(rgbaBody[3])
-            
-        glBindTexture(GL_TEXTURE_2D, tex)   
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, ix, iy, 0, GL_RGBA, GL_UNSIGNED_BYTE, image)
-        
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, tex)
-        
-        # Render a tube segment
-        glBegin(GL_QUAD_STRIP)
-        for k in range(0,slices+1):
-            s=2*np.pi*k/slices
-            x0 = p0[0] + r0*(np.cos(s)*N0[0] + np.sin(s)*B0[0]);
-            y0 = p0[1] + r0*(np.cos(s)*N0[1] + np.sin(s)*B0[1]);
-            z0 = p0[2] + r0*(np.cos(s)*N0[2] + np.sin(s)*B0[2]);
-            
-            x1 = p1[0] + r1*(np.cos(s)*N1[0] + np.sin(s)*B1[0]);
-            y1 = p1[1] + r1*(np.cos(s)*N1[1] + np.sin(s)*B1[1]);
-            z1 = p1[2] + r1*(np.cos(s)*N1[2] + np.sin(s)*B1[2]);
-            
-            glNormal3f(-(x0-p0[0]),-(y0-p0[1]),-(z0-p0[2]))
-            glTexCoord2f(0, 0)
-            glVertex3f(x0,y0,z0)
-            glNormal3f(-(x1-p1[0]),-(y1-p1[1]),-(z1-p1[2]))
-            glTexCoord2f(1, 1)
-            glVertex3f(x1,y1,z1)
-            
-        glEnd()
-        
-        glDisable(GL_TEXTURE_2D)
-        glDeleteTextures(tex)
-        
-        # proceed to the next segment
-        T0=T1
-        N0=N1
-        B0=B1
-        
-    return
+#==============================================================================
+# GetFiberFrames(fiberIndex)
+#    Return the FiberFrames of fiberIndex, built on first use. A new
+#    FiberIndex is built when the points change, which drops the frames.
+#==============================================================================
+def GetFiberFrames(fiberIndex):
+    frames=getattr(fiberIndex,'frames',None)
+    if frames is None:
+        frames=BuildFiberFrames(fiberIndex)
+        fiberIndex.frames=frames
+    return frames
 
 #==============================================================================
-# RenderTubeWithOrientation(inpd,lineNum,params)
-# params: contains the required tube size information.
-# tube color is determined by tube orientation.
+# GetRingTable(slices)
+#    cos and sin of the slices angles around a tube ring, computed once
+#    for each number of slices.
 #==============================================================================
-def RenderTubeWithOrientation(inpd,lineNum,params):
-    glShadeModel(GL_SMOOTH)
-    glEnable(GL_NORMALIZE)
-    slices=int(params['tubeSlices'])
+_ringTables={}
 
-    pidList = vtk.vtkIdList()
-    if lineNum>inpd.GetNumberOfLines:
-        lineNum=inpd.GetNumberOfLines
-        
-    inlines = inpd.GetLines()
-    inlines.InitTraversal();
-    for lidx in range(0,lineNum):
-        inlines.GetNextCell(pidList)
-     
-    if pidList.GetNumberOfIds() < 2:
-        return
-    
-    # get tube size info.
-    sizeArray=GetPointArrayByName(inpd,params['tubeMappedToName'])
-    sizeMin,sizeMax=GetMinMaxInArray(sizeArray)
-    
-    # Initial for the first point
-    p0=GetPointPos(inpd,pidList.GetId(0))
-    p1=GetPointPos(inpd,pidList.GetId(1))
-    
-    a = np.array(p1)-np.array(p0)
-    b = [0,0,1]
-    c = crossProduct(a,b);
-    if c[0]==0.0 and c[1]==0.0 and c[2]==0.0:
-       b = [1,0,0];
-       c = crossProduct(a,b);
-    
-    b = crossProduct(c,a)
-    norm = np.linalg.norm(b)
-    if norm<>0:
-       b[0] = b[0]/ norm
-       b[1] = b[1]/ norm
-       b[2] = b[2]/ norm
-    
-    N0=b 
-    T0=np.array(p1)-np.array(p0)
-    norm = np.linalg.norm(T0)
-    if norm<>0:
-       T0[0] = T0[0]/norm
-       T0[1] = T0[1]/norm
-       T0[2] = T0[2]/norm
-    B0=crossProduct(T0,N0)
-    
-    for i in range(1,pidList.GetNumberOfIds()):
-        # calculate unitnormal and binormal based on the tangent
-        if i==pidList.GetNumberOfIds()-1:
-            p0=GetPointPos(inpd,pidList.GetId(i-1))
-            p1=GetPointPos(inpd,pidList.GetId(i))
-        else:
-            p0=GetPointPos(inpd,pidList.GetId(i))
-            p1=GetPointPos(inpd,pidList.GetId(i+1))
-            
-        T1=np.array(p1)-np.array(p0)
-        norm = np.linalg.norm(T1)
-        if norm<>0:
-           T1[0] = T1[0]/norm
-           T1[1] = T1[1]/norm
-           T1[2] = T1[2]/norm
-        
-        c=crossProduct(T0,N0)
-        N1=crossProduct(c,T0)
-        norm = np.linalg.norm(N1)
-        if norm<>0:
-           N1[0] = N1[0]/norm
-           N1[1] = N1[1]/norm
-           N1[2] = N1[2]/norm
-        
-        B1=crossProduct(T1,N1)            
-        
-        #Calculate outer-ring points to draw a tube segment
-        p0=GetPointPos(inpd,pidList.GetId(i-1))
-        p1=GetPointPos(inpd,pidList.GetId(i))
+def GetRingTable(slices):
+    if slices not in _ringTables:
+        s=2*np.pi*np.arange(slices)/slices
+        _ringTables[slices]=(np.cos(s),np.sin(s))
+    return _ringTables[slices]
 
-        # determine the tube size
-        r0=0.0
-        r1=0.0
-        if params['tubeSizeFlag']==0:
-            r0=float(params['tubeFixedSize'])
-            r1=r0
-        else:
-            r0=sizeArray.GetComponent(pidList.GetId(i-1),0)
-            r1=sizeArray.GetComponent(pidList.GetId(i),0) 
-            r0=(r0-sizeMin)/(sizeMax-sizeMin)
-            r1=(r1-sizeMin)/(sizeMax-sizeMin)
-        
-        r0=r0*float(params['tubeScale'])
-        r1=r1*float(params['tubeScale'])
-        
-        # get tube color
-        color=np.array(p1)-np.array(p0)
-        norm=np.linalg.norm(color)
-        color=np.fabs(color/norm)
-        
-        # Generate Textures
-        tex=glGenTextures(1)
-        ix=4
-        iy=4
-        image = bytearray(ix*iy*4)
-            
-        # Set texture for tube segment, no transparency
-        for i in range(0,ix):
-            for j in range(0,iy):
-                image[(i*ix+j)*4]=int(color[0]*255)
-                image[(i*ix+j)*4+1]=int(color[1]*255)
-                image[(i*ix+j)*4+2]=int(color[2]*255)
-                image[(i*ix+j)*4+3]=255
-            
-        glBindTexture(GL_TEXTURE_2D, tex)   
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, ix, iy, 0, GL_RGBA, GL_UNSIGNED_BYTE, image)
-        
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, tex)
+#==============================================================================
+# GetTubeRadii(inpd,params,pids)
+#    Tube radius at the points pids: tubeFixedSize, or tubeMappedToName
+#    mapped linearly from its range to 0..1, times tubeScale.
+#==============================================================================
+def GetTubeRadii(inpd,params,pids):
+    if params['tubeSizeFlag']==0:
+        radii=np.empty(pids.shape[0])
+        radii[:]=float(params['tubeFixedSize'])
+    else:
+        sizeArray=GetPointArrayByName(inpd,params['tubeMappedToName'])
+        sizeMin,sizeMax=GetMinMaxInArray(sizeArray)
+        values=GetArrayRegistry(inpd).GetPointValues(params['tubeMappedToName'])
+        span=sizeMax-sizeMin
+        if span==0:
+            span=1.0
+        radii=(values[pids]-sizeMin)/span
+    return radii*float(params['tubeScale'])
 
-        # Render a tube segment
-        glBegin(GL_QUAD_STRIP)
-        for k in range(0,slices+1):
-            s=2*np.pi*k/slices
-            x0 = p0[0] + r0*(np.cos(s)*N0[0] + np.sin(s)*B0[0]);
-            y0 = p0[1] + r0*(np.cos(s)*N0[1] + np.sin(s)*B0[1]);
-            z0 = p0[2] + r0*(np.cos(s)*N0[2] + np.sin(s)*B0[2]);
-            
-            x1 = p1[0] + r1*(np.cos(s)*N1[0] + np.sin(s)*B1[0]);
-            y1 = p1[1] + r1*(np.cos(s)*N1[1] + np.sin(s)*B1[1]);
-            z1 = p1[2] + r1*(np.cos(s)*N1[2] + np.sin(s)*B1[2]);
-            
-            glNormal3f(-(x0-p0[0]),-(y0-p0[1]),-(z0-p0[2]))
-            glTexCoord2f(0, 0)
-            glVertex3f(x0,y0,z0)
-            glNormal3f(-(x1-p1[0]),-(y1-p1[1]),-(z1-p1[2]))
-            glTexCoord2f(1, 1)
-            glVertex3f(x1,y1,z1)
-            
-        glEnd()
-        
-        glDisable(GL_TEXTURE_2D)
-        glDeleteTextures(tex)
-        
-        # proceed to the next segment
-        T0=T1
-        N0=N1
-        B0=B1
-        
-    return
 #==============================================================================
-# RenderTubeWithFixedColor(inpd,lineNum,params)
-# params: contains the fixed color without alpha information
+# TubeMesh
+#    vertices, normals: (numRings*slices,3) float32, ring j holds the
+#    vertices slices*j..slices*(j+1)-1, two rings per point (see
+#    GetTubeRingColorIndex). Normals point to the tube axis as the
+#    immediate mode tubes did.
+#    indices: uint32 triangle strip; segment j (between two consecutive
+#    points of a line) takes indices[j*segmentSize:(j+1)*segmentSize]. The
+#    last 2 indices of a segment are degenerate ones joining it to the next
+#    segment, so indices[:-2] draws the whole mesh in one strip.
+#    colors: (numRings*slices,4) uint8 or None
+#    colorIndex: the point color (see CalTubeColors) each ring takes
 #==============================================================================
-def RenderTubeWithFixedColor(inpd,lineNum,params):
+class TubeMesh:
+    def __init__(self,vertices,normals,indices,slices,colors=None,colorIndex=None):
+        self.vertices=vertices
+        self.normals=normals
+        self.indices=indices
+        self.slices=slices
+        self.colors=colors
+        self.colorIndex=colorIndex
+        self.segmentSize=2*(slices+1)+2
     
-    glShadeModel(GL_SMOOTH)
-    glEnable(GL_NORMALIZE)
+    def GetNumberOfSegments(self):
+        return self.indices.shape[0]//self.segmentSize
     
-    slices=int(params['tubeSlices'])
+    def GetSegmentIndices(self,segment):
+        start=segment*self.segmentSize
+        return self.indices[start:start+self.segmentSize-2]
     
-    pidList = vtk.vtkIdList()
-    if lineNum>inpd.GetNumberOfLines:
-        lineNum=inpd.GetNumberOfLines
-        
-    inlines = inpd.GetLines()
-    inlines.InitTraversal();
-    for lidx in range(0,lineNum):
-        inlines.GetNextCell(pidList)
-     
-    if pidList.GetNumberOfIds() < 2:
-        return
+    def GetStripIndices(self):
+        return self.indices[:-2]
+
+#==============================================================================
+# BuildTubeMesh(positions,normals,binormals,radii,counts,slices,colors=None)
+#    positions, normals, binormals: (M,3) points and frames of the lines,
+#    one line after another; radii: (M,); counts: number of points of each
+#    line; colors: optional (M,4) colors of the points, as CalTubeColors
+#    gives them.
+#    Every point gets two copies of its ring of slices vertices, one for
+#    the segment before it and one for the segment after it, so each
+#    segment is drawn in one flat color.
+#==============================================================================
+def BuildTubeMesh(positions,normals,binormals,radii,counts,slices,colors=None):
+    vertices,ringNormals=BuildTubeRings(positions,normals,binormals,radii,slices)
+    indices=BuildTubeIndices(counts,slices)
+    colorIndex=GetTubeRingColorIndex(counts)
+    if colors is not None:
+        colors=GetTubeVertexColors(colors,colorIndex,slices)
+    return TubeMesh(vertices,ringNormals,indices,slices,colors,colorIndex)
+
+#==============================================================================
+# GetTubeRingColorIndex(counts)
+#    Point i of lines with counts points has rings 2i and 2i+1 in a
+#    TubeMesh: ring 2i starts the segment leaving the point, ring 2i+1 ends
+#    the segment arriving at it. Return the point whose color each ring
+#    takes, the end point of its segment, so both rings of a segment have
+#    the color that segment had with a texture.
+# GetTubeVertexColors(colors,colorIndex,slices)
+#    The vertex colors of a TubeMesh from the colors of its points.
+#==============================================================================
+def GetTubeRingColorIndex(counts):
+    counts=np.asarray(counts,dtype=np.int64)
+    num=int(counts.sum())
+    following=np.arange(1,num+1)
+    ends=np.cumsum(counts)
+    # no segment leaves the last point of a line
+    following[ends[counts>0]-1]-=1
+    colorIndex=np.empty(2*num,dtype=np.int64)
+    colorIndex[0::2]=following
+    colorIndex[1::2]=np.arange(num)
+    return colorIndex
+
+def GetTubeVertexColors(colors,colorIndex,slices):
+    return np.repeat(np.asarray(colors,dtype=np.uint8)[colorIndex],slices,axis=0)
+
+#==============================================================================
+# BuildTubeRings(positions,normals,binormals,radii,slices)
+#    Vertices and normals, (2*M*slices,3) float32, of the two rings of each
+#    point of a TubeMesh. Every ring depends only on its own point, so the
+#    rings of any range of points can be built separately.
+#==============================================================================
+def BuildTubeRings(positions,normals,binormals,radii,slices):
+    cosTable,sinTable=GetRingTable(slices)
     
-    # Get the tube size
-    sizeArray=GetPointArrayByName(inpd,params['tubeMappedToName'])
-    sizeMin,sizeMax=GetMinMaxInArray(sizeArray)
+    # ring directions, (M,slices,3)
+    directions=cosTable[np.newaxis,:,np.newaxis]*normals[:,np.newaxis,:]+ \
+               sinTable[np.newaxis,:,np.newaxis]*binormals[:,np.newaxis,:]
+    vertices=positions[:,np.newaxis,:]+radii[:,np.newaxis,np.newaxis]*directions
+    vertices=np.repeat(vertices.astype(np.float32),2,axis=0).reshape(-1,3)
+    ringNormals=np.repeat((-directions).astype(np.float32),2,axis=0).reshape(-1,3)
+    return vertices,ringNormals
+
+#==============================================================================
+# BuildTubeIndices(counts,slices)
+#    Triangle strip indices of a TubeMesh of lines with counts points.
+#==============================================================================
+def BuildTubeIndices(counts,slices):
+    # a segment starts at every point but the last one of its line
+    counts=np.asarray(counts,dtype=np.int64)
+    ends=np.cumsum(counts)
+    starts=np.ones(int(counts.sum()),dtype=bool)
+    starts[ends[counts>0]-1]=False
+    segments=np.nonzero(starts)[0]
     
-    # Get the fixed color
-    qColor=params['tubeFixedColor']
+    # strip of one segment from point i to i+1: ring 2i and ring 2i+3
+    # around the tube, then the degenerate indices to the next segment
+    k=np.arange(slices+1)%slices
+    strip=np.empty(2*(slices+1),dtype=np.int64)
+    strip[0::2]=k
+    strip[1::2]=k+3*slices
+    template=np.concatenate([strip,[strip[-1]],[strip[0]]])
+    indices=segments[:,np.newaxis]*(2*slices)+template[np.newaxis,:]
+    return JoinTubeSegments(indices).reshape(-1).astype(np.uint32)
+
+#==============================================================================
+# JoinTubeSegments(segmentIndices)
+#    segmentIndices: (S,segmentSize) strip indices of some segments of a
+#    TubeMesh, in the order they are drawn. Point the degenerate index of
+#    each segment to the start of the one after it, so any subset of the
+#    segments of a mesh is drawn as one strip.
+#==============================================================================
+def JoinTubeSegments(segmentIndices):
+    if segmentIndices.shape[0]>0:
+        segmentIndices[:-1,-1]=segmentIndices[1:,0]
+        segmentIndices[-1,-1]=segmentIndices[-1,-2]
+    return segmentIndices
 
-    # Generate Textures
-    tex=glGenTextures(1)
-    ix=4
-    iy=4
-    image = bytearray(ix*iy*4)
-    # Set texture for tube segment, no transparency
-    for i in range(0,ix):
-        for j in range(0,iy):
-            image[(i*ix+j)*4]=qColor.red()
-            image[(i*ix+j)*4+1]=qColor.green()
-            image[(i*ix+j)*4+2]=qColor.blue()
-            image[(i*ix+j)*4+3]=qColor.alpha()
+#==============================================================================
+# CalTubeColors(inpd,params,rows,counts,fiberIndex=None)
+#    (M,4) uint8 colors of the tube rings at the points rows of fiberIndex
+#    (counts points per line; by default the FiberIndex of inpd), by
+#    tubeColorFlag:
+#    0 fixed tubeFixedColor, 1 orientation of the segment, 2 the bod*
+#    colors of the glyph bodies.
+#    Point i has the color of the segment ending at it, the first point of
+#    a line that of the first segment; the tube segments take the color of
+#    their end point (see GetTubeRingColorIndex).
+#==============================================================================
+def CalTubeColors(inpd,params,rows,counts,fiberIndex=None):
+    if fiberIndex is None:
+        fiberIndex=GetFiberIndex(inpd)
+    tubeColorFlag=params['tubeColorFlag']
     
-    glBindTexture(GL_TEXTURE_2D, tex)   
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, ix, iy, 0, GL_RGBA, GL_UNSIGNED_BYTE, image)
+    if tubeColorFlag==0:
+        qColor=params['tubeFixedColor']
+        colors=np.empty((rows.shape[0],4),dtype=np.uint8)
+        colors[:]=[qColor.red(),qColor.green(),qColor.blue(),qColor.alpha()]
+        return colors
     
-    glEnable(GL_TEXTURE_2D)
-    glBindTexture(GL_TEXTURE_2D, tex)
+    pids=fiberIndex.pointIds[rows]
+    if tubeColorFlag==1:
+        return CalSegmentColors(fiberIndex.points[pids],counts)
     
-    # Initial for the first point
-    p0=GetPointPos(inpd,pidList.GetId(0))
-    p1=GetPointPos(inpd,pidList.GetId(1))
+    return CalBodyColors(inpd,params,pids[GetSegmentEndIndex(counts)])
+
+#==============================================================================
+# BuildTubes(inpd,lineNums,params)
+#    Colored TubeMesh of all lines in lineNums, or None if there is no
+#    segment to draw. The lines are simplified within decimateTolerance.
+#==============================================================================
+def BuildTubes(inpd,lineNums,params):
+    fiberIndex=GetRenderFiberIndex(inpd,params)
+    rows,counts=fiberIndex.GetLineRows(lineNums)
+    if not (counts>1).any():
+        return None
+    frames=GetFiberFrames(fiberIndex)
+    pids=fiberIndex.pointIds[rows]
+    radii=GetTubeRadii(inpd,params,pids)
+    colors=CalTubeColors(inpd,params,rows,counts,fiberIndex)
+    return BuildTubeMesh(fiberIndex.points[pids],frames.normals[rows], \
+        frames.binormals[rows],radii,counts,int(params['tubeSlices']),colors)
+
+#==============================================================================
+# DrawTubeMesh(mesh,indices)
+#    Draw indices of mesh as a triangle strip from client side arrays. The
+#    vertex colors feed the lit material through GL_COLOR_MATERIAL.
+#==============================================================================
+def DrawTubeMesh(mesh,indices):
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_NORMAL_ARRAY)
+    glVertexPointer(3,GL_FLOAT,0,mesh.vertices)
+    glNormalPointer(GL_FLOAT,0,mesh.normals)
+    if mesh.colors is not None:
+        glEnable(GL_COLOR_MATERIAL)
+        glColorMaterial(GL_FRONT_AND_BACK,GL_AMBIENT_AND_DIFFUSE)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glColorPointer(4,GL_UNSIGNED_BYTE,0,mesh.colors)
+    glDrawElements(GL_TRIANGLE_STRIP,indices.shape[0],GL_UNSIGNED_INT,indices)
+    if mesh.colors is not None:
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisable(GL_COLOR_MATERIAL)
+    glDisableClientState(GL_NORMAL_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+
+#==============================================================================
+# TubeBuffers()
+#    A TubeMesh in buffer objects: interleaved positions and normals, the
+#    vertex colors and the strip indices. The colors can be replaced without
+#    touching the geometry.
+#==============================================================================
+class TubeBuffers:
+    def __init__(self):
+        self.vertexBuffer=VertexBuffer()
+        self.colorBuffer=VertexBuffer()
+        self.indexBuffer=VertexBuffer(GL_ELEMENT_ARRAY_BUFFER)
+        self.slices=0
+        self.colorIndex=None
+        self.count=0
     
-    a = np.array(p1)-np.array(p0)
-    b = [0,0,1]
-    c = crossProduct(a,b);
-    if c[0]==0.0 and c[1]==0.0 and c[2]==0.0:
-       b = [1,0,0];
-       c = crossProduct(a,b);
+    def SetMesh(self,mesh,usage=GL_STATIC_DRAW):
+        self.vertexBuffer.Upload(np.hstack((mesh.vertices,mesh.normals)),usage)
+        indices=mesh.GetStripIndices()
+        self.indexBuffer.Upload(indices,usage)
+        self.slices=mesh.slices
+        self.colorIndex=mesh.colorIndex
+        self.count=indices.shape[0]
+        if mesh.colors is not None:
+            self.colorBuffer.Upload(mesh.colors,usage)
     
-    b = crossProduct(c,a)
-    norm = np.linalg.norm(b)
-    if norm<>0:
-       b[0] = b[0]/ norm
-       b[1] = b[1]/ norm
-       b[2] = b[2]/ norm
+    def SetStripIndices(self,indices,usage=GL_STATIC_DRAW):
+        # draw other segments of the same mesh
+        self.indexBuffer.Upload(np.asarray(indices,dtype=np.uint32),usage)
+        self.count=indices.shape[0]
     
-    N0=b 
-    T0=np.array(p1)-np.array(p0)
-    norm = np.linalg.norm(T0)
-    if norm<>0:
-       T0[0] = T0[0]/norm
-       T0[1] = T0[1]/norm
-       T0[2] = T0[2]/norm
-    B0=crossProduct(T0,N0)
+    def SetRingColors(self,colors,usage=GL_STATIC_DRAW):
+        # one color per point, as CalTubeColors gives them
+        self.colorBuffer.Upload(GetTubeVertexColors(colors,self.colorIndex, \
+            self.slices),usage)
     
-    for i in range(1,pidList.GetNumberOfIds()):
-        # Cal unitnormal and binormal based on the tangent
-        if i==pidList.GetNumberOfIds()-1:
-            p0=GetPointPos(inpd,pidList.GetId(i-1))
-            p1=GetPointPos(inpd,pidList.GetId(i))
-        else:
-            p0=GetPointPos(inpd,pidList.GetId(i))
-            p1=GetPointPos(inpd,pidList.GetId(i+1))
-        T1=np.array(p1)-np.array(p0)
-        norm = np.linalg.norm(T1)
-        if norm<>0:
-           T1[0] = T1[0]/norm
-           T1[1] = T1[1]/norm
-           T1[2] = T1[2]/norm
-        
-        c=crossProduct(T0,N0)
-        N1=crossProduct(c,T0)
-        norm = np.linalg.norm(N1)
-        if norm<>0:
-           N1[0] = N1[0]/norm
-           N1[1] = N1[1]/norm
-           N1[2] = N1[2]/norm
-        
-        B1=crossProduct(T1,N1)            
-        
-        # To get outer-ring points
-        p0=GetPointPos(inpd,pidList.GetId(i-1))
-        p1=GetPointPos(inpd,pidList.GetId(i))
-        
-        # To get tube size
-        r0=0.0
-        r1=0.0
-        if params['tubeSizeFlag']==0:
-            r0=float(params['tubeFixedSize'])
-            r1=r0
-        else:
-            r0=sizeArray.GetComponent(pidList.GetId(i-1),0)
-            r1=sizeArray.GetComponent(pidList.GetId(i),0) 
-            r0=(r0-sizeMin)/(sizeMax-sizeMin)
-            r1=(r1-sizeMin)/(sizeMax-sizeMin)
-        
-        r0=r0*float(params['tubeScale'])
-        r1=r1*float(params['tubeScale'])
-                
-        # Render a tube segment
-        glBegin(GL_QUAD_STRIP)
-        for k in range(0,slices+1):
-            s=2*np.pi*k/slices
-            x0 = p0[0] + r0*(np.cos(s)*N0[0] + np.sin(s)*B0[0]);
-            y0 = p0[1] + r0*(np.cos(s)*N0[1] + np.sin(s)*B0[1]);
-            z0 = p0[2] + r0*(np.cos(s)*N0[2] + np.sin(s)*B0[2]);
-            
-            x1 = p1[0] + r1*(np.cos(s)*N1[0] + np.sin(s)*B1[0]);
-            y1 = p1[1] + r1*(np.cos(s)*N1[1] + np.sin(s)*B1[1]);
-            z1 = p1[2] + r1*(np.cos(s)*N1[2] + np.sin(s)*B1[2]);
-            
-            glNormal3f(-(x0-p0[0]),-(y0-p0[1]),-(z0-p0[2]))
-            glTexCoord2f(0, 0)
-            glVertex3f(x0,y0,z0)
-            glNormal3f(-(x1-p1[0]),-(y1-p1[1]),-(z1-p1[2]))
-            glTexCoord2f(1, 1)
-            glVertex3f(x1,y1,z1)
-            
-        glEnd()
-        
-        # proceed to the next segment
-        T0=T1
-        N0=N1
-        B0=B1
+    def Draw(self):
+        if self.count==0:
+            return
+        glShadeModel(GL_SMOOTH)
+        glEnable(GL_NORMALIZE)
+        glEnable(GL_COLOR_MATERIAL)
+        glColorMaterial(GL_FRONT_AND_BACK,GL_AMBIENT_AND_DIFFUSE)
+        
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        self.vertexBuffer.Bind()
+        glVertexPointer(3,GL_FLOAT,24,ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT,24,ctypes.c_void_p(12))
+        self.colorBuffer.Bind()
+        glColorPointer(4,GL_UNSIGNED_BYTE,0,ctypes.c_void_p(0))
+        self.colorBuffer.Unbind()
+        self.indexBuffer.Bind()
+        glDrawElements(GL_TRIANGLE_STRIP,self.count,GL_UNSIGNED_INT,None)
+        self.indexBuffer.Unbind()
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        
+        glDisable(GL_COLOR_MATERIAL)
     
-    glEnable(GL_TEXTURE_2D)   
-    glDeleteTextures(tex)
+    def Release(self):
+        self.vertexBuffer.Release()
+        self.colorBuffer.Release()
+        self.indexBuffer.Release()
+        self.count=0
+
+#==============================================================================
+# RenderTubes(inpd,lineNums,params)
+#    Draw the tubes of all lines in lineNums with one draw call, colored by
+#    tubeColorFlag.
+#==============================================================================
+def RenderTubes(inpd,lineNums,params):
+    glShadeModel(GL_SMOOTH)
+    glEnable(GL_NORMALIZE)
+    mesh=BuildTubes(inpd,lineNums,params)
+    if mesh is not None:
+        DrawTubeMesh(mesh,mesh.GetStripIndices())
+    return
+
+def _RenderTubeWithColorFlag(inpd,lineNum,params,tubeColorFlag):
+    params=dict(params)
+    params['tubeColorFlag']=tubeColorFlag
+    RenderTubes(inpd,[lineNum],params)
+
+#==============================================================================
+# RenderTubeWithCustomColors(inpd,lineNum,params)
+# params: contains the required tube color and tube size information.
+# Here it shares the color settings with the cylinder body.
+#==============================================================================
+def RenderTubeWithCustomColors(inpd,lineNum,params):
+    _RenderTubeWithColorFlag(inpd,lineNum,params,2)
+    return
+
+#==============================================================================
+# RenderTubeWithOrientation(inpd,lineNum,params)
+# params: contains the required tube size information.
+# tube color is determined by tube orientation.
+#==============================================================================
+def RenderTubeWithOrientation(inpd,lineNum,params):
+    _RenderTubeWithColorFlag(inpd,lineNum,params,1)
+    return
+
+#==============================================================================
+# RenderTubeWithFixedColor(inpd,lineNum,params)
+# params: contains the fixed color without alpha information
+#==============================================================================
+def RenderTubeWithFixedColor(inpd,lineNum,params):
+    _RenderTubeWithColorFlag(inpd,lineNum,params,0)
     return
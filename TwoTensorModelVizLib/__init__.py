@@ -28,4 +28,4 @@ sys.path.append('.\TwoTensorModelVizLib\Dlls')
 
 print "PyOpenGL and vtkPyOpenGLActor have been enabled!"
 
-__all__=["PolyDataLib","LineRenderLib","TensorRenderLib","TubeRenderLib"]
\ No newline at end of file
+__all__=["PolyDataLib","PolyDataFileLib","SidecarCacheLib","BundleLib","TensorLib","GLBufferLib","LineRenderLib","ColorMapLib","TensorRenderLib","TubeRenderLib","DecimateLib","SpatialIndexLib","PickLib","BuilderLib","ParallelBuildLib","SceneLib"]
\ No newline at end of file